@@ -1,18 +1,22 @@
 import sys
 import os
+import json
 import logging
+import threading
+import time
 
 # Add parent directory to path to import quantum_lib
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import quantum_lib
 import numpy as np
-import quantum_lib
-import numpy as np
-from google import genai
 from dotenv import load_dotenv
+from export import check_options, encode_state
+from gemini import QasmGenerator, ResponseCache
+from jobs import JobQueue, QueueFull
+import metrics
 
 load_dotenv() # Load environment variables from .env file, overriding system envs
 
@@ -23,116 +27,617 @@ CORS(app)  # Enable CORS for all routes
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on the size of programs accepted by /simulate/qasm
+MAX_QASM_OPERATIONS = int(os.environ.get("MAX_QASM_OPERATIONS", 1_000_000))
+
+# Background simulations (see /jobs routes)
+job_queue = JobQueue(
+    workers=int(os.environ.get("JOB_WORKERS", 2)),
+    max_queued=int(os.environ.get("JOB_QUEUE_SIZE", 32)),
+)
+
+# Admission control: requests are priced with the cost model before anything
+# is allocated. Run `python backend/calibrate_cost_model.py` on the host to
+# replace the built-in coefficients with locally measured ones.
+COST_MODEL_PATH = os.environ.get(
+    "COST_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cost_model.json")
+)
+cost_model = (quantum_lib.CostModel.load(COST_MODEL_PATH) if os.path.exists(COST_MODEL_PATH)
+              else quantum_lib.CostModel())
+MAX_PEAK_BYTES = int(os.environ.get("MAX_PEAK_BYTES", 2 * 2**30))
+MAX_SYNC_SECONDS = float(os.environ.get("MAX_SYNC_SECONDS", 20))
+MAX_JOB_SECONDS = float(os.environ.get("MAX_JOB_SECONDS", 3600))
+
+# /generate_qasm client and response cache, see _qasm_generator
+qasm_generator = None
+_qasm_generator_lock = threading.Lock()
+
+# Statevector checkpoints shared by all requests in this worker, so re-running
+# an edited circuit only simulates the operations after the edit. With
+# CHECKPOINT_DIR set they are also written there, shared by every worker and
+# kept across restarts.
+checkpoints = quantum_lib.CheckpointCache(
+    max_bytes=int(os.environ.get("CHECKPOINT_CACHE_BYTES", 256 * 2**20)),
+    disk=quantum_lib.DiskCheckpointCache(
+        os.environ["CHECKPOINT_DIR"],
+        max_bytes=int(os.environ.get("CHECKPOINT_DISK_BYTES", 8 * 2**30)),
+        min_bytes=int(os.environ.get("CHECKPOINT_DISK_MIN_BYTES", 16 * 2**20)),
+        interval=float(os.environ.get("CHECKPOINT_DISK_INTERVAL", 0)),
+        verify=os.environ.get("CHECKPOINT_DISK_VERIFY", "0") == "1",
+    ) if os.environ.get("CHECKPOINT_DIR") else None,
+)
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    # Streaming responses are timed to the start of the stream
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe_request(route, request.method, response.status_code,
+                            time.perf_counter() - g.get('request_start', time.perf_counter()),
+                            g.get('error_type'))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+def _build_circuit(data, auto_measure=True):
+    """
+    Validates a /simulate style request body and builds the circuit.
+    Returns (circuit, shots); raises ValueError with a client-facing message.
+    """
+    if not data:
+        raise ValueError("Invalid JSON")
+
+    num_qubits = data.get('num_qubits')
+    operations = data.get('operations')
+    shots = data.get('shots', 1024)
+
+    if not num_qubits or not isinstance(num_qubits, int):
+        raise ValueError("num_qubits must be an integer > 0")
+    if not operations or not isinstance(operations, list):
+        raise ValueError("operations must be a list of gate objects")
+    if not isinstance(shots, int) or shots < 0:
+        raise ValueError("shots must be a non-negative integer (0 for exact probabilities)")
+
+    # Initialize circuit
+    circuit = quantum_lib.QuantumCircuit(num_qubits)
+
+    # Apply operations
+    for op in operations:
+        gate_type = op.get('type')
+        if not gate_type:
+            continue
+
+        gate_type = gate_type.lower()
+
+        try:
+            if gate_type == 'h':
+                circuit.h(op['qubit'])
+            elif gate_type == 'x':
+                circuit.x(op['qubit'])
+            elif gate_type == 'y':
+                circuit.y(op['qubit'])
+            elif gate_type == 'z':
+                circuit.z(op['qubit'])
+            elif gate_type == 't':
+                circuit.t(op['qubit'])
+            elif gate_type == 's':
+                circuit.s(op['qubit'])
+            elif gate_type == 'rx':
+                circuit.rx(op['qubit'], op.get('theta', 0.0))
+            elif gate_type == 'ry':
+                circuit.ry(op['qubit'], op.get('theta', 0.0))
+            elif gate_type == 'rz':
+                circuit.rz(op['qubit'], op.get('theta', 0.0))
+            elif gate_type == 'phase':
+                circuit.phase(op['qubit'], op.get('theta', 0.0))
+            elif gate_type == 'cx':
+                circuit.cx(op['control'], op['target'])
+            elif gate_type == 'cz':
+                circuit.cz(op['control'], op['target'])
+            elif gate_type == 'cp':
+                circuit.cp(op['control'], op['target'], op.get('theta', 0.0))
+            elif gate_type == 'swap':
+                circuit.swap(op['qubit1'], op['qubit2'])
+            elif gate_type == 'measure':
+                 # Explicit measurement
+                 # Backend expects (qubit, cbit)
+                 # We map q -> cbit (same index for simplicity in this API version unless specified)
+                 q = op['qubit']
+                 c = op.get('cbit', q) 
+                 circuit.measure(q, c)
+            elif gate_type == 'custom':
+                # Custom gate: expects 'matrix' (2^k x 2^k list) and 'qubit'
+                # or a list of k 'qubits' (bit j of the matrix index is qubits[j])
+                matrix = op.get('matrix')
+                if not matrix:
+                    raise ValueError("Custom gate requires 'matrix'")
+
+                circuit.custom(op['qubits'] if 'qubits' in op else op['qubit'], np.array(matrix))
+
+            else:
+                logger.warning(f"Unknown gate type: {gate_type}")
+        except KeyError as e:
+            raise ValueError(f"Missing parameter for gate {gate_type}: {str(e)}")
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error applying gate {gate_type}: {str(e)}")
+
+    # Auto-measure ALL qubits IF AND ONLY IF no explicit measurements exist
+    if auto_measure and not circuit.measurements:
+        for i in range(num_qubits):
+            circuit.measure(i, i)
+
+    quantum_lib._check_qubits(circuit)
+    return circuit, shots
+
+
+class AdmissionError(Exception):
+    pass
+
+def _admit(circuit, shots, max_seconds=float('inf'), exact=False, method='statevector'):
+    """
+    Prices the run with the cost model and raises AdmissionError if it would
+    exceed MAX_PEAK_BYTES or max_seconds. Returns the estimate. exact prices
+    an exact-probabilities run (shots=0) instead of sampling, and method the
+    Simulator backend.
+    """
+    estimate = cost_model.estimate(circuit, shots, exact=exact, method=method)
+    if estimate['path'] == 'unsupported':
+        raise AdmissionError(
+            f"Circuit acts on {circuit.num_qubits} qubits; at most "
+            f"{cost_model.MAX_QUBITS} can be simulated"
+        )
+    if estimate['peak_bytes'] > MAX_PEAK_BYTES:
+        raise AdmissionError(
+            f"Circuit needs an estimated {estimate['peak_bytes'] / 2**20:.0f} MiB of memory "
+            f"for {circuit.num_qubits} qubits; the limit is {MAX_PEAK_BYTES / 2**20:.0f} MiB"
+        )
+    if estimate['seconds'] > max_seconds:
+        raise AdmissionError(
+            f"Circuit would take an estimated {estimate['seconds']:.0f}s to simulate; "
+            f"the limit is {max_seconds:.0f}s"
+        )
+    return estimate
+
+def _max_shots_within(circuit, seconds, method='statevector'):
+    """
+    Largest shot count whose estimated runtime fits in `seconds` (0 if none).
+    """
+    base = cost_model.estimate(circuit, 0, method=method)['seconds']
+    per_shot = cost_model.estimate(circuit, 1, method=method)['seconds'] - base
+    if base > seconds:
+        return 0
+    if per_shot <= 0:
+        return 2**31
+    return int((seconds - base) / per_shot)
+
+def _run_options(source, query=False):
+    """
+    (method, top_k, threshold) of a run request from a JSON body or, with
+    query=True, from the query parameters: the Simulator backend and the
+    exact-probabilities cuts. Raises ValueError.
+    """
+    method = source.get('method', 'statevector')
+    if query:
+        top_k = source.get('top_k', type=int)
+        threshold = source.get('threshold', 0.0, type=float)
+    else:
+        top_k = source.get('top_k')
+        threshold = source.get('threshold', 0.0)
+    if method not in quantum_lib.Simulator.METHODS:
+        raise ValueError(f"method must be one of {', '.join(quantum_lib.Simulator.METHODS)}")
+    if top_k is not None and (not isinstance(top_k, int) or top_k <= 0):
+        raise ValueError("top_k must be a positive integer")
+    if not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1:
+        raise ValueError("threshold must be a probability between 0 and 1")
+    return method, top_k, threshold
+
+def _run_measured(simulator, circuit, shots, top_k=None, threshold=0.0, progress=None):
+    """
+    Counts of a sampled run, or with shots=0 the exact outcome
+    probabilities (optionally the top_k outcomes at or above threshold).
+    """
+    if shots == 0:
+        return {"probabilities": simulator.probabilities(circuit, top_k=top_k, threshold=threshold)}
+    return {"counts": simulator.run(circuit, shots=shots, progress=progress)}
+
+def _simulate_counts(circuit, shots, on_slow='job', extra=None, profile=False, top_k=None, threshold=0.0,
+                     method='statevector'):
+    """
+    Runs a measured circuit for /simulate and /simulate/qasm with admission
+    control. Runs estimated to exceed MAX_SYNC_SECONDS are, depending on
+    on_slow, queued as a background job ('job', default), run with fewer
+    shots ('cap') or rejected ('reject'). With profile, the response carries
+    a per-operation time/memory summary and a Chrome trace of the run.
+    shots=0 returns exact 'probabilities' instead of 'counts'; those runs
+    cannot be capped. method picks the Simulator backend.
+    """
+    if on_slow not in ('job', 'cap', 'reject'):
+        return jsonify({"error": "on_slow must be 'job', 'cap' or 'reject'"}), 400
+
+    exact = shots == 0
+    response = {"num_qubits": circuit.num_qubits}
+    response.update(extra or {})
+    try:
+        estimate = _admit(circuit, shots, exact=exact, method=method)
+        if estimate['seconds'] > MAX_SYNC_SECONDS:
+            if on_slow == 'job':
+                _admit(circuit, shots, MAX_JOB_SECONDS, exact=exact, method=method)
+                return _submit_job(circuit, shots, top_k=top_k, threshold=threshold, method=method)
+            capped = _max_shots_within(circuit, MAX_SYNC_SECONDS, method) if on_slow == 'cap' and not exact else 0
+            if capped < 1:
+                _admit(circuit, shots, MAX_SYNC_SECONDS, exact=exact, method=method)  # raises with the runtime error
+            response["shots_requested"] = shots
+            shots = capped
+    except AdmissionError as e:
+        g.error_type = 'AdmissionError'
+        return jsonify({"error": str(e)}), 413
+
+    # Run simulation
+    profiler = quantum_lib.Profiler() if profile else None
+    simulator = quantum_lib.Simulator(checkpoints=checkpoints, profiler=profiler, method=method)
+    
+    # Run and get counts (or exact probabilities for shots=0)
+    try:
+        result = _run_measured(simulator, circuit, shots, top_k, threshold)
+    except Exception as e:
+        logger.error(f"Simulation error: {e}")
+        g.error_type = type(e).__name__
+        # Fallback/Debug: print full stack trace if needed, but for now sane error msg
+        return jsonify({"error": f"Simulation execution failed: {str(e)}"}), 500
+    finally:
+        metrics.observe_simulation(simulator, circuit)
+
+    response.update(result)
+    response.update({"shots": shots, "light_cone": {
+        "operations_pruned": simulator.operations_pruned,
+        "qubits_pruned": simulator.qubits_pruned,
+    }})
+    if profiler is not None:
+        response["profile"] = {"summary": profiler.summary(), "trace": profiler.chrome_trace()}
+    return jsonify(response)
+
 @app.route('/simulate', methods=['POST'])
 def simulate():
+    """
+    Optional 'on_slow': what to do when the run would exceed
+    MAX_SYNC_SECONDS, see _simulate_counts. Optional 'profile': true adds
+    a 'profile' field with per-operation timings.
+    """
     try:
         data = request.get_json()
-        if not data:
-            return jsonify({"error": "Invalid JSON"}), 400
-            
-        num_qubits = data.get('num_qubits')
-        operations = data.get('operations')
-        shots = data.get('shots', 1024)
-        
-        if not num_qubits or not isinstance(num_qubits, int):
-            return jsonify({"error": "num_qubits must be an integer > 0"}), 400
-        if not operations or not isinstance(operations, list):
-            return jsonify({"error": "operations must be a list of gate objects"}), 400
+        try:
+            circuit, shots = _build_circuit(data)
+            method, top_k, threshold = _run_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Initialize circuit
-        circuit = quantum_lib.QuantumCircuit(num_qubits)
-        
-        # Apply operations
-        for op in operations:
-            gate_type = op.get('type')
-            if not gate_type:
-                continue
-                
-            gate_type = gate_type.lower()
-            
-            try:
-                if gate_type == 'h':
-                    circuit.h(op['qubit'])
-                elif gate_type == 'x':
-                    circuit.x(op['qubit'])
-                elif gate_type == 'y':
-                    circuit.y(op['qubit'])
-                elif gate_type == 'z':
-                    circuit.z(op['qubit'])
-                elif gate_type == 't':
-                    circuit.t(op['qubit'])
-                elif gate_type == 's':
-                    circuit.s(op['qubit'])
-                elif gate_type == 'rx':
-                    circuit.rx(op['qubit'], op.get('theta', 0.0))
-                elif gate_type == 'ry':
-                    circuit.ry(op['qubit'], op.get('theta', 0.0))
-                elif gate_type == 'rz':
-                    circuit.rz(op['qubit'], op.get('theta', 0.0))
-                elif gate_type == 'phase':
-                    circuit.phase(op['qubit'], op.get('theta', 0.0))
-                elif gate_type == 'cx':
-                    circuit.cx(op['control'], op['target'])
-                elif gate_type == 'cz':
-                    circuit.cz(op['control'], op['target'])
-                elif gate_type == 'cp':
-                    circuit.cp(op['control'], op['target'], op.get('theta', 0.0))
-                elif gate_type == 'swap':
-                    circuit.swap(op['qubit1'], op['qubit2'])
-                elif gate_type == 'measure':
-                     # Explicit measurement
-                     # Backend expects (qubit, cbit)
-                     # We map q -> cbit (same index for simplicity in this API version unless specified)
-                     q = op['qubit']
-                     c = op.get('cbit', q) 
-                     circuit.measure(q, c)
-                elif gate_type == 'custom':
-                    # Custom gate: expects 'matrix' (2D list) and 'qubit'
-                    matrix = op.get('matrix')
-                    if not matrix:
-                        return jsonify({"error": "Custom gate requires 'matrix'"}), 400
-                    
-                    # Convert list to numpy array
-                    np_matrix = np.array(matrix)
-                    circuit.operations.append(('custom', op['qubit'], np_matrix))
-                    
-                else:
-                    logger.warning(f"Unknown gate type: {gate_type}")
-            except KeyError as e:
-                return jsonify({"error": f"Missing parameter for gate {gate_type}: {str(e)}"}), 400
-            except Exception as e:
-                return jsonify({"error": f"Error applying gate {gate_type}: {str(e)}"}), 400
-
-        # Auto-measure ALL qubits IF AND ONLY IF no explicit measurements exist
-        if not circuit.measurements:
-            for i in range(num_qubits):
-                circuit.measure(i, i)
-
-        # Run simulation
-        simulator = quantum_lib.Simulator()
-        
-        # Run and get counts
-        # Note: quantum_lib.Simulator.run returns counts dict
+        return _simulate_counts(circuit, shots, data.get('on_slow', 'job'), profile=bool(data.get('profile')),
+                                top_k=top_k, threshold=threshold, method=method)
+
+    except Exception as e:
+        logger.exception("Global server error")
+        return jsonify({"error": str(e)}), 500
+
+def _max_standard_error(counts, shots_done):
+    """
+    Largest standard error sqrt((p(1-p) + 1/N)/N) over the observed
+    outcomes. The 1/N term keeps it from reaching 0 when every shot so far
+    gave the same outcome, which says little about the next ones.
+    """
+    return max(np.sqrt((c / shots_done * (1 - c / shots_done) + 1 / shots_done) / shots_done)
+               for c in counts.values())
+
+@app.route('/simulate/qasm', methods=['POST'])
+def simulate_qasm():
+    """
+    Runs an OpenQASM 2.0 or QASM-lite program sent as the raw request body.
+    Query parameters: shots (default 1024), num_qubits (QASM-lite only;
+    inferred from the program when omitted). The body is parsed line by
+    line as it is read, and at most MAX_QASM_OPERATIONS operations are
+    accepted. on_slow works as for /simulate.
+    """
+    shots = request.args.get('shots', 1024, type=int)
+    num_qubits = request.args.get('num_qubits', type=int)
+
+    start = time.perf_counter()
+    try:
+        circuit = quantum_lib.parse_qasm(request.stream, num_qubits=num_qubits,
+                                         max_ops=MAX_QASM_OPERATIONS)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"QASM parse error: {str(e)}"}), 400
+    parse_ms = (time.perf_counter() - start) * 1000
+
+    if not circuit.num_qubits:
+        return jsonify({"error": "Program declares no qubits"}), 400
+    if shots < 0:
+        return jsonify({"error": "shots must be a non-negative integer (0 for exact probabilities)"}), 400
+    try:
+        method, top_k, threshold = _run_options(request.args, query=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not circuit.measurements:
+        for i in range(circuit.num_qubits):
+            circuit.measure(i, i)
+
+    return _simulate_counts(circuit, shots, request.args.get('on_slow', 'job'), {
+        "num_operations": len(circuit.operations),
+        "parse_ms": parse_ms,
+    }, top_k=top_k, threshold=threshold, method=method)
+
+@app.route('/export_qasm', methods=['POST'])
+def export_qasm():
+    """
+    Converts a /simulate request body to OpenQASM 2.0 text, or QASM-lite
+    with ?dialect=lite. Measurements are exported only if present.
+    """
+    try:
+        circuit, _ = _build_circuit(request.get_json(), auto_measure=False)
+        lines = quantum_lib.dump_qasm(circuit, lite=request.args.get('dialect') == 'lite')
+        text = "".join(line + "\n" for line in lines)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(text, mimetype='text/plain')
+
+@app.route('/simulate/stream', methods=['POST'])
+def simulate_stream():
+    """
+    Streaming variant of /simulate. Sends running counts after every batch of
+    shots as NDJSON, or as Server-Sent Events when the client asks for
+    text/event-stream (or passes "format": "sse").
+
+    Optional fields:
+        batch_size: shots per update (default 128)
+        precision: stop once the standard error of every observed outcome
+                   probability is at most this value
+    """
+    data = request.get_json()
+    try:
+        circuit, shots = _build_circuit(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if shots == 0:
+        return jsonify({"error": "streaming needs shots > 0; use /simulate for exact probabilities"}), 400
+    batch_size = data.get('batch_size', 128)
+    precision = data.get('precision')
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        return jsonify({"error": "batch_size must be a positive integer"}), 400
+    if precision is not None and (not isinstance(precision, (int, float)) or precision <= 0):
+        return jsonify({"error": "precision must be a positive number"}), 400
+
+    try:
+        _admit(circuit, shots, MAX_JOB_SECONDS)
+    except AdmissionError as e:
+        g.error_type = 'AdmissionError'
+        return jsonify({"error": str(e)}), 413
+
+    sse = data.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+
+    def encode(message):
+        line = json.dumps(message)
+        return f"data: {line}\n\n" if sse else line + "\n"
+
+    def generate():
+        simulator = quantum_lib.Simulator(checkpoints=checkpoints)
+        counts, shots_done, stderr = {}, 0, None
         try:
-            counts = simulator.run(circuit, shots=shots)
+            for counts in simulator.iter_counts(circuit, shots=shots, batch_size=batch_size):
+                shots_done = simulator.shots_done
+                stderr = _max_standard_error(counts, shots_done)
+                if shots_done >= shots or (precision is not None and stderr <= precision):
+                    break
+                yield encode({"counts": counts, "shots_done": shots_done, "standard_error": stderr})
         except Exception as e:
             logger.error(f"Simulation error: {e}")
-            # Fallback/Debug: print full stack trace if needed, but for now sane error msg
-            return jsonify({"error": f"Simulation execution failed: {str(e)}"}), 500
+            metrics.ERRORS.labels('/simulate/stream', type(e).__name__).inc()
+            yield encode({"error": f"Simulation execution failed: {str(e)}"})
+            return
+        finally:
+            metrics.observe_simulation(simulator, circuit)
 
-        return jsonify({
+        yield encode({
+            "done": True,
             "counts": counts,
-            "shots": shots,
-            "num_qubits": num_qubits
+            "shots": shots_done,
+            "shots_requested": shots,
+            "standard_error": stderr,
+            "stopped_early": shots_done < shots,
+            "num_qubits": circuit.num_qubits,
         })
 
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype, headers={"Cache-Control": "no-cache"})
+
+@app.route('/statevector', methods=['POST'])
+def statevector():
+    """
+    Final statevector (or probability vector) as a binary payload; see
+    export.encode_state. Measurements in the circuit are ignored.
+
+    Optional fields:
+        output: 'statevector' (default) or 'probabilities'
+        precision: 'single' (complex64/float32, default) or 'double'
+        format: 'raw' (default) or 'npy'
+        top_k: only send the k most probable basis states
+        compress: 'gzip'
+    """
+    data = request.get_json()
+    try:
+        circuit, _ = _build_circuit(data, auto_measure=False)
+        options = {
+            'output': data.get('output', 'statevector'),
+            'precision': data.get('precision', 'single'),
+            'fmt': data.get('format', 'raw'),
+            'top_k': data.get('top_k'),
+            'compress': data.get('compress'),
+        }
+        check_options(**options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        _admit(circuit, 0, MAX_SYNC_SECONDS)
+    except AdmissionError as e:
+        g.error_type = 'AdmissionError'
+        return jsonify({"error": str(e)}), 413
+
+    simulator = quantum_lib.Simulator(checkpoints=checkpoints)
+    try:
+        state = simulator.statevector(circuit)
     except Exception as e:
-        logger.exception("Global server error")
-        return jsonify({"error": str(e)}), 500
+        logger.error(f"Simulation error: {e}")
+        g.error_type = type(e).__name__
+        return jsonify({"error": f"Simulation execution failed: {str(e)}"}), 500
+    finally:
+        metrics.observe_simulation(simulator, circuit)
+
+    chunks, meta = encode_state(state.coef, **options)
+    headers = {
+        "X-Num-Qubits": str(circuit.num_qubits),
+        "X-Dtype": meta['dtype'],
+        "X-Length": str(meta['length']),
+        "X-Sparse": "1" if meta['sparse'] else "0",
+    }
+    if options['compress'] == 'gzip':
+        headers["Content-Encoding"] = "gzip"
+    mimetype = 'application/x-npy' if options['fmt'] == 'npy' else 'application/octet-stream'
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+@app.route('/gradient', methods=['POST'])
+def gradient():
+    """
+    Expectation value of a Pauli-sum observable in the circuit's final state
+    and its gradient with respect to every rx/ry/rz/phase/cp angle, by the
+    adjoint method (Simulator.expectation_gradient) in one request.
+    Measurements in the circuit are ignored.
+
+    Fields: the /simulate circuit fields plus 'observable', a mapping of
+    Pauli labels to real coefficients, e.g. {"ZZ": 1.0, "XI": -0.5}; the
+    leftmost label character acts on the highest qubit.
+    """
+    data = request.get_json()
+    try:
+        circuit, _ = _build_circuit(data, auto_measure=False)
+        observable = data.get('observable')
+        if not isinstance(observable, dict) or not observable:
+            raise ValueError("observable must map Pauli labels to coefficients")
+        for label, coefficient in observable.items():
+            if len(label) != circuit.num_qubits or set(label) - set('IXYZ'):
+                raise ValueError(f"Pauli label {label!r} must have {circuit.num_qubits} characters from I, X, Y, Z")
+            if not isinstance(coefficient, (int, float)):
+                raise ValueError(f"Coefficient of {label!r} must be a real number")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # forward pass plus the two backward passes
+        _admit(circuit, 0, MAX_SYNC_SECONDS / 3)
+    except AdmissionError as e:
+        g.error_type = 'AdmissionError'
+        return jsonify({"error": str(e)}), 413
+
+    simulator = quantum_lib.Simulator(checkpoints=checkpoints)
+    try:
+        value, gradients = simulator.expectation_gradient(circuit, observable)
+    except Exception as e:
+        logger.error(f"Simulation error: {e}")
+        g.error_type = type(e).__name__
+        return jsonify({"error": f"Simulation execution failed: {str(e)}"}), 500
+    finally:
+        metrics.observe_simulation(simulator, circuit)
+
+    return jsonify({
+        "num_qubits": circuit.num_qubits,
+        "expectation": value,
+        "gradients": gradients.tolist(),
+        # Index of each differentiated operation in the built circuit (= in the
+        # request operations, unless unknown gate types were skipped)
+        "parameters": [i for i, op in enumerate(circuit.operations) if op[0] in quantum_lib._PARAMETERIZED],
+    })
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues a /simulate request body for background execution.
+    Optional 'priority' (int, higher runs first, default 0).
+    """
+    data = request.get_json()
+    try:
+        circuit, shots = _build_circuit(data)
+        method, top_k, threshold = _run_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int):
+        return jsonify({"error": "priority must be an integer"}), 400
+
+    try:
+        _admit(circuit, shots, MAX_JOB_SECONDS, exact=shots == 0, method=method)
+    except AdmissionError as e:
+        g.error_type = 'AdmissionError'
+        return jsonify({"error": str(e)}), 413
+
+    return _submit_job(circuit, shots, priority, top_k, threshold, method)
+
+def _submit_job(circuit, shots, priority=0, top_k=None, threshold=0.0, method='statevector'):
+    def run(job):
+        simulator = quantum_lib.Simulator(checkpoints=checkpoints, method=method)
+        try:
+            result = _run_measured(simulator, circuit, shots, top_k, threshold, progress=job.update_progress)
+        finally:
+            metrics.observe_simulation(simulator, circuit)
+        return dict(result, shots=shots, num_qubits=circuit.num_qubits)
+
+    # Exact-probability runs do not report progress
+    gates_total = quantum_lib._planned_gates(circuit, shots) if shots else None
+    try:
+        job = job_queue.submit(run, priority=priority, shots_total=shots, gates_total=gates_total)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify(job.to_dict()), 202, {"Location": f"/jobs/{job.id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status == 'done':
+        return jsonify(job.result), 200
+    if job.status == 'failed':
+        return jsonify({"error": f"Simulation execution failed: {job.error}"}), 500
+    if job.status == 'cancelled':
+        return jsonify({"error": "Job was cancelled"}), 410
+    # Still queued or running
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict()), 200
 
 @app.route('/generate_qasm', methods=['POST'])
 def generate_qasm():
@@ -144,41 +649,58 @@ def generate_qasm():
         prompt = data['prompt']
         num_qubits = data.get('num_qubits', 5) 
 
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
+        generator = _qasm_generator()
+        if generator is None:
              return jsonify({"error": "GEMINI_API_KEY not set on server"}), 500
 
-        client = genai.Client(api_key=api_key)
-        
-        system_prompt = (
-            "You are a quantum computing expert. Translate the following natural language request "
-            "into OpenQASM 2.0 compatible simplified instructions for this specific simulator. "
-            f"You MUST use ONLY the available {num_qubits} qubits, indexed from 0 to {num_qubits-1}. "
-            "Do NOT use qubits outside this range. "
-            "Supported gates: H <q>, X <q>, Y <q>, Z <q>, CX <c> <t>, CZ <c> <t>, SWAP <q1> <q2>, "
-            "RX <q> <theta>, RY <q> <theta>, RZ <q> <theta>, PHASE <q> <theta>. "
-            "Return ONLY the code commands separated by newlines. No markdown, no explanations. "
-            "Example output:\nH 0\nCX 0 1"
-        )
-        
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', 
-            contents=f"{system_prompt}\n\nRequest: {prompt}"
-        )
-        
-        qasm_code = response.text.strip()
-        
-        if qasm_code.startswith("```"):
-            lines = qasm_code.splitlines()
-            if lines[0].startswith("```"): lines = lines[1:]
-            if lines and lines[-1].startswith("```"): lines = lines[:-1]
-            qasm_code = "\n".join(lines)
+        qasm_code, cached = generator.generate(prompt, num_qubits)
+        metrics.observe_cache('generate_qasm', hits=int(cached), misses=int(not cached))
 
-        return jsonify({"qasm": qasm_code})
+        return jsonify({"qasm": qasm_code, "cached": cached})
 
     except Exception as e:
         logger.exception("Gemini generation error")
         return jsonify({"error": str(e)}), 500
 
+def _qasm_generator():
+    """
+    The process-wide QasmGenerator, created on first use from GEMINI_API_KEY,
+    GEMINI_MODEL, GEMINI_BASE_URL and the GEMINI_CACHE_* settings. None when
+    no API key is configured.
+    """
+    global qasm_generator
+    with _qasm_generator_lock:
+        if qasm_generator is None and os.environ.get("GEMINI_API_KEY"):
+            qasm_generator = QasmGenerator(
+                api_key=os.environ["GEMINI_API_KEY"],
+                model=os.environ.get("GEMINI_MODEL", "gemini-2.5-flash"),
+                base_url=os.environ.get("GEMINI_BASE_URL"),
+                cache=ResponseCache(
+                    max_entries=int(os.environ.get("GEMINI_CACHE_SIZE", 512)),
+                    ttl=float(os.environ.get("GEMINI_CACHE_TTL", 3600)),
+                ),
+            )
+        return qasm_generator
+
+def warm_up():
+    """
+    Exercises the simulation, QASM and export paths once so first-use costs
+    (lazy imports, NumPy/BLAS initialisation, module-level caches) are paid
+    up front. gunicorn.conf.py calls this in the master process with
+    preload_app, so every forked worker starts warm and shares those pages
+    copy-on-write. Bypasses metrics and the checkpoint cache.
+    """
+    circuit = quantum_lib.parse_qasm(
+        'OPENQASM 2.0;\ninclude "qelib1.inc";\nqreg q[3];\ncreg c[3];\n'
+        'h q[0];\ncx q[0],q[1];\ncp(pi/4) q[1],q[2];\nswap q[0],q[2];\nrx(pi/2) q[1];\n'
+    )
+    state = quantum_lib.Simulator().statevector(circuit)
+    b"".join(encode_state(state.coef)[0])
+    "".join(quantum_lib.dump_qasm(circuit))
+    for q in range(circuit.num_qubits):
+        circuit.measure(q, q)
+    cost_model.estimate(circuit, 16)
+    quantum_lib.Simulator().run(circuit, shots=16)
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
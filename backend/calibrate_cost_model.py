@@ -0,0 +1,21 @@
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quantum_lib
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the /simulate cost model on this machine.")
+    parser.add_argument("--max-qubits", type=int, default=10)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cost_model.json"))
+    args = parser.parse_args()
+
+    print(f"Timing operations on 2..{args.max_qubits} qubits...")
+    model = quantum_lib.CostModel.calibrate(qubits=range(2, args.max_qubits + 1))
+    model.save(args.output)
+    print(f"Saved cost model to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import io
+import zlib
+
+import numpy as np
+
+CHUNK_ELEMENTS = 1 << 16
+
+DTYPES = {
+    ('statevector', 'single'): np.dtype('<c8'),
+    ('statevector', 'double'): np.dtype('<c16'),
+    ('probabilities', 'single'): np.dtype('<f4'),
+    ('probabilities', 'double'): np.dtype('<f8'),
+}
+
+
+def _npy_header(dtype, length):
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buf, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (length,)}
+    )
+    return buf.getvalue()
+
+
+def _dense_chunks(coef, output, dtype):
+    """
+    Encodes the amplitudes chunk by chunk straight from the simulator buffer,
+    converting at most one chunk at a time, so no full-size copy of the
+    state is made.
+    """
+    for start in range(0, len(coef), CHUNK_ELEMENTS):
+        chunk = coef[start:start + CHUNK_ELEMENTS]
+        if output == 'probabilities':
+            chunk = chunk.real ** 2 + chunk.imag ** 2 if np.iscomplexobj(chunk) else chunk ** 2
+        if chunk.dtype != dtype:
+            chunk = chunk.astype(dtype)
+        yield np.ascontiguousarray(chunk).tobytes()
+
+
+def _top_k(coef, output, dtype, k):
+    probs = np.abs(coef) ** 2
+    k = min(k, len(probs))
+    idx = np.argpartition(probs, len(probs) - k)[len(probs) - k:]
+    idx = idx[np.argsort(probs[idx])[::-1]]
+    records = np.empty(k, dtype=[('index', '<u8'), ('value', dtype)])
+    records['index'] = idx
+    records['value'] = probs[idx] if output == 'probabilities' else coef[idx]
+    return records
+
+
+def check_options(output='statevector', precision='single', fmt='raw', top_k=None, compress=None):
+    """
+    Raises ValueError for options encode_state does not support.
+    """
+    if output not in ('statevector', 'probabilities'):
+        raise ValueError("output must be 'statevector' or 'probabilities'")
+    if precision not in ('single', 'double'):
+        raise ValueError("precision must be 'single' or 'double'")
+    if fmt not in ('raw', 'npy'):
+        raise ValueError("format must be 'raw' or 'npy'")
+    if compress not in (None, 'gzip'):
+        raise ValueError("compress must be 'gzip' if given")
+    if top_k is not None and (not isinstance(top_k, int) or top_k <= 0):
+        raise ValueError("top_k must be a positive integer")
+
+
+def encode_state(coef, output='statevector', precision='single', fmt='raw', top_k=None, compress=None):
+    """
+    Binary payload for a statevector (or its probability vector).
+
+    Dense payloads are the little-endian amplitudes indexed by basis state,
+    where bit q of the index is qubit q. With top_k, the payload holds the k
+    most probable basis states as (uint64 index, value) records, in
+    descending probability. fmt='npy' prefixes the matching .npy header.
+    compress='gzip' gzips the stream.
+
+    Returns (chunk_iterator, metadata_dict).
+    """
+    check_options(output, precision, fmt, top_k, compress)
+
+    dtype = DTYPES[(output, precision)]
+    coef = np.asarray(coef).reshape(-1)
+
+    if top_k is not None:
+        records = _top_k(coef, output, dtype, top_k)
+        dtype, length = records.dtype, len(records)
+        chunks = iter([records.tobytes()])
+    else:
+        length = len(coef)
+        chunks = _dense_chunks(coef, output, dtype)
+
+    if fmt == 'npy':
+        header = _npy_header(dtype, length)
+        chunks = _prepend(header, chunks)
+    if compress == 'gzip':
+        chunks = _gzip(chunks)
+
+    metadata = {
+        'dtype': str(np.lib.format.dtype_to_descr(dtype)),
+        'length': length,
+        'sparse': top_k is not None,
+    }
+    return chunks, metadata
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
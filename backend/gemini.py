@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+SYSTEM_PROMPT = (
+    "You are a quantum computing expert. Translate the following natural language request "
+    "into OpenQASM 2.0 compatible simplified instructions for this specific simulator. "
+    "You MUST use ONLY the available {num_qubits} qubits, indexed from 0 to {last_qubit}. "
+    "Do NOT use qubits outside this range. "
+    "Supported gates: H <q>, X <q>, Y <q>, Z <q>, CX <c> <t>, CZ <c> <t>, SWAP <q1> <q2>, "
+    "RX <q> <theta>, RY <q> <theta>, RZ <q> <theta>, PHASE <q> <theta>. "
+    "Return ONLY the code commands separated by newlines. No markdown, no explanations. "
+    "Example output:\nH 0\nCX 0 1"
+)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=512, ttl=3600.0):
+        '''
+        Thread-safe LRU cache whose entries also expire ttl seconds after
+        they were stored.
+        '''
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QasmGenerator:
+    def __init__(self, api_key, model='gemini-2.5-flash', base_url=None, cache=None):
+        '''
+        Turns natural-language prompts into simulator instructions with Gemini.
+
+        One client (and so one pool of keep-alive connections) is shared by
+        every request in the process. It is created on first use, so it is
+        never inherited across a gunicorn fork. base_url points the client at
+        another server speaking the Gemini REST API, such as a local stand-in
+        for tests.
+        '''
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.cache = cache if cache is not None else ResponseCache()
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # google.genai is slow to import and only needed here
+                from google import genai
+                from google.genai import types
+
+                http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                self._client = genai.Client(api_key=self.api_key, http_options=http_options)
+            return self._client
+
+    def generate(self, prompt, num_qubits):
+        """
+        Returns (qasm, cached). Identical (prompt, num_qubits) requests are
+        answered from the cache without calling the model.
+        """
+        key = (prompt, num_qubits)
+        qasm = self.cache.get(key)
+        if qasm is not None:
+            return qasm, True
+
+        system_prompt = SYSTEM_PROMPT.format(num_qubits=num_qubits, last_qubit=num_qubits - 1)
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=f"{system_prompt}\n\nRequest: {prompt}"
+        )
+        qasm = _strip_code_fence(response.text.strip())
+        self.cache.put(key, qasm)
+        return qasm, False
+
+
+def _strip_code_fence(text):
+    if text.startswith("```"):
+        lines = text.splitlines()
+        if lines[0].startswith("```"): lines = lines[1:]
+        if lines and lines[-1].startswith("```"): lines = lines[:-1]
+        text = "\n".join(lines)
+    return text
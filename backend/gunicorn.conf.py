@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+# Shared directory for per-worker metric files, aggregated by /metrics.
+# Must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "simulator-metrics"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Import the app once in the master and fork the workers from it, so imports
+# and warm-up state are shared copy-on-write instead of repeated per worker.
+# Job worker threads are started lazily, after the fork.
+preload_app = True
+
+
+def on_starting(server):
+    # Drop samples left over from a previous run of the server
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, before forking
+    import app
+    app.warm_up()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
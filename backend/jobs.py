@@ -0,0 +1,166 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, fn, priority=0, shots_total=None, gates_total=None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.priority = priority
+        self.status = 'queued'
+        self.progress = {
+            'shots_done': 0,
+            'shots_total': shots_total,
+            'gates_done': 0,
+            'gates_total': gates_total,
+        }
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def update_progress(self, shots_done, gates_done):
+        """
+        Progress callback for Simulator.run; raises JobCancelled once the job
+        has been cancelled so the simulation stops at the next gate or shot.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress['shots_done'] = shots_done
+        self.progress['gates_done'] = gates_done
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'progress': dict(self.progress),
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_queued=32, max_retained=256):
+        '''
+        Background simulation jobs run by a pool of worker threads.
+
+        workers: number of worker threads
+        max_queued: jobs waiting beyond this are rejected with QueueFull
+        max_retained: finished jobs kept around for status/result queries
+
+        Jobs with a higher priority are started first; equal priorities run
+        in submission order. Worker threads are started on the first submit so
+        the queue can be created before gunicorn forks its workers. Jobs live
+        in the memory of the worker process that accepted them.
+        '''
+        self.workers = workers
+        self.max_retained = max_retained
+        self._queue = queue.PriorityQueue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._threads = []
+
+    def submit(self, fn, priority=0, shots_total=None, gates_total=None):
+        """
+        Queues fn(job) for execution and returns the Job. fn should pass
+        job.update_progress to the simulator so progress and cancellation work.
+        """
+        job = Job(fn, priority, shots_total, gates_total)
+        with self._lock:
+            self._start_workers()
+            try:
+                self._queue.put_nowait((-priority, next(self._seq), job))
+            except queue.Full:
+                raise QueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Returns the Job, or None if unknown.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job._cancel.set()
+        with self._lock:
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+        return job
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f'sim-job-{len(self._threads)}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_retained)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            try:
+                with self._lock:
+                    if job.status != 'queued':
+                        continue  # cancelled while waiting
+                    job.status = 'running'
+                    job.started_at = time.time()
+                try:
+                    job.result = job.fn(job)
+                    if job.progress['gates_total'] is not None:
+                        # Gates resumed from checkpoints are never applied
+                        job.progress['gates_done'] = job.progress['gates_total']
+                    job.status = 'done'
+                except JobCancelled:
+                    job.status = 'cancelled'
+                except Exception as e:
+                    logger.exception(f"Job {job.id} failed")
+                    job.error = str(e)
+                    job.status = 'failed'
+                job.finished_at = time.time()
+                job.fn = None
+            finally:
+                self._queue.task_done()
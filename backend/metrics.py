@@ -0,0 +1,72 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+
+# With PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py) every worker writes
+# its samples to that directory and /metrics aggregates all of them;
+# otherwise the metrics of the current process are reported.
+
+REQUEST_LATENCY = Histogram(
+    'simulator_request_duration_seconds', 'Request latency by route',
+    ['route', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+ERRORS = Counter('simulator_errors_total', 'Failed requests by route and error type', ['route', 'type'])
+
+GATES = Counter('simulator_gates_total', 'Gates applied by the simulator')
+SHOTS = Counter('simulator_shots_total', 'Shots simulated')
+CIRCUITS = Counter('simulator_circuits_total', 'Circuits simulated')
+QUBITS = Histogram(
+    'simulator_circuit_qubits', 'Register size of simulated circuits',
+    buckets=(1, 2, 4, 6, 8, 10, 12, 14, 16, 20, 24, 28, 32),
+)
+PEAK_STATE_BYTES = Gauge(
+    'simulator_peak_statevector_bytes', 'Largest statevector held by any worker',
+    multiprocess_mode='max',
+)
+CACHE_LOOKUPS = Counter('simulator_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+
+_peak_state_bytes = 0
+
+
+def observe_request(route, method, status, seconds, error_type=None):
+    REQUEST_LATENCY.labels(route, method, str(status)).observe(seconds)
+    if status >= 400:
+        ERRORS.labels(route, error_type or f'http_{status}').inc()
+
+
+def observe_simulation(simulator, circuit):
+    """
+    Records the counters of a finished (or aborted) Simulator run.
+    """
+    CIRCUITS.inc()
+    QUBITS.observe(circuit.num_qubits)
+    GATES.inc(simulator.gates_applied)
+    SHOTS.inc(simulator.shots_done)
+    global _peak_state_bytes
+    if simulator.peak_state_bytes > _peak_state_bytes:
+        _peak_state_bytes = simulator.peak_state_bytes
+        PEAK_STATE_BYTES.set(simulator.peak_state_bytes)
+    observe_cache('checkpoint', simulator.checkpoint_hits, simulator.checkpoint_misses)
+
+
+def observe_cache(cache, hits=0, misses=0):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, 'miss').inc(misses)
+
+
+def render():
+    """
+    Returns (body, content_type) in the Prometheus text format.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
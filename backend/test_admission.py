@@ -0,0 +1,94 @@
+import app as server
+import quantum_lib
+
+client = server.app.test_client()
+
+
+def ops(n):
+    return [{"type": "h", "qubit": q} for q in range(n)] + [
+        {"type": "measure", "qubit": 0}, {"type": "h", "qubit": 0}, {"type": "measure", "qubit": 0},
+    ] + [{"type": "measure", "qubit": q} for q in range(1, n)]
+
+
+def test_estimate_scales_with_qubits_and_measurements():
+    model = quantum_lib.CostModel()
+    small, big = quantum_lib.QuantumCircuit(3), quantum_lib.QuantumCircuit(28)
+    for c in (small, big):
+        c.h(0)
+        c.measure(0, 0)
+        c.h(0)
+        # Every qubit is read, so light-cone pruning keeps the whole register
+        for q in range(c.num_qubits):
+            c.measure(q, q)
+    assert model.estimate(big, 10)['peak_bytes'] > 2**33
+    assert model.estimate(small, 10)['path'] == 'per_shot'
+    assert model.estimate(small, 1000)['seconds'] > model.estimate(small, 10)['seconds']
+
+
+def test_rejects_before_allocating():
+    resp = client.post('/simulate', json={"num_qubits": 28, "shots": 10, "operations": ops(28)})
+    assert resp.status_code == 413
+    assert "MiB" in resp.get_json()["error"]
+
+
+def test_rejects_out_of_range_qubits():
+    operations = [{"type": "h", "qubit": 5}, {"type": "measure", "qubit": 5}]
+    resp = client.post('/simulate', json={"num_qubits": 2, "shots": 10, "operations": operations})
+    assert resp.status_code == 400
+    assert "qubit 5" in resp.get_json()["error"]
+
+
+def test_rejects_registers_no_method_supports():
+    # Every qubit is measured, so light-cone pruning keeps them all
+    n = 2000
+    operations = [{"type": "x", "qubit": q} for q in range(n)] + [{"type": "measure", "qubit": q} for q in range(n)]
+    for method in ("statevector", "sparse"):
+        resp = client.post('/simulate', json={"num_qubits": n, "shots": 10, "method": method, "operations": operations})
+        assert resp.status_code == 413
+        assert "at most 62" in resp.get_json()["error"]
+
+
+def test_sparse_method_admits_large_registers():
+    ghz = [{"type": "h", "qubit": 0}] + [{"type": "cx", "control": q, "target": q + 1} for q in range(49)]
+    payload = {"num_qubits": 50, "shots": 100, "operations": ghz}
+    assert client.post('/simulate', json=payload).status_code == 413
+
+    resp = client.post('/simulate', json=dict(payload, method="sparse"))
+    assert resp.status_code == 200
+    assert set(resp.get_json()["counts"]) == {"0" * 50, "1" * 50}
+    assert client.post('/simulate', json=dict(payload, method="mps")).status_code == 400
+
+
+def test_slow_requests_are_capped_or_queued():
+    limit, server.MAX_SYNC_SECONDS = server.MAX_SYNC_SECONDS, 0.05
+    try:
+        check_slow_request_policies()
+    finally:
+        server.MAX_SYNC_SECONDS = limit
+
+
+def check_slow_request_policies():
+    payload = {"num_qubits": 3, "shots": 100000, "operations": ops(3)}
+
+    resp = client.post('/simulate', json=dict(payload, on_slow="cap"))
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data["shots_requested"] == 100000
+    assert 0 < data["shots"] < 100000
+
+    resp = client.post('/simulate', json=dict(payload, on_slow="reject"))
+    assert resp.status_code == 413
+
+    resp = client.post('/simulate', json=payload)
+    assert resp.status_code == 202
+    client.delete(f"/jobs/{resp.get_json()['job_id']}")
+
+
+if __name__ == "__main__":
+    test_estimate_scales_with_qubits_and_measurements()
+    test_rejects_before_allocating()
+    test_rejects_out_of_range_qubits()
+    test_rejects_registers_no_method_supports()
+    test_sparse_method_admits_large_registers()
+    test_slow_requests_are_capped_or_queued()
+    print("Admission tests passed")
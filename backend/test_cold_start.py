@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_import_skips_optional_dependencies():
+    code = "import sys, app; app.warm_up(); print('google.genai' in sys.modules, 'scipy' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, capture_output=True, text=True, check=True)
+    assert out.stdout.split()[-2:] == ["False", "False"]
+
+
+if __name__ == "__main__":
+    test_import_skips_optional_dependencies()
+    print("Cold start test passed")
@@ -0,0 +1,61 @@
+import gzip
+import io
+
+import numpy as np
+
+from app import app
+
+GHZ = [
+    {"type": "h", "qubit": 0},
+    {"type": "cx", "control": 0, "target": 1},
+    {"type": "cx", "control": 0, "target": 2},
+]
+
+
+def test_raw_complex64_statevector():
+    client = app.test_client()
+    resp = client.post('/statevector', json={"num_qubits": 3, "operations": GHZ})
+    assert resp.status_code == 200
+    assert resp.headers["X-Dtype"] == "<c8"
+
+    amps = np.frombuffer(resp.get_data(), dtype='<c8')
+    expected = np.zeros(8)
+    expected[[0, 7]] = 1 / np.sqrt(2)
+    assert np.allclose(amps, expected, atol=1e-6)
+
+
+def test_npy_probabilities_gzip():
+    client = app.test_client()
+    resp = client.post('/statevector', json={
+        "num_qubits": 3, "operations": GHZ,
+        "output": "probabilities", "precision": "double", "format": "npy", "compress": "gzip",
+    })
+    assert resp.headers["Content-Encoding"] == "gzip"
+    probs = np.load(io.BytesIO(gzip.decompress(resp.get_data())))
+    assert probs.dtype == np.float64
+    assert np.allclose(probs[[0, 7]], 0.5) and np.isclose(probs.sum(), 1.0)
+
+
+def test_top_k_sparse():
+    client = app.test_client()
+    resp = client.post('/statevector', json={
+        "num_qubits": 3, "operations": GHZ + [{"type": "x", "qubit": 1}],
+        "top_k": 2, "format": "npy",
+    })
+    records = np.load(io.BytesIO(resp.get_data()))
+    assert sorted(records['index']) == [2, 5]
+    assert np.allclose(np.abs(records['value']) ** 2, 0.5)
+
+
+def test_invalid_options():
+    client = app.test_client()
+    resp = client.post('/statevector', json={"num_qubits": 1, "operations": GHZ[:1], "format": "csv"})
+    assert resp.status_code == 400
+
+
+if __name__ == "__main__":
+    test_raw_complex64_statevector()
+    test_npy_probabilities_gzip()
+    test_top_k_sparse()
+    test_invalid_options()
+    print("Export tests passed")
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import app as server
+
+client = server.app.test_client()
+
+
+class FakeGemini(BaseHTTPRequestHandler):
+    """Answers generateContent calls like the Gemini REST API."""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FakeGemini.requests.append((self.path, body))
+        text = "```\nH 0\nCX 0 1\n```"
+        payload = json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_generate_qasm_against_local_model():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeGemini)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    saved = {key: os.environ.get(key) for key in ("GEMINI_API_KEY", "GEMINI_BASE_URL")}
+    os.environ.update(GEMINI_API_KEY="test-key", GEMINI_BASE_URL=f"http://127.0.0.1:{httpd.server_port}")
+    server.qasm_generator = None
+    try:
+        first = client.post('/generate_qasm', json={"prompt": "bell state", "num_qubits": 2}).get_json()
+        second = client.post('/generate_qasm', json={"prompt": "bell state", "num_qubits": 2}).get_json()
+        other = client.post('/generate_qasm', json={"prompt": "bell state", "num_qubits": 3}).get_json()
+        generator = server.qasm_generator
+    finally:
+        httpd.shutdown()
+        server.qasm_generator = None
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    assert first == {"qasm": "H 0\nCX 0 1", "cached": False}
+    assert second == {"qasm": "H 0\nCX 0 1", "cached": True}
+    assert other["cached"] is False
+    # Only the two distinct (prompt, num_qubits) pairs reached the model, through one client
+    assert len(FakeGemini.requests) == 2
+    path, body = FakeGemini.requests[0]
+    assert path.endswith("models/gemini-2.5-flash:generateContent")
+    assert "indexed from 0 to 1" in body["contents"][0]["parts"][0]["text"]
+    assert generator is not None and generator._client is not None
+
+
+def test_response_cache_evicts_and_expires():
+    cache = server.ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.ttl = -1
+    assert cache.get("a") is None
+
+
+if __name__ == "__main__":
+    test_generate_qasm_against_local_model()
+    test_response_cache_evicts_and_expires()
+    print("generate_qasm tests passed")
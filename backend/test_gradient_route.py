@@ -0,0 +1,32 @@
+import numpy as np
+
+from app import app
+
+client = app.test_client()
+
+
+def test_gradient_route():
+    payload = {
+        "num_qubits": 2,
+        "operations": [
+            {"type": "ry", "qubit": 0, "theta": 0.3},
+            {"type": "cx", "control": 0, "target": 1},
+            {"type": "rz", "qubit": 1, "theta": 0.7},
+        ],
+        "observable": {"ZI": 1.0},
+    }
+    resp = client.post('/gradient', json=payload)
+    assert resp.status_code == 200
+    data = resp.get_json()
+    # <Z_1> = cos(θ) after RY(θ) and CNOT; RZ does not change it
+    assert np.isclose(data["expectation"], np.cos(0.3))
+    assert np.allclose(data["gradients"], [-np.sin(0.3), 0.0])
+    assert data["parameters"] == [0, 2]
+
+    for observable in ({}, {"Z": 1.0}, {"ZQ": 1.0}, {"ZZ": "1"}):
+        assert client.post('/gradient', json=dict(payload, observable=observable)).status_code == 400
+
+
+if __name__ == "__main__":
+    test_gradient_route()
+    print("Gradient route tests passed")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from app import app
+from jobs import JobQueue, QueueFull
+
+
+def wait_for(job, timeout=10):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_job_api_roundtrip():
+    client = app.test_client()
+    payload = {
+        "num_qubits": 2,
+        "shots": 200,
+        "operations": [
+            {"type": "h", "qubit": 0},
+            {"type": "measure", "qubit": 0},
+            {"type": "cx", "control": 0, "target": 1},
+            {"type": "measure", "qubit": 1},
+        ],
+    }
+    resp = client.post('/jobs', json=payload)
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+
+    deadline = time.time() + 10
+    while True:
+        resp = client.get(f'/jobs/{job_id}/result')
+        if resp.status_code != 202 or time.time() > deadline:
+            break
+        time.sleep(0.02)
+
+    assert resp.status_code == 200
+    counts = resp.get_json()["counts"]
+    assert set(counts) <= {"00", "11"}
+    assert sum(counts.values()) == 200
+
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status["status"] == "done"
+    assert status["progress"]["shots_done"] == 200
+    # h once before the first measurement, cx replayed for every shot
+    assert status["progress"]["gates_done"] == status["progress"]["gates_total"] == 1 + 200
+
+    assert client.get('/jobs/unknown').status_code == 404
+
+
+def test_priority_order_and_bounded_queue():
+    jobs = JobQueue(workers=1, max_queued=3)
+    gate = threading.Event()
+    order = []
+
+    blocker = jobs.submit(lambda job: gate.wait())
+    while blocker.status == 'queued':
+        time.sleep(0.01)
+
+    low = jobs.submit(lambda job: order.append('low'), priority=0)
+    high = jobs.submit(lambda job: order.append('high'), priority=5)
+    jobs.submit(lambda job: None)
+    try:
+        jobs.submit(lambda job: None)
+        assert False, "expected QueueFull"
+    except QueueFull:
+        pass
+
+    gate.set()
+    wait_for(low)
+    wait_for(high)
+    assert order == ['high', 'low']
+
+
+def test_cancel_running_job():
+    jobs = JobQueue(workers=1)
+
+    def spin(job):
+        while True:
+            job.update_progress(0, 0)
+            time.sleep(0.01)
+
+    job = jobs.submit(spin)
+    while job.status == 'queued':
+        time.sleep(0.01)
+    jobs.cancel(job.id)
+    assert wait_for(job).status == 'cancelled'
+
+
+if __name__ == "__main__":
+    test_job_api_roundtrip()
+    test_priority_order_and_bounded_queue()
+    test_cancel_running_job()
+    print("Job queue tests passed")
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import metrics
+from app import app
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_metrics_endpoint_reports_simulations():
+    client = app.test_client()
+    client.post('/simulate', json={"num_qubits": 2, "shots": 50, "operations": [
+        {"type": "h", "qubit": 0}, {"type": "cx", "control": 0, "target": 1},
+    ]})
+    client.post('/simulate', json={"num_qubits": 0, "operations": []})
+
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    text = resp.get_data(as_text=True)
+    assert 'simulator_request_duration_seconds_count{method="POST",route="/simulate",status="200"}' in text
+    assert 'simulator_errors_total{route="/simulate",type="http_400"}' in text
+    assert 'simulator_peak_statevector_bytes' in text
+    gates = [line for line in text.splitlines() if line.startswith('simulator_gates_total ')]
+    assert gates and float(gates[0].split()[1]) >= 2
+
+
+def test_multiprocess_aggregation():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=tmp)
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", "import metrics; metrics.GATES.inc(5)"],
+                           cwd=BACKEND, env=env, check=True)
+
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tmp
+        try:
+            body, _ = metrics.render()
+        finally:
+            del os.environ['PROMETHEUS_MULTIPROC_DIR']
+    assert b'simulator_gates_total 10.0' in body
+
+
+def test_simulate_profile_flag():
+    client = app.test_client()
+    # A circuit no other test has run, so nothing resumes from a checkpoint
+    resp = client.post('/simulate', json={"num_qubits": 2, "shots": 10, "profile": True, "operations": [
+        {"type": "ry", "qubit": 0, "theta": 0.123}, {"type": "cx", "control": 0, "target": 1},
+    ]})
+    profile = resp.get_json()["profile"]
+    assert {(row["phase"], row["op"]) for row in profile["summary"]} >= {("apply", "ry"), ("apply", "cx")}
+    assert profile["trace"]["traceEvents"][0]["ph"] == "X"
+
+    resp = client.post('/simulate', json={"num_qubits": 1, "shots": 10, "operations": [{"type": "h", "qubit": 0}]})
+    assert "profile" not in resp.get_json()
+
+
+if __name__ == "__main__":
+    test_metrics_endpoint_reports_simulations()
+    test_multiprocess_aggregation()
+    test_simulate_profile_flag()
+    print("Metrics tests passed")
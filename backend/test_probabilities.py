@@ -0,0 +1,42 @@
+import numpy as np
+
+from app import app
+
+client = app.test_client()
+
+GHZ = [
+    {"type": "h", "qubit": 0},
+    {"type": "cx", "control": 0, "target": 1},
+    {"type": "cx", "control": 0, "target": 2},
+]
+
+
+def test_simulate_exact_probabilities():
+    resp = client.post('/simulate', json={"num_qubits": 3, "shots": 0, "operations": GHZ})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert "counts" not in data and data["shots"] == 0
+    assert set(data["probabilities"]) == {"000", "111"}
+    assert np.allclose(list(data["probabilities"].values()), 0.5)
+
+    resp = client.post('/simulate', json={"num_qubits": 3, "shots": 0, "operations": GHZ + [{"type": "ry", "qubit": 0, "theta": 0.4}],
+                                          "top_k": 2, "threshold": 0.01})
+    assert len(resp.get_json()["probabilities"]) == 2
+
+    resp = client.post('/simulate/qasm?shots=0&top_k=1', data="H 0\nCX 0 1\n", content_type='text/plain')
+    assert len(resp.get_json()["probabilities"]) == 1
+
+
+def test_invalid_exact_options():
+    for extra in ({"top_k": 0}, {"threshold": 2}, {"shots": -1}):
+        resp = client.post('/simulate', json=dict({"num_qubits": 3, "shots": 0, "operations": GHZ}, **extra))
+        assert resp.status_code == 400
+
+    resp = client.post('/simulate/stream', json={"num_qubits": 3, "shots": 0, "operations": GHZ})
+    assert resp.status_code == 400
+
+
+if __name__ == "__main__":
+    test_simulate_exact_probabilities()
+    test_invalid_exact_options()
+    print("Probability tests passed")
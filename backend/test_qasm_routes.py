@@ -0,0 +1,37 @@
+from app import app
+
+
+def test_simulate_qasm_body():
+    client = app.test_client()
+    program = 'OPENQASM 2.0;\ninclude "qelib1.inc";\nqreg q[2];\nh q[0];\ncx q[0],q[1];\n'
+    resp = client.post('/simulate/qasm?shots=500', data=program, content_type='text/plain')
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert set(data["counts"]) <= {"00", "11"}
+    assert data["num_operations"] == 4  # two gates plus auto-measurement
+    assert data["parse_ms"] >= 0
+
+    resp = client.post('/simulate/qasm', data="H 0\nBOGUS 1\n", content_type='text/plain')
+    assert resp.status_code == 400
+    assert "line 2" in resp.get_json()["error"]
+
+    for angle in ("1/0", "9**9**9"):
+        program = f'OPENQASM 2.0;\nqreg q[1];\nrx({angle}) q[0];\n'
+        resp = client.post('/simulate/qasm', data=program, content_type='text/plain')
+        assert resp.status_code == 400
+        assert "line 3" in resp.get_json()["error"]
+
+
+def test_export_qasm_lite():
+    client = app.test_client()
+    resp = client.post('/export_qasm?dialect=lite', json={
+        "num_qubits": 2,
+        "operations": [{"type": "h", "qubit": 0}, {"type": "cp", "control": 0, "target": 1, "theta": 0.5}],
+    })
+    assert resp.get_data(as_text=True) == "H 0\nCP 0 1 0.5\n"
+
+
+if __name__ == "__main__":
+    test_simulate_qasm_body()
+    test_export_qasm_lite()
+    print("QASM route tests passed")
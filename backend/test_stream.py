@@ -0,0 +1,67 @@
+import json
+
+from app import app
+
+BELL = [
+    {"type": "h", "qubit": 0},
+    {"type": "cx", "control": 0, "target": 1},
+]
+
+
+def read_ndjson(resp):
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines() if line]
+
+
+def test_stream_sends_running_counts():
+    client = app.test_client()
+    resp = client.post('/simulate/stream', json={
+        "num_qubits": 2, "shots": 1000, "batch_size": 250, "operations": BELL,
+    })
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+
+    messages = read_ndjson(resp)
+    assert [m["shots_done"] for m in messages[:-1]] == [250, 500, 750]
+    final = messages[-1]
+    assert final["done"] and not final["stopped_early"]
+    assert final["shots"] == 1000
+    assert set(final["counts"]) <= {"00", "11"}
+
+
+def test_stream_stops_at_requested_precision():
+    client = app.test_client()
+    resp = client.post('/simulate/stream', json={
+        "num_qubits": 2, "shots": 100000, "batch_size": 100, "precision": 0.02,
+        "operations": BELL,
+    })
+    final = read_ndjson(resp)[-1]
+    assert final["stopped_early"]
+    assert final["standard_error"] <= 0.02
+    assert final["shots"] < 100000
+
+    # One outcome in every shot so far does not count as zero error
+    resp = client.post('/simulate/stream', json={
+        "num_qubits": 1, "shots": 1000, "batch_size": 10, "precision": 0.05,
+        "operations": [{"type": "x", "qubit": 0}],
+    })
+    final = read_ndjson(resp)[-1]
+    assert final["stopped_early"] and final["shots"] == 20
+
+
+def test_stream_server_sent_events():
+    client = app.test_client()
+    resp = client.post('/simulate/stream', json={
+        "num_qubits": 1, "shots": 10, "batch_size": 5, "format": "sse",
+        "operations": [{"type": "x", "qubit": 0}],
+    })
+    assert resp.mimetype == 'text/event-stream'
+    events = [e for e in resp.get_data(as_text=True).split("\n\n") if e]
+    assert all(e.startswith("data: ") for e in events)
+    assert json.loads(events[-1][len("data: "):])["counts"] == {"1": 10}
+
+
+if __name__ == "__main__":
+    test_stream_sends_running_counts()
+    test_stream_stops_at_requested_precision()
+    test_stream_server_sent_events()
+    print("Streaming tests passed")
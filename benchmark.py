@@ -0,0 +1,248 @@
+"""
+Benchmark suite for quantum_lib and the Flask /simulate path.
+
+    python benchmark.py                      # run and compare with the baseline
+    python benchmark.py --save               # run and record a new baseline
+    python benchmark.py --qubits 2,4,6 --only ghz,qft
+
+Every workload is timed on each qubit count of the grid (best of --repeats),
+along with the cold-start time to import quantum_lib and the backend app,
+and compared against the JSON baseline; runs slower than the baseline by
+more than --threshold are reported and the script exits with status 1.
+Baselines are machine specific, so record one per host.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import quantum_lib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmark_baseline.json")
+SHOTS = 256
+# Density matrices are 4^n and noisy runs embed every Kraus operator
+MAX_NOISY_QUBITS = 6
+
+
+def ghz(n):
+    circuit = quantum_lib.QuantumCircuit(n)
+    circuit.h(0)
+    for q in range(n - 1):
+        circuit.cx(q, q + 1)
+    return circuit
+
+
+def qft(n):
+    circuit = quantum_lib.QuantumCircuit(n)
+    for q in range(0, n, 2):
+        circuit.x(q)
+    for target in reversed(range(n)):
+        circuit.h(target)
+        for control in reversed(range(target)):
+            circuit.cp(control, target, np.pi / 2 ** (target - control))
+    for q in range(n // 2):
+        circuit.swap(q, n - 1 - q)
+    return circuit
+
+
+def random_layers(n, depth=None, seed=1234):
+    rng = np.random.default_rng(seed)
+    circuit = quantum_lib.QuantumCircuit(n)
+    for layer in range(depth or n):
+        for q in range(n):
+            [circuit.rx, circuit.ry, circuit.rz][rng.integers(3)](q, rng.uniform(0, 2 * np.pi))
+        for q in range(layer % 2, n - 1, 2):
+            circuit.cx(q, q + 1)
+    return circuit
+
+
+def measured(circuit):
+    for q in range(circuit.num_qubits):
+        circuit.measure(q, q)
+    return circuit
+
+
+def mid_circuit(n):
+    """Measures half the register halfway through, forcing per-shot replay."""
+    circuit = random_layers(n, depth=2)
+    for q in range(0, n, 2):
+        circuit.measure(q, q)
+    for q in range(n):
+        circuit.h(q)
+    for q in range(1, n, 2):
+        circuit.measure(q, q)
+    return circuit
+
+
+def _embed(matrix, qubit, n):
+    """Single-qubit matrix on qubit (LSB ordering) as an n-qubit Operator."""
+    result = quantum_lib.Operator([[1]])
+    for i in range(n):
+        factor = matrix if i == n - 1 - qubit else np.eye(2)
+        result = result.tensor(quantum_lib.Operator(factor))
+    return result
+
+
+def noisy_evolution(n):
+    """GHZ preparation with depolarizing noise after every layer, on a DensityMatrix."""
+    ket = quantum_lib.Ket([1] + [0] * (2 ** n - 1))
+    gates = [quantum_lib.Operator.hadamard(n - 1, n)] + [quantum_lib.Operator.cnot(q, q + 1, n) for q in range(n - 1)]
+    channels = [
+        quantum_lib.QuantumChannel([_embed(K.matrix, q, n) for K in quantum_lib.QuantumChannel.depolarizing(0.01).kraus_operators])
+        for q in range(n)
+    ]
+
+    def run():
+        rho = quantum_lib.DensityMatrix(ket.outer_product(ket.dagger()))
+        for gate in gates:
+            rho = rho.evolve(gate)
+            for channel in channels:
+                rho = channel.apply(rho)
+        return rho
+    return run
+
+
+def _simulator_run(build, shots=SHOTS):
+    def workload(n):
+        circuit = build(n)
+        return lambda: quantum_lib.Simulator().run(circuit, shots=shots)
+    return workload
+
+
+def _flask_simulate(n):
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+    import app as server
+
+    client = server.app.test_client()
+    payload = {
+        "num_qubits": n,
+        "shots": SHOTS,
+        "operations": [{"type": "h", "qubit": 0}] + [
+            {"type": "cx", "control": q, "target": q + 1} for q in range(n - 1)
+        ],
+    }
+
+    def run():
+        # Every repeat does the full simulation instead of resuming from a checkpoint
+        server.checkpoints.clear()
+        resp = client.post('/simulate', json=payload)
+        assert resp.status_code == 200, resp.get_json()
+    return run
+
+
+WORKLOADS = {
+    "ghz": _simulator_run(lambda n: measured(ghz(n))),
+    "ghz_statevector": _simulator_run(ghz),
+    "qft": _simulator_run(lambda n: measured(qft(n))),
+    "random_layers": _simulator_run(lambda n: measured(random_layers(n))),
+    "mid_circuit": _simulator_run(mid_circuit, shots=32),
+    "noisy_density_matrix": noisy_evolution,
+    "flask_simulate": _flask_simulate,
+}
+
+
+# Cold start: fresh interpreters importing the engine and the backend app
+IMPORTS = {
+    "quantum_lib": (ROOT, "import quantum_lib"),
+    "app": (os.path.join(ROOT, "backend"), "import app"),
+}
+
+
+def import_time(cwd, statement):
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_suite(qubits, repeats=3, only=None):
+    """
+    Returns {"<workload>/<n>": seconds} for every workload and qubit count,
+    plus {"import/<module>": seconds} for the cold-start imports.
+    """
+    results = {}
+    if not only or "import" in only:
+        for module, (cwd, statement) in IMPORTS.items():
+            results[f"import/{module}"] = min(import_time(cwd, statement) for _ in range(repeats))
+            print(f"{'import/' + module:<28} {results[f'import/{module}'] * 1e3:>10.2f} ms", flush=True)
+    for name, workload in WORKLOADS.items():
+        if only and name not in only:
+            continue
+        for n in qubits:
+            if name == "noisy_density_matrix" and n > MAX_NOISY_QUBITS:
+                continue
+            fn = workload(n)
+            results[f"{name}/{n}"] = best_time(fn, repeats)
+            print(f"{name + '/' + str(n):<28} {results[f'{name}/{n}'] * 1e3:>10.2f} ms", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns (key, baseline_seconds, seconds, ratio) for every result slower
+    than its baseline by more than threshold (0.25 = 25%).
+    """
+    regressions = []
+    for key, seconds in results.items():
+        old = baseline.get(key)
+        if old and seconds / old > 1 + threshold:
+            regressions.append((key, old, seconds, seconds / old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulator and compare with a baseline.")
+    parser.add_argument("--qubits", default="2,4,6,8", help="comma separated qubit counts")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", default="", help="comma separated workloads: import," + ",".join(WORKLOADS))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--save", action="store_true", help="record the results as the new baseline")
+    args = parser.parse_args()
+
+    qubits = [int(n) for n in args.qubits.split(",")]
+    only = {name for name in args.only.split(",") if name}
+    unknown = only - set(WORKLOADS) - {"import"}
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    results = run_suite(qubits, args.repeats, only)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(),
+                       "numpy": np.__version__, "results": results}, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for key, old, new, ratio in regressions:
+        print(f"REGRESSION {key}: {old * 1e3:.2f} ms -> {new * 1e3:.2f} ms ({ratio:.2f}x)")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,22 @@
+import ast
+import atexit
+import functools
+import hashlib
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import operator
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
 import numpy as np
-import scipy.linalg
 
 class Ket:
     def __init__(self, coef):
@@ -131,11 +148,20 @@ class Operator:
     def __matmul__(self,another):
         return Operator(np.matmul(self.matrix , another.matrix))
 
+    def _apply(self, array):
+        """
+        self.matrix @ array; structured subclasses override this to avoid
+        building the full matrix.
+        """
+        return self.matrix @ array
+
     def op(self, another):
+        if isinstance(another, DensityMatrix):
+            return another.evolve(self)
         if not isinstance(another,Ket):
             raise ValueError('Cannot Operate')
         else:
-            return Ket(self.matrix@another.coef)
+            return Ket(self._apply(another.coef))
         
     def dagger(self):
         return Operator(np.conjugate(self.matrix).T)
@@ -156,12 +182,10 @@ class Operator:
             raise ValueError("It is not a square Matrix")
         
     def tensor(self, *args):
-        result = self.matrix
-        for another in args:
-            if not isinstance(another, Operator):
-                raise ValueError("Tensor product can only be performed with Operators.")
-            result = np.kron(result, another.matrix)
-        return Operator(result)
+        """
+        Lazy Kronecker product with the given Operators, see KronOperator.
+        """
+        return KronOperator([self.matrix]).tensor(*args)
         
     def commutator(self, another):
         if not isinstance(another, Operator):
@@ -269,16 +293,10 @@ class Operator:
         if control == target:
             raise ValueError("Control and target qubit indices must be different.")
 
-        dim = 2 ** no_of_qubits
-        cnot_matrix = np.zeros((dim, dim), dtype=complex)
-        for i in range(dim):
-            binary = format(i, f'0{no_of_qubits}b')
-            bits = list(binary)
-            if bits[no_of_qubits - 1 - control] == '1':
-                bits[no_of_qubits - 1 - target] = '1' if bits[no_of_qubits - 1 - target] == '0' else '0'
-            j = int(''.join(bits), 2)
-            cnot_matrix[j, i] = 1  
-        return Operator(cnot_matrix)
+        # Flip the target bit of every basis index whose control bit is set
+        # (LSB ordering: qubit q is bit q); CNOT is its own inverse
+        index = np.arange(2 ** no_of_qubits)
+        return PermutationOperator(index ^ (((index >> control) & 1) << target))
     
     @staticmethod
     def hadamard(qubit, no_of_qubits):
@@ -303,15 +321,9 @@ class Operator:
         if qubit < 0 or qubit >= no_of_qubits:
             raise ValueError("Qubit index must be within the range of the number of qubits.")
         
-        P = np.array([[1, 0], [0, np.exp(1j * theta)]], dtype=complex)
-        result = Operator([[1]])
-        for i in range(no_of_qubits):
-            # Use LSB ordering to match CNOT: qubit 0 is last in tensor product
-            if i == (no_of_qubits - 1 - qubit):
-                result = result.tensor(Operator(P))
-            else:
-                result = result.tensor(Operator(Operator.identity))
-        return result
+        # e^(i*theta) on basis states with the qubit set (LSB ordering, as CNOT)
+        bits = (np.arange(2 ** no_of_qubits) >> qubit) & 1
+        return DiagonalOperator(np.where(bits == 1, np.exp(1j * theta), 1))
 
 
     @staticmethod
@@ -326,17 +338,9 @@ class Operator:
         if control == target:
             raise ValueError("Control and target must be different.")
         
-        dim = 2 ** no_of_qubits
-        cp_matrix = np.eye(dim, dtype=complex)
-        
-        for i in range(dim):
-             # Format to binary string. Index 0 of string corresponds to MSB?
-             # cnot implementation uses bits[no_of_qubits - 1 - control]
-             binary = format(i, f'0{no_of_qubits}b')
-             if binary[no_of_qubits - 1 - control] == '1' and binary[no_of_qubits - 1 - target] == '1':
-                  cp_matrix[i, i] = np.exp(1j * theta)
-        
-        return Operator(cp_matrix)
+        index = np.arange(2 ** no_of_qubits)
+        both = (index >> control) & (index >> target) & 1
+        return DiagonalOperator(np.where(both == 1, np.exp(1j * theta), 1))
 
     @staticmethod
     def t_gate(qubit, no_of_qubits):
@@ -348,23 +352,28 @@ class Operator:
 
     @staticmethod
     def swap(qubit1, qubit2, no_of_qubits):
-        cnot12 = Operator.cnot(qubit1, qubit2, no_of_qubits)
-        cnot21 = Operator.cnot(qubit2, qubit1, no_of_qubits)
-        return cnot12 @ cnot21 @ cnot12
+        if qubit1 < 0 or qubit1 >= no_of_qubits or qubit2 < 0 or qubit2 >= no_of_qubits:
+            raise ValueError("Qubit indices must be within the range of the number of qubits.")
+        if qubit1 == qubit2:
+            raise ValueError("Qubit indices must be different.")
+
+        # Exchange the two bits of every basis index where they differ
+        # (CNOT(1,2) CNOT(2,1) CNOT(1,2) as one permutation)
+        index = np.arange(2 ** no_of_qubits)
+        differ = ((index >> qubit1) ^ (index >> qubit2)) & 1
+        return PermutationOperator(index ^ (differ << qubit1) ^ (differ << qubit2))
 
     @staticmethod
     def cz(control, target, no_of_qubits):
-        # Manually construct H on target using LSB ordering
-        H = (1 / np.sqrt(2)) * np.array([[1, 1], [1, -1]], dtype=complex)
-        h_target = Operator([[1]])
-        for i in range(no_of_qubits):
-            if i == (no_of_qubits - 1 - target):
-                h_target = h_target.tensor(Operator(H))
-            else:
-                h_target = h_target.tensor(Operator(Operator.identity))
-                
-        cnot = Operator.cnot(control, target, no_of_qubits)
-        return h_target @ cnot @ h_target
+        if control < 0 or control >= no_of_qubits or target < 0 or target >= no_of_qubits:
+            raise ValueError("Control and target qubit indices must be within the range of the number of qubits.")
+        if control == target:
+            raise ValueError("Control and target qubit indices must be different.")
+
+        # H CNOT H on the target: -1 on basis states where both qubits are set
+        index = np.arange(2 ** no_of_qubits)
+        both = (index >> control) & (index >> target) & 1
+        return DiagonalOperator(np.where(both == 1, -1, 1))
     
     @staticmethod
     def rx(qubit, theta, no_of_qubits):
@@ -402,6 +411,286 @@ class Operator:
                 result = result.tensor(Operator(Operator.identity))
         return result
 
+# Below this dimension one cached dense matmul is cheaper than applying
+# Kronecker factors one at a time
+_DENSE_APPLY_DIM = 64
+
+
+class KronOperator(Operator):
+    def __init__(self, factors):
+        '''
+        Lazy Kronecker product factors[0] ⊗ factors[1] ⊗ ... of matrices,
+        as returned by Operator.tensor. Identity factors cost nothing when
+        applied; the full matrix is only built when .matrix is read.
+
+        factors: list of 2D arrays, first factor is the most significant
+        '''
+        self.factors = []
+        self._identity = []
+        self._matrix = None
+        self._extend(factors)
+
+    def _extend(self, factors):
+        for factor in factors:
+            factor = np.asarray(factor)
+            if factor.ndim != 2:
+                raise ValueError("Kronecker factors must be matrices.")
+            if factor.shape == (1, 1) and factor[0, 0] == 1:
+                continue  # the Operator([[1]]) seed of a tensor chain
+            self.factors.append(factor)
+            self._identity.append(factor.shape[0] == factor.shape[1] and np.array_equal(factor, np.eye(len(factor))))
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = functools.reduce(np.kron, self.factors, np.ones((1, 1), dtype=int))
+        return self._matrix
+
+    @property
+    def shape(self):
+        rows = int(np.prod([f.shape[0] for f in self.factors]))
+        cols = int(np.prod([f.shape[1] for f in self.factors]))
+        return rows, cols
+
+    def _apply(self, array):
+        """
+        self.matrix @ array, one factor (tensor axis) at a time.
+        """
+        if self._matrix is not None or self.shape[1] <= _DENSE_APPLY_DIM:
+            return self.matrix @ array
+        in_dims = [f.shape[1] for f in self.factors]
+        tensor = np.asarray(array).reshape(in_dims + list(array.shape[1:]))
+        for axis, (factor, identity) in enumerate(zip(self.factors, self._identity)):
+            if not identity:
+                tensor = np.moveaxis(np.tensordot(factor, tensor, axes=(1, axis)), 0, axis)
+        return tensor.reshape((self.shape[0],) + array.shape[1:])
+
+    def __matmul__(self, another):
+        if isinstance(another, KronOperator):
+            groups = _align_factors(self.factors, another.factors)
+            if groups is not None:
+                return KronOperator([_kron_all(a) @ _kron_all(b) for a, b in groups])
+        return Operator(self._apply(another.matrix))
+
+    def __rmatmul__(self, another):
+        # another @ self == (self^T @ another^T)^T
+        transposed = KronOperator([f.T for f in self.factors])
+        return Operator(transposed._apply(np.asarray(another.matrix).T).T)
+
+    def __mul__(self, scalar):
+        if not self.factors:
+            return KronOperator([[[scalar]]])
+        return KronOperator([scalar * self.factors[0]] + self.factors[1:])
+
+    def __rmul__(self, scalar):
+        return self.__mul__(scalar)
+
+    def tensor(self, *args):
+        result = KronOperator([])
+        result.factors = list(self.factors)
+        result._identity = list(self._identity)
+        for another in args:
+            if not isinstance(another, Operator):
+                raise ValueError("Tensor product can only be performed with Operators.")
+            result._extend(another.factors if isinstance(another, KronOperator) else [another.matrix])
+        return result
+
+    def dagger(self):
+        return KronOperator([np.conjugate(f).T for f in self.factors])
+
+    def unitary(self):
+        if self.shape[0] != self.shape[1]:
+            raise ValueError("It is not a square Matrix")
+        # A product of unitary factors is unitary; otherwise check the full matrix
+        if all(identity or Operator(f).unitary() for f, identity in zip(self.factors, self._identity)):
+            return True
+        return super().unitary()
+
+    def __repr__(self):
+        return f'KronOperator({[f.shape for f in self.factors]})'
+
+
+def _kron_all(factors):
+    return functools.reduce(np.kron, factors)
+
+
+def _align_factors(left, right):
+    """
+    Groups consecutive factors of left (by column dimension) and right (by
+    row dimension) so each pair of groups has matching sizes, making
+    (⊗A_i) @ (⊗B_i) = ⊗(A_i @ B_i) valid. Returns [(left_group, right_group)]
+    or None when the total dimensions differ.
+    """
+    groups = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        a, b = [left[i]], [right[j]]
+        da, db = left[i].shape[1], right[j].shape[0]
+        i, j = i + 1, j + 1
+        while da != db:
+            if da < db and i < len(left):
+                a.append(left[i])
+                da *= left[i].shape[1]
+                i += 1
+            elif db < da and j < len(right):
+                b.append(right[j])
+                db *= right[j].shape[0]
+                j += 1
+            else:
+                return None
+        groups.append((a, b))
+    if i < len(left) or j < len(right) or not groups:
+        return None
+    return groups
+
+
+class PermutationOperator(Operator):
+    def __init__(self, perm):
+        '''
+        Permutation matrix stored as an index array: (P v)[i] = v[perm[i]],
+        i.e. row i has its single 1 in column perm[i]. Products, daggers and
+        application to states are O(2^n) index operations.
+        '''
+        self.perm = np.asarray(perm, dtype=np.intp)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            dim = len(self.perm)
+            self._matrix = np.zeros((dim, dim), dtype=complex)
+            self._matrix[np.arange(dim), self.perm] = 1
+        return self._matrix
+
+    def _apply(self, array):
+        return np.asarray(array)[self.perm]
+
+    def __matmul__(self, another):
+        if isinstance(another, PermutationOperator):
+            return PermutationOperator(another.perm[self.perm])
+        return Operator(self._apply(another.matrix))
+
+    def __rmatmul__(self, another):
+        # Column k of another lands in column perm[k]
+        another = np.asarray(another.matrix)
+        result = np.empty(another.shape, dtype=np.result_type(another, complex))
+        result[:, self.perm] = another
+        return Operator(result)
+
+    def dagger(self):
+        return PermutationOperator(np.argsort(self.perm))
+
+    def hermitian(self):
+        return bool(np.array_equal(self.perm[self.perm], np.arange(len(self.perm))))
+
+    def unitary(self):
+        return True
+
+    def __repr__(self):
+        return f'PermutationOperator({self.perm})'
+
+
+class DiagonalOperator(Operator):
+    def __init__(self, diagonal):
+        '''
+        Diagonal matrix stored as its diagonal vector. Products, daggers and
+        application to states are O(2^n) elementwise operations.
+        '''
+        self.diagonal = np.asarray(diagonal, dtype=complex)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = np.diag(self.diagonal)
+        return self._matrix
+
+    def _apply(self, array):
+        array = np.asarray(array)
+        return self.diagonal.reshape((-1,) + (1,) * (array.ndim - 1)) * array
+
+    def __matmul__(self, another):
+        if isinstance(another, DiagonalOperator):
+            return DiagonalOperator(self.diagonal * another.diagonal)
+        return Operator(self._apply(another.matrix))
+
+    def __rmatmul__(self, another):
+        return Operator(np.asarray(another.matrix) * self.diagonal)
+
+    def __mul__(self, scalar):
+        return DiagonalOperator(scalar * self.diagonal)
+
+    def __rmul__(self, scalar):
+        return self.__mul__(scalar)
+
+    def dagger(self):
+        return DiagonalOperator(np.conjugate(self.diagonal))
+
+    def hermitian(self):
+        return bool(np.array_equal(self.diagonal.imag, np.zeros(len(self.diagonal))))
+
+    def unitary(self):
+        # Every diagonal entry must be a phase; rounding in e^(i*theta) makes
+        # an exact comparison meaningless here
+        return bool(np.allclose(np.abs(self.diagonal), 1))
+
+    def __repr__(self):
+        return f'DiagonalOperator({self.diagonal})'
+
+
+class SubsystemOperator(Operator):
+    def __init__(self, gate, qubits, no_of_qubits):
+        '''
+        A 2^k x 2^k gate on k qubits of an n-qubit register, identity on the
+        rest. Bit j of the gate's row/column index is qubits[j] (LSB
+        ordering, as for the register). Applied with one tensor contraction
+        over those axes; the full matrix is only built when .matrix is read.
+        '''
+        self.qubits = tuple(int(q) for q in qubits)
+        self.no_of_qubits = no_of_qubits
+        if any(q < 0 or q >= no_of_qubits for q in self.qubits):
+            raise ValueError("Qubit indices must be within the range of the number of qubits.")
+        if len(set(self.qubits)) != len(self.qubits):
+            raise ValueError("Qubit indices must be different.")
+        self.gate = np.asarray(gate, dtype=complex)
+        dim = 2 ** len(self.qubits)
+        if self.gate.shape != (dim, dim):
+            raise ValueError(f"A gate on {len(self.qubits)} qubit(s) must be {dim}x{dim}.")
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = self._apply(np.eye(2 ** self.no_of_qubits, dtype=complex))
+        return self._matrix
+
+    def _apply(self, array):
+        array = np.asarray(array)
+        n, k = self.no_of_qubits, len(self.qubits)
+        tensor = array.reshape((2,) * n + array.shape[1:])
+        # Reshaped gate axis a (and k + a) is qubits[k-1-a]; qubit q is tensor axis n-1-q
+        axes = [n - 1 - q for q in reversed(self.qubits)]
+        gate = self.gate.reshape((2,) * (2 * k))
+        result = np.tensordot(gate, tensor, axes=(list(range(k, 2 * k)), axes))
+        return np.moveaxis(result, list(range(k)), axes).reshape(array.shape)
+
+    def __mul__(self, scalar):
+        return SubsystemOperator(scalar * self.gate, self.qubits, self.no_of_qubits)
+
+    def __rmul__(self, scalar):
+        return self.__mul__(scalar)
+
+    def dagger(self):
+        return SubsystemOperator(np.conjugate(self.gate).T, self.qubits, self.no_of_qubits)
+
+    def unitary(self):
+        # Same tolerance as the validation of custom gates, see _validated_gate
+        return bool(np.allclose(self.gate.conj().T @ self.gate, np.eye(len(self.gate))))
+
+    def __repr__(self):
+        return f'SubsystemOperator({self.gate.shape}, qubits={self.qubits})'
+
+
 class DensityMatrix(Operator):
     def __init__(self, matrix):
         super().__init__(matrix)
@@ -431,6 +720,8 @@ class DensityMatrix(Operator):
         if not isinstance(another, DensityMatrix):
             raise ValueError("Fidelity can only be calculated with another DensityMatrix.")
         
+        import scipy.linalg  # only needed here; keeps scipy out of the import path
+
         sqrt_rho = scipy.linalg.sqrtm(self.matrix)
         product = sqrt_rho @ another.matrix @ sqrt_rho
         sqrt_product = scipy.linalg.sqrtm(product)
@@ -441,15 +732,20 @@ class DensityMatrix(Operator):
     def evolve(self, operator):
         if not isinstance(operator, Operator):
             raise ValueError("Evolution can only be performed with an Operator.")
-        U = operator.matrix
-        U_dagger = operator.dagger().matrix
-        new_matrix = U @ self.matrix @ U_dagger
-        return DensityMatrix(new_matrix)
+        return DensityMatrix(_conjugate_by(operator, self.matrix))
     def partial_trace(self, keep, dims):
         traced_operator = super().partial_trace(keep, dims)
         return DensityMatrix(traced_operator.matrix)
     
     
+def _conjugate_by(operator, rho):
+    """
+    operator @ rho @ operator^dagger, computed as (U (U rho)^dagger)^dagger so
+    structured operators never build their full matrix.
+    """
+    return np.conjugate(operator._apply(np.conjugate(operator._apply(rho)).T)).T
+
+
 class QuantumChannel:
     def __init__(self, kraus_operators):
         '''
@@ -463,7 +759,7 @@ class QuantumChannel:
         
         new_matrix = np.zeros_like(density_matrix.matrix, dtype=complex)
         for K in self.kraus_operators:
-            new_matrix += K.matrix @ density_matrix.matrix @ K.dagger().matrix
+            new_matrix += _conjugate_by(K, density_matrix.matrix)
         return DensityMatrix(new_matrix)
     @classmethod
     def amplitude_damping(cls, gamma):
@@ -671,6 +967,23 @@ class QuantumCircuit:
     def swap(self, qubit1, qubit2):
         self.operations.append(('swap', qubit1, qubit2))
 
+    def custom(self, qubits, matrix):
+        """
+        Apply a 2^k x 2^k unitary to a qubit or a list of k qubits; bit j
+        of the matrix index is qubits[j]. The matrix is validated here.
+        """
+        if np.ndim(qubits) == 0:
+            qubits = int(qubits)
+            count = 1
+        else:
+            qubits = tuple(int(q) for q in qubits)
+            count = len(qubits)
+            if len(set(qubits)) != count:
+                raise ValueError("Custom gate qubits must be different.")
+        if any(q < 0 or q >= self.num_qubits for q in _op_qubits(('custom', qubits))):
+            raise ValueError("Qubit indices must be within the range of the number of qubits.")
+        self.operations.append(('custom', qubits, _validated_gate(matrix, count)))
+
     def measure(self, qubit, cbit):
         """
         Measure qubit and store in classical bit cbit.
@@ -679,233 +992,2333 @@ class QuantumCircuit:
         self.operations.append(('measure', qubit, cbit))
 
 
-class Simulator:
-    def __init__(self):
+_QASM_ANGLE_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Pow: operator.pow,
+    ast.USub: operator.neg, ast.UAdd: operator.pos,
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _qasm_angle(expr):
+    """
+    Evaluates a gate parameter such as '0.5', 'pi/2' or '-3*pi/4'.
+    """
+    def ev(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return float(node.value)
+        if isinstance(node, ast.Name) and node.id == 'pi':
+            return np.pi
+        if isinstance(node, ast.BinOp) and type(node.op) in _QASM_ANGLE_OPS:
+            return _QASM_ANGLE_OPS[type(node.op)](ev(node.left), ev(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _QASM_ANGLE_OPS:
+            return _QASM_ANGLE_OPS[type(node.op)](ev(node.operand))
+        raise ValueError(f"Unsupported parameter expression '{expr}'")
+
+    try:
+        value = ev(ast.parse(expr.strip(), mode='eval').body)
+    except (SyntaxError, ArithmeticError, TypeError):
+        # ArithmeticError: 1/0, 9**9**9; TypeError: complex results compared or converted
+        raise ValueError(f"Unsupported parameter expression '{expr}'")
+    if isinstance(value, complex) or not np.isfinite(value):
+        raise ValueError(f"Parameter expression '{expr}' is not a finite real number")
+    return value
+
+
+def _u3_matrix(theta, phi, lam):
+    return np.array([[np.cos(theta / 2), -np.exp(1j * lam) * np.sin(theta / 2)],
+                     [np.exp(1j * phi) * np.sin(theta / 2), np.exp(1j * (phi + lam)) * np.cos(theta / 2)]],
+                    dtype=complex)
+
+
+def _qasm_append(circuit, name, params, qubits):
+    """
+    Appends one gate to the circuit. Shared by the OpenQASM 2.0 and QASM-lite
+    readers; `name` is lower case, `params` are floats, `qubits` flat indices.
+    """
+    ops = circuit.operations
+    arity = {'cx': 2, 'cnot': 2, 'cz': 2, 'swap': 2, 'cp': 2, 'cu1': 2, 'cphase': 2}.get(name, 1)
+    if len(qubits) != arity:
+        raise ValueError(f"{name} takes {arity} qubit(s), got {len(qubits)}")
+
+    if name in ('h', 'x', 'y', 'z', 's', 't'):
+        ops.append((name, qubits[0]))
+    elif name in ('rx', 'ry', 'rz'):
+        ops.append((name, qubits[0], params[0]))
+    elif name in ('phase', 'p', 'u1'):
+        ops.append(('phase', qubits[0], params[0]))
+    elif name == 'sdg':
+        ops.append(('phase', qubits[0], -np.pi / 2))
+    elif name == 'tdg':
+        ops.append(('phase', qubits[0], -np.pi / 4))
+    elif name == 'u2':
+        ops.append(('custom', qubits[0], _u3_matrix(np.pi / 2, params[0], params[1])))
+    elif name in ('u3', 'u'):
+        ops.append(('custom', qubits[0], _u3_matrix(*params[:3])))
+    elif name in ('cx', 'cnot'):
+        ops.append(('cx', qubits[0], qubits[1]))
+    elif name == 'cz':
+        ops.append(('cz', qubits[0], qubits[1]))
+    elif name in ('cp', 'cu1', 'cphase'):
+        ops.append(('cp', qubits[0], qubits[1], params[0]))
+    elif name == 'swap':
+        ops.append(('swap', qubits[0], qubits[1]))
+    elif name == 'id':
         pass
+    else:
+        raise ValueError(f"Unsupported gate '{name}'")
 
-    def run(self, circuit, shots=1024):
-        # Check if we need Monte Carlo simulation (intermediate measurements)
-        # We look for 'measure' operations in the circuit
-        has_measure_ops = any(op[0] == 'measure' for op in circuit.operations)
 
-        if not has_measure_ops and not circuit.measurements:
-            # No measurements at all
-            final_state = self._simulate_state(circuit)
-            return {'statevector': final_state}
+def _qasm_lines(source):
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    for lineno, line in enumerate(source, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        yield lineno, line.split('//', 1)[0]
 
-        # If we have measure ops, we MUST do shot-based simulation because
-        # the state collapses differently each time.
-        # Even if we don't have explicit measure ops but have measurements list
-        # (old style or implicit at end), the old logic worked. 
-        # But to be consistent with "Collapse" behavior, let's use the new engine 
-        # if there are ANY explicit measure instructions in the operations list.
-        
-        if has_measure_ops:
-            counts = {}
-            for _ in range(shots):
-                # Run single shot
-                _, measured_bits = self._simulate_shot(circuit)
-                
-                # measured_bits is a dict {cbit: val}
-                # We need to construct the bitstring
-                if not measured_bits:
-                    continue
-                
-                # Determine max cbit index
-                max_cbit = 0
-                if circuit.measurements:
-                     max_cbit = max(c for _, c in circuit.measurements)
-                
-                # Also check dynamic measurements from simulation
-                if measured_bits:
-                    max_cbit = max(max_cbit, max(measured_bits.keys()))
-
-                # Create bitstring c[n]...c[0]
-                c_reg = ['0'] * (max_cbit + 1)
-                for c_idx, val in measured_bits.items():
-                    c_reg[c_idx] = str(val)
-                
-                c_result = "".join(reversed(c_reg))
-                counts[c_result] = counts.get(c_result, 0) + 1
-            
-            return counts
-        
+
+def parse_qasm(source, num_qubits=None, max_ops=None, max_statement_length=4096):
+    """
+    Builds a QuantumCircuit from OpenQASM 2.0 or QASM-lite text.
+
+    source: a string, or any iterable of lines (str or bytes) such as an open
+            file or a request stream. Lines are consumed one at a time, so
+            memory use does not depend on the length of the program beyond
+            the circuit itself.
+    num_qubits: register size for QASM-lite ('H 0', 'CX 0 1', 'RX 0 1.57',
+                'MEASURE 0 [cbit]'); when omitted it is inferred from the
+                highest qubit index. OpenQASM programs size the register
+                from their qreg declarations.
+    max_ops: reject programs with more operations than this
+    max_statement_length: reject statements (or lines) longer than this
+
+    The dialect is OpenQASM 2.0 when the first statement is 'OPENQASM ...',
+    QASM-lite otherwise. Raises ValueError naming the offending line.
+    """
+    lines = _qasm_lines(source)
+    for lineno, first in lines:
+        if first.strip():
+            break
+    else:
+        return QuantumCircuit(num_qubits or 0)
+
+    lines = itertools.chain([(lineno, first)], lines)
+    if first.strip().startswith('OPENQASM'):
+        circuit = QuantumCircuit(0)
+        statements = _qasm2_statements(lines, max_statement_length)
+        parse_statement = _qasm2_statement(circuit)
+    else:
+        circuit = QuantumCircuit(num_qubits or 0)
+        statements = ((n, line.strip().rstrip(';')) for n, line in lines if line.strip())
+        parse_statement = _qasm_lite_statement(circuit, infer_size=num_qubits is None)
+
+    for lineno, statement in statements:
+        if len(statement) > max_statement_length:
+            raise ValueError(f"line {lineno}: statement longer than {max_statement_length} characters")
+        try:
+            parse_statement(statement)
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"line {lineno}: {e}") from None
+        if max_ops is not None and len(circuit.operations) > max_ops:
+            raise ValueError(f"line {lineno}: program exceeds {max_ops} operations")
+    return circuit
+
+
+def _qasm2_statements(lines, max_statement_length):
+    pending = ''
+    for lineno, line in lines:
+        pending += line
+        *complete, pending = pending.split(';')
+        for statement in complete:
+            if statement.strip():
+                yield lineno, ' '.join(statement.split())
+        if len(pending) > max_statement_length:
+            raise ValueError(f"line {lineno}: statement longer than {max_statement_length} characters")
+    if pending.strip():
+        raise ValueError(f"line {lineno}: missing ';'")
+
+
+def _qasm2_statement(circuit):
+    """
+    Returns a parser for single OpenQASM 2.0 statements (without the ';')
+    that appends to `circuit`, tracking qreg/creg offsets as it goes.
+    """
+    qregs, cregs = {}, {}
+
+    def declare(regs, decl, size_attr):
+        name, _, size = decl.partition('[')
+        name, size = name.strip(), int(size.rstrip(']').strip())
+        if name in regs:
+            raise ValueError(f"register '{name}' declared twice")
+        offset = sum(s for _, s in regs.values())
+        regs[name] = (offset, size)
+        if size_attr:
+            circuit.num_qubits = offset + size
+
+    def operand(regs, text):
+        # 'q[3]' -> ([offset + 3], False); 'q' -> (the whole register, True)
+        name, bracket, index = text.strip().partition('[')
+        if name.strip() not in regs:
+            raise ValueError(f"unknown register '{name.strip()}'")
+        offset, size = regs[name.strip()]
+        if not bracket:
+            return list(range(offset, offset + size)), True
+        i = int(index.rstrip(']').strip())
+        if not 0 <= i < size:
+            raise ValueError(f"index {i} out of range for register '{name.strip()}'")
+        return [offset + i], False
+
+    def broadcast(operands, mixed=True):
+        # Register arguments must all have the same size; the statement is
+        # repeated for each of their positions. Gates repeat an indexed bit
+        # with every position (CX a[0],b); measure takes two registers or
+        # two bits, so mixed=False rejects a register next to a bit.
+        sizes = {len(bits) for bits, register in operands if register}
+        if len(sizes) > 1:
+            raise ValueError("register sizes do not match")
+        if sizes and not mixed and not all(register for _, register in operands):
+            raise ValueError("cannot mix a register with an indexed bit")
+        width = sizes.pop() if sizes else 1
+        return [[bits[i] if register else bits[0] for bits, register in operands] for i in range(width)]
+
+    def parse(statement):
+        head, _, rest = statement.partition(' ')
+        if head in ('OPENQASM', 'include', 'barrier'):
+            return
+        if head == 'qreg':
+            return declare(qregs, rest, True)
+        if head == 'creg':
+            return declare(cregs, rest, False)
+        if head == 'measure':
+            src, arrow, dst = rest.partition('->')
+            if not arrow:
+                raise ValueError("measure needs '->'")
+            for q, c in broadcast([operand(qregs, src), operand(cregs, dst)], mixed=False):
+                circuit.measure(q, c)
+            return
+        if head in ('gate', 'opaque', 'if', 'reset') or '{' in statement:
+            raise ValueError(f"'{head}' statements are not supported")
+
+        name, params = statement, []
+        if '(' in statement:
+            name, _, tail = statement.partition('(')
+            arg_text, _, rest = tail.rpartition(')')
+            params = [_qasm_angle(p) for p in arg_text.split(',')]
         else:
-            # Optimization: Use Statevector sampling if NO intermediate collapse is needed
-            # This is the old "Deffered Measurement" style (faster)
-            final_state = self._simulate_state(circuit)
-            
-            # Calculate probabilities for all basis states
-            probs = np.abs(final_state.coef.flatten())**2
-            probs /= np.sum(probs) # Normalize
-            
-            n = circuit.num_qubits
-            basis_states = [format(i, f'0{n}b') for i in range(2**n)]
-            
-            measurements = np.random.choice(basis_states, size=shots, p=probs)
-            
-            counts = {}
-            for sample in measurements:
-                # sample is string like '010' (q0, q1, q2)
-                if not circuit.measurements:
-                    continue
-                    
-                max_cbit = max(cbit for _, cbit in circuit.measurements)
-                c_reg = ['0'] * (max_cbit + 1)
-                
-                for q_idx, c_idx in circuit.measurements:
-                    val = sample[n - 1 - q_idx]
-                    c_reg[c_idx] = val
-                
-                c_result = "".join(reversed(c_reg))
-                counts[c_result] = counts.get(c_result, 0) + 1
-                
-            return counts
+            name, _, rest = statement.partition(' ')
+        for qubits in broadcast([operand(qregs, a) for a in rest.split(',')]):
+            _qasm_append(circuit, name.strip().lower(), params, qubits)
 
-    def _simulate_state(self, circuit):
+    return parse
+
+
+def _qasm_lite_statement(circuit, infer_size):
+    def parse(statement):
+        parts = statement.split()
+        name = parts[0].lower()
+        args = parts[1:]
+        if name == 'measure':
+            q = int(args[0])
+            c = int(args[1]) if len(args) > 1 else q
+            qubits = [q]
+        else:
+            arity = 2 if name in ('cx', 'cnot', 'cz', 'swap', 'cp', 'cu1', 'cphase') else 1
+            qubits = [int(a) for a in args[:arity]]
+            params = [_qasm_angle(a) for a in args[arity:]]
+
+        for q in qubits:
+            if q < 0:
+                raise ValueError(f"negative qubit index {q}")
+            if q >= circuit.num_qubits:
+                if not infer_size:
+                    raise ValueError(f"qubit {q} out of range for {circuit.num_qubits} qubits")
+                circuit.num_qubits = q + 1
+
+        if name == 'measure':
+            circuit.measure(q, c)
+        else:
+            _qasm_append(circuit, name, params, qubits)
+
+    return parse
+
+
+def _u3_params(matrix):
+    """
+    (theta, phi, lambda) with u3(theta, phi, lambda) equal to the 2x2
+    unitary up to global phase.
+    """
+    matrix = np.asarray(matrix, dtype=complex)
+    special = matrix / np.sqrt(np.linalg.det(matrix))
+    theta = 2 * np.arctan2(abs(special[1, 0]), abs(special[0, 0]))
+    phi_plus_lam = -2 * np.angle(special[0, 0])
+    phi_minus_lam = 2 * np.angle(special[1, 0])
+    return theta, (phi_plus_lam + phi_minus_lam) / 2, (phi_plus_lam - phi_minus_lam) / 2
+
+
+def dump_qasm(circuit, lite=False):
+    """
+    Yields the circuit as OpenQASM 2.0 lines (or QASM-lite when lite=True),
+    one operation per line, so large circuits can be written incrementally.
+    Single-qubit custom gates become u3 in OpenQASM, exact up to a global
+    phase; multi-qubit custom gates have no export, nor has QASM-lite any
+    custom gates.
+    """
+    if not lite:
+        yield 'OPENQASM 2.0;'
+        yield 'include "qelib1.inc";'
+        yield f'qreg q[{circuit.num_qubits}];'
+        if circuit.measurements:
+            yield f'creg c[{max(c for _, c in circuit.measurements) + 1}];'
+
+    names = {'phase': 'u1', 'cp': 'cu1'}
+    for op in circuit.operations:
+        name = op[0]
+        if name == 'custom':
+            if lite:
+                raise ValueError("QASM-lite cannot express custom gates")
+            if len(_op_qubits(op)) > 1:
+                raise ValueError("OpenQASM export supports only single-qubit custom gates")
+            op = (name, _op_qubits(op)[0], op[2])
+            theta, phi, lam = _u3_params(op[2])
+            yield f'u3({float(theta)!r},{float(phi)!r},{float(lam)!r}) q[{op[1]}];'
+        elif name == 'measure':
+            if lite:
+                yield f'MEASURE {op[1]}' if op[1] == op[2] else f'MEASURE {op[1]} {op[2]}'
+            else:
+                yield f'measure q[{op[1]}] -> c[{op[2]}];'
+        elif name in ('cx', 'cz', 'swap', 'cp'):
+            params = op[3:]
+            if lite:
+                yield ' '.join([name.upper(), str(op[1]), str(op[2])] + [repr(float(p)) for p in params])
+            else:
+                args = f'({float(params[0])!r})' if params else ''
+                yield f'{names.get(name, name)}{args} q[{op[1]}],q[{op[2]}];'
+        else:
+            params = op[2:]
+            if lite:
+                yield ' '.join([name.upper(), str(op[1])] + [repr(float(p)) for p in params])
+            else:
+                args = f'({float(params[0])!r})' if params else ''
+                yield f'{names.get(name, name)}{args} q[{op[1]}];'
+
+
+def _op_digest(op):
+    """
+    Byte encoding of an operation tuple; numpy payloads (custom gate matrices)
+    are encoded by dtype, shape and raw data rather than their truncated repr.
+    """
+    parts = []
+    for item in op:
+        if isinstance(item, np.ndarray):
+            parts.append(f'{item.dtype.str}{item.shape}'.encode())
+            parts.append(np.ascontiguousarray(item).tobytes())
+        else:
+            parts.append(repr(item).encode())
+    return b'\x1f'.join(parts)
+
+
+# Custom gate matrices already checked by _validated_gate, keyed by digest
+_VALIDATED_GATES = OrderedDict()
+_VALIDATED_GATES_LOCK = threading.Lock()
+_MAX_VALIDATED_GATES = 1024
+
+
+def _validated_gate(matrix, num_qubits):
+    """
+    matrix as a read-only complex array, checked to be a 2^k x 2^k unitary
+    for k = num_qubits. Each distinct matrix is validated once; later calls
+    only hash it.
+    """
+    matrix = np.asarray(matrix)
+    key = hashlib.blake2b(_op_digest((num_qubits, matrix)), digest_size=16).digest()
+    with _VALIDATED_GATES_LOCK:
+        gate = _VALIDATED_GATES.get(key)
+        if gate is not None:
+            _VALIDATED_GATES.move_to_end(key)
+            return gate
+
+    try:
+        gate = matrix.astype(complex)
+    except (TypeError, ValueError):
+        raise ValueError("Custom gate matrix must be numeric.")
+    dim = 2 ** num_qubits
+    if gate.shape != (dim, dim):
+        raise ValueError(f"Custom gate on {num_qubits} qubit(s) needs a {dim}x{dim} matrix, got shape {gate.shape}.")
+    if not np.allclose(gate.conj().T @ gate, np.eye(dim)):
+        raise ValueError("Custom gate matrix must be unitary.")
+    gate.flags.writeable = False
+
+    with _VALIDATED_GATES_LOCK:
+        _VALIDATED_GATES[key] = gate
+        while len(_VALIDATED_GATES) > _MAX_VALIDATED_GATES:
+            _VALIDATED_GATES.popitem(last=False)
+    return gate
+
+
+def _prefix_hashes(circuit, stop=None):
+    """
+    Rolling hash of every operation prefix of the circuit.
+    hashes[i] identifies the state after the first i operations, so
+    hashes[0] depends only on the register size.
+    """
+    if stop is None:
+        stop = len(circuit.operations)
+    h = hashlib.blake2b(f'qubits={circuit.num_qubits}'.encode(), digest_size=16).digest()
+    hashes = [h]
+    for op in circuit.operations[:stop]:
+        h = hashlib.blake2b(h + _op_digest(op), digest_size=16).digest()
+        hashes.append(h)
+    return hashes
+
+
+def _op_qubits(op):
+    """
+    Qubits an operation tuple acts on.
+    """
+    if op[0] in ('cx', 'cz', 'swap', 'cp'):
+        return (op[1], op[2])
+    if op[0] == 'custom' and not np.isscalar(op[1]):
+        return tuple(op[1])
+    return (op[1],)
+
+
+# Operations Simulator._gate_operator builds; anything else is skipped
+_GATES = ('h', 'x', 'y', 'z', 'phase', 't', 's', 'cx', 'cz', 'cp', 'swap', 'custom', 'rx', 'ry', 'rz')
+
+# Tile of the statevector kept in cache while a layer of gates is applied:
+# 2^14 complex128 amplitudes = 256 KiB, the size of a typical L2
+_TILE_QUBITS = 14
+
+
+def _gate_layers(ops):
+    """
+    Schedules gate operations (no measurements) into layers of gates on
+    disjoint qubits. Each gate goes into the layer after the last one
+    touching any of its qubits, so gates only move past gates they commute
+    with and applying the layers in order equals applying ops in order.
+    Returns a list of lists of operation tuples.
+    """
+    layers = []
+    depth = {}  # qubit -> number of layers already touching it
+    for op in ops:
+        qubits = _op_qubits(op)
+        level = max((depth.get(q, 0) for q in qubits), default=0)
+        if level == len(layers):
+            layers.append([])
+        layers[level].append(op)
+        for q in qubits:
+            depth[q] = level + 1
+    return layers
+
+
+def _relabel(array, layout, n):
+    """
+    Moves the amplitudes of `array` (a statevector or a batch of them as
+    columns) held with logical qubit q on physical qubit layout[q] back to
+    the standard order, where bit q of the basis index is qubit q.
+    """
+    tensor = array.reshape((2,) * n + array.shape[1:])
+    # Tensor axis n-1-q is qubit q, see SubsystemOperator._apply
+    axes = [n - 1 - layout[n - 1 - axis] for axis in range(n)] + list(range(n, tensor.ndim))
+    return np.ascontiguousarray(tensor.transpose(axes)).reshape(array.shape)
+
+
+def _split_terminal_measurements(circuit):
+    """
+    Separates measure operations that nothing follows on their qubit (and
+    whose cbit no later mid-circuit measurement overwrites) from the rest.
+    Those can be deferred to the final state without changing the outcome
+    distribution. Returns (body, terminal): body is a copy of the circuit
+    without them and terminal their (qubit, cbit) pairs in circuit order.
+    """
+    touched = set()
+    overwritten = set()
+    terminal = []
+    ops = []
+    for op in reversed(circuit.operations):
+        if op[0] == 'measure':
+            if op[1] not in touched and op[2] not in overwritten:
+                terminal.append((op[1], op[2]))
+                continue
+            overwritten.add(op[2])
+        else:
+            touched.update(_op_qubits(op))
+        ops.append(op)
+
+    body = QuantumCircuit(circuit.num_qubits)
+    body.operations = ops[::-1]
+    body.measurements = list(circuit.measurements)
+    return body, terminal[::-1]
+
+
+def _remap_op(op, mapping):
+    """
+    The operation with its qubit indices translated through mapping.
+    """
+    if op[0] in ('cx', 'cz', 'swap', 'cp'):
+        return (op[0], mapping[op[1]], mapping[op[2]]) + op[3:]
+    if op[0] == 'custom' and not np.isscalar(op[1]):
+        return (op[0], tuple(mapping[q] for q in op[1])) + op[2:]
+    return (op[0], mapping[op[1]]) + op[2:]
+
+
+def _check_qubits(circuit):
+    """
+    Raises ValueError if an operation or measurement of circuit refers to a
+    qubit outside its register.
+    """
+    n = circuit.num_qubits
+    for op in circuit.operations:
+        for q in _op_qubits(op):
+            if not 0 <= q < n:
+                raise ValueError(f"Operation '{op[0]}' acts on qubit {q}, outside the {n}-qubit register.")
+    for q, _ in circuit.measurements:
+        if not 0 <= q < n:
+            raise ValueError(f"Measurement of qubit {q} is outside the {n}-qubit register.")
+
+
+def _planned_gates(circuit, shots):
+    """
+    Number of gates Simulator.run(circuit, shots) applies without
+    checkpoint hits, as counted by Simulator.gates_applied: those of the
+    light cone before the first mid-circuit measurement once, the rest
+    once per shot.
+    """
+    if not circuit.measurements and not any(op[0] == 'measure' for op in circuit.operations):
+        return sum(op[0] in _GATES for op in circuit.operations)
+    body, _ = _split_terminal_measurements(_light_cone(circuit)[0])
+    ops = body.operations
+    first_measure = next((i for i, op in enumerate(ops) if op[0] == 'measure'), len(ops))
+    prefix = sum(op[0] in _GATES for op in ops[:first_measure])
+    return prefix + shots * sum(op[0] in _GATES for op in ops[first_measure:])
+
+
+def _light_cone(circuit):
+    """
+    Backward light-cone pass over a measured circuit. Operations that act
+    only on qubits which can no longer influence a reported classical bit
+    are dropped, as are measurements whose cbit a later measurement
+    overwrites (unless their collapse still matters). Circuits without
+    measure operations are read as measuring circuit.measurements at the
+    end. The outcome distribution is unchanged.
+
+    The remaining operations are moved onto a register of just the qubits
+    they touch, in the original order. Returns (reduced circuit, number of
+    operations dropped). Raises ValueError for qubits outside the register.
+    """
+    _check_qubits(circuit)
+    ops = circuit.operations
+    has_measure_ops = any(op[0] == 'measure' for op in ops)
+    live = set() if has_measure_ops else {q for q, _ in circuit.measurements}
+    written = set() if has_measure_ops else {c for _, c in circuit.measurements}
+
+    kept = []
+    for op in reversed(ops):
+        if op[0] == 'measure':
+            if op[2] not in written:
+                written.add(op[2])
+                live.add(op[1])
+            elif op[1] not in live:
+                continue
+        else:
+            qubits = _op_qubits(op)
+            if live.isdisjoint(qubits):
+                continue
+            live.update(qubits)
+        kept.append(op)
+    kept.reverse()
+
+    mapping = {q: i for i, q in enumerate(sorted(live))}
+    reduced = QuantumCircuit(len(mapping))
+    reduced.operations = [_remap_op(op, mapping) for op in kept]
+    # A measurement is only dropped when a kept one later writes its cbit,
+    # so the classical register keeps its width without the dropped entries
+    reduced.measurements = [(mapping[q], c) for q, c in circuit.measurements if q in mapping]
+    return reduced, len(ops) - len(kept)
+
+
+# Outcome probabilities at or below this are rounding noise, not outcomes
+_ZERO_PROBABILITY = 1e-12
+
+
+def _marginal_key(state_hash, qubits):
+    """
+    Cache key of the marginal distribution of `qubits` in the state
+    identified by state_hash; distinct from every prefix hash.
+    """
+    return hashlib.blake2b(state_hash + f'marginal={tuple(qubits)}'.encode(), digest_size=16).digest()
+
+
+class CheckpointCache:
+    def __init__(self, max_bytes=256 * 2**20, disk=None):
+        '''
+        Statevector checkpoints keyed by circuit-prefix hash, shared between
+        Simulator runs. Least recently used entries are evicted once the
+        stored amplitudes exceed max_bytes. Safe to share across threads.
+        disk: optional DiskCheckpointCache as a second tier. Statevector
+              checkpoints (puts with a position) are also written there,
+              including states too large for memory, subject to its
+              min_bytes; lookups fall back to it, so runs resume across
+              restarts. Marginals and unitary blocks stay in memory.
+        '''
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def longest_prefix(self, hashes):
         """
-        Original simulator for pure states (no intermediate collapse).
-        Ignores 'measure' operations to prevent crash, effectively treating them as Identity
-        if this method is called directly (though .run() guards against this).
+        Finds the longest stored prefix among `hashes` (as produced by
+        _prefix_hashes), in memory or on disk. Returns (prefix_length, coef),
+        or (0, None) on a miss.
         """
-        state, _ = self._simulate_shot(circuit, force_pure=True)
-        return state
+        found, coef = 0, None
+        with self._lock:
+            for i in range(len(hashes) - 1, 0, -1):
+                coef = self._entries.get(hashes[i])
+                if coef is not None:
+                    self._entries.move_to_end(hashes[i])
+                    found = i
+                    break
+        if self.disk is not None:
+            for i in range(len(hashes) - 1, found, -1):
+                if hashes[i] in self.disk:
+                    disk_coef = self.disk.get(hashes[i])
+                    if disk_coef is not None:
+                        self._put_memory(hashes[i], disk_coef)
+                        found, coef = i, disk_coef
+                        break
+        with self._lock:
+            if coef is None:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            return found, coef
 
-    def _simulate_shot(self, circuit, force_pure=False):
+    def get(self, key):
         """
-        Simulates a single shot of the circuit.
-        current_state evolves.
-        Returns (final_state, measured_values_dict)
+        The array stored under key, or None.
+        """
+        with self._lock:
+            coef = self._entries.get(key)
+            if coef is not None:
+                self._entries.move_to_end(key)
+                return coef
+        if self.disk is not None:
+            coef = self.disk.get(key)
+            if coef is not None:
+                self._put_memory(key, coef)
+        return coef
+
+    def put(self, key, coef, position=None):
+        """
+        Stores coef under key. position: number of circuit operations the
+        statevector has gone through; only entries with one are written to
+        the disk tier.
+        """
+        if self.disk is not None and position is not None:
+            self.disk.put(key, coef, position)
+        self._put_memory(key, coef)
+
+    def _put_memory(self, key, coef):
+        # Shared between runs: lock the caller's array too, so an in-place
+        # change to a returned state raises instead of corrupting the cache
+        coef.flags.writeable = False
+        if coef.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.nbytes
+            self._entries[key] = coef
+            self.total_bytes += coef.nbytes
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+
+def _checksum(array):
+    return hashlib.blake2b(np.ascontiguousarray(array).data, digest_size=16).hexdigest()
+
+
+class DiskCheckpointCache:
+    def __init__(self, directory, max_bytes=8 * 2**30, min_bytes=16 * 2**20, interval=0.0, verify=False):
+        '''
+        Checkpoints as memory-mappable .npy files in directory, named by key,
+        each with a .json sidecar recording the circuit position, shape,
+        dtype and a blake2b checksum of the amplitudes. Files survive process
+        restarts, so a recycled worker resumes a long run from its latest
+        checkpoint. They are loaded with mmap: resuming copies nothing up
+        front, and the first gate streams the pages in from the file as it
+        reads them (Simulator._prefix_state evolves the mapped array
+        itself). Files are written to a temporary name and renamed, so a
+        crash never leaves a partial checkpoint.
+
+        max_bytes: disk space for .npy files; least recently used entries
+                   are deleted beyond it
+        min_bytes: smaller arrays are not written; recomputing them is
+                   cheaper than the write
+        interval: minimum seconds between two writes; checkpoints offered
+                  sooner are skipped
+        verify: compare the checksum when an entry is loaded. This reads
+                the whole file before the run resumes, so by default only
+                the .npy header is checked against the sidecar (shape,
+                dtype, and a file long enough for them). Entries that fail
+                are deleted and miss.
+        Safe to share across threads and processes.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        self.interval = interval
+        self.verify = verify
+        self._last_write = float('-inf')
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        path = os.path.join(self.directory, key.hex())
+        return path + '.npy', path + '.json'
+
+    def __contains__(self, key):
+        return os.path.exists(self._paths(key)[1])
+
+    def __len__(self):
+        return sum(name.endswith('.json') for name in os.listdir(self.directory))
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def metadata(self, key):
+        """
+        The sidecar of key ({'position', 'shape', 'dtype', 'checksum',
+        'created'}), or None.
+        """
+        try:
+            with open(self._paths(key)[1]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """
+        The array stored under key as a read-only memory map, or None.
+        """
+        data_path, _ = self._paths(key)
+        meta = self.metadata(key)
+        if meta is None:
+            return None
+        try:
+            array = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            array = None
+        if (array is None or list(array.shape) != meta['shape'] or array.dtype.str != meta['dtype']
+                or (self.verify and _checksum(array) != meta['checksum'])):
+            del array
+            self._remove(key)
+            return None
+        os.utime(data_path)  # recency for eviction
+        return array
+
+    def put(self, key, array, position=None):
+        array = np.ascontiguousarray(array)
+        now = time.monotonic()
+        with self._lock:
+            if (array.nbytes > self.max_bytes or array.nbytes < self.min_bytes
+                    or now - self._last_write < self.interval):
+                return
+            self._last_write = now
+        data_path, meta_path = self._paths(key)
+        meta = {'position': position, 'shape': list(array.shape), 'dtype': array.dtype.str,
+                'checksum': _checksum(array), 'created': time.time()}
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(data_path + suffix, 'wb') as f:
+            np.save(f, array)
+        os.replace(data_path + suffix, data_path)
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+        self._evict()
+
+    def _entries(self):
+        """
+        (last used, size, key) of every complete entry.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = bytes.fromhex(name[:-len('.json')])
+            try:
+                stat = os.stat(self._paths(key)[0])
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, key))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+
+    def _remove(self, key):
+        for path in reversed(self._paths(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for _, _, key in self._entries():
+            self._remove(key)
+
+
+# tracemalloc is process-wide: profilers share one tracing session
+# (refcounted, stopped by the last one if a profiler started it), and spans
+# that read the traced memory peak run one at a time so another thread's
+# reset_peak() cannot land inside them
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+_memory_span_lock = threading.RLock()
+
+
+class Profiler:
+    def __init__(self, track_memory=True, max_events=100000):
+        '''
+        Records wall time and allocated bytes per phase ('build', 'apply',
+        'measure', 'sample') and operation type for a Simulator run.
+
+        track_memory: measure bytes allocated with tracemalloc (slower)
+        max_events: timeline events kept for chrome_trace(); the summary
+                    always covers every event
+
+        Pass an instance as Simulator(profiler=...). Subclasses can override
+        begin()/end() to forward the data elsewhere.
+
+        Memory-tracked spans of concurrent runs are serialized, so each
+        reads its own peak; bytes that other threads allocate during a
+        span are still counted in it.
+        '''
+        self.track_memory = track_memory
+        self.max_events = max_events
+        self.events = []
+        self.totals = {}
+        self._origin = time.perf_counter()
+        self._tracing = False
+        self._open_spans = 0
+
+    def start(self):
+        global _tracing_users, _tracing_started
+        if not self.track_memory or self._tracing:
+            return
+        with _tracing_lock:
+            if _tracing_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_started = True
+            _tracing_users += 1
+        self._tracing = True
+
+    def stop(self):
+        global _tracing_users, _tracing_started
+        # Spans left open by an exception
+        for _ in range(self._open_spans):
+            _memory_span_lock.release()
+        self._open_spans = 0
+        if not self._tracing:
+            return
+        self._tracing = False
+        with _tracing_lock:
+            _tracing_users -= 1
+            if _tracing_users == 0 and _tracing_started:
+                tracemalloc.stop()
+                _tracing_started = False
+
+    def begin(self):
+        if self.track_memory and tracemalloc.is_tracing():
+            _memory_span_lock.acquire()
+            self._open_spans += 1
+            tracemalloc.reset_peak()
+            return time.perf_counter(), tracemalloc.get_traced_memory()[0]
+        return time.perf_counter(), None
+
+    def end(self, token, phase, name):
+        start, mem_before = token
+        duration = time.perf_counter() - start
+        allocated = 0
+        if mem_before is not None:
+            allocated = max(tracemalloc.get_traced_memory()[1] - mem_before, 0)
+            self._open_spans -= 1
+            _memory_span_lock.release()
+
+        total = self.totals.setdefault((phase, name), [0, 0.0, 0])
+        total[0] += 1
+        total[1] += duration
+        total[2] += allocated
+        if len(self.events) < self.max_events:
+            self.events.append((phase, name, start - self._origin, duration, allocated))
+
+    def summary(self):
+        """
+        One row per (phase, operation): calls, total seconds and bytes
+        allocated (peak above the starting point, summed over calls),
+        slowest first.
+        """
+        rows = [{'phase': phase, 'op': name, 'calls': calls, 'seconds': seconds, 'bytes': allocated}
+                for (phase, name), (calls, seconds, allocated) in self.totals.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def summary_table(self):
+        lines = [f"{'phase':<8} {'op':<8} {'calls':>8} {'total ms':>10} {'mean us':>10} {'bytes':>14}"]
+        for row in self.summary():
+            mean_us = row['seconds'] / row['calls'] * 1e6
+            lines.append(f"{row['phase']:<8} {row['op']:<8} {row['calls']:>8} "
+                         f"{row['seconds'] * 1e3:>10.3f} {mean_us:>10.1f} {row['bytes']:>14}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Timeline in the Chrome trace event format (chrome://tracing, Perfetto).
+        """
+        pid = os.getpid()
+        return {
+            'traceEvents': [
+                {'name': name, 'cat': phase, 'ph': 'X', 'pid': pid, 'tid': 0,
+                 'ts': start * 1e6, 'dur': duration * 1e6, 'args': {'bytes': allocated}}
+                for phase, name, start, duration, allocated in self.events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+
+# Fraction of non-zero amplitudes above which a sparse state is converted
+# to a dense statevector
+_SPARSE_DENSITY = 1 / 16
+# Sparse amplitudes with a smaller magnitude are cancellation noise
+_SPARSE_ATOL = 1e-12
+
+
+def _gate_matrix(op):
+    """
+    (matrix, qubits) of a non-measurement operation: the 2^k x 2^k matrix
+    on its k qubits, where bit j of the matrix index is qubits[j].
+    """
+    name = op[0]
+    if name == 'custom':
+        qubits = _op_qubits(op)
+        return _validated_gate(op[2], len(qubits)), qubits
+    if name == 'cx':
+        # index = control + 2 * target; the target flips when the control is set
+        return np.eye(4, dtype=complex)[[0, 3, 2, 1]], (op[1], op[2])
+    if name == 'swap':
+        return np.eye(4, dtype=complex)[[0, 2, 1, 3]], (op[1], op[2])
+    if name == 'cz':
+        return np.diag([1, 1, 1, -1]).astype(complex), (op[1], op[2])
+    if name == 'cp':
+        return np.diag([1, 1, 1, np.exp(1j * op[3])]), (op[1], op[2])
+
+    if name == 'h':
+        matrix = np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2)
+    elif name in ('x', 'y', 'z'):
+        matrix = np.array({'x': Operator.pauli_x, 'y': Operator.pauli_y, 'z': Operator.pauli_z}[name], dtype=complex)
+    elif name in ('phase', 's', 't'):
+        theta = {'s': np.pi / 2, 't': np.pi / 4}.get(name, op[2] if len(op) > 2 else 0.0)
+        matrix = np.diag([1, np.exp(1j * theta)])
+    elif name == 'rx':
+        matrix = np.array([[np.cos(op[2] / 2), -1j * np.sin(op[2] / 2)],
+                           [-1j * np.sin(op[2] / 2), np.cos(op[2] / 2)]], dtype=complex)
+    elif name == 'ry':
+        matrix = np.array([[np.cos(op[2] / 2), -np.sin(op[2] / 2)],
+                           [np.sin(op[2] / 2), np.cos(op[2] / 2)]], dtype=complex)
+    elif name == 'rz':
+        matrix = np.diag([np.exp(-1j * op[2] / 2), np.exp(1j * op[2] / 2)])
+    else:
+        raise ValueError(f"Unknown operation {name!r}")
+    return matrix, (op[1],)
+
+
+def _branching(matrix):
+    """
+    True if the gate can map one basis state to several, i.e. some column
+    has more than one non-zero entry; diagonal and permutation-like gates
+    never grow a sparse state.
+    """
+    return bool(np.any(np.count_nonzero(np.abs(matrix) > _SPARSE_ATOL, axis=0) > 1))
+
+
+class SparseState:
+    def __init__(self, num_qubits, indices=None, values=None):
+        '''
+        Statevector stored as its non-zero amplitudes: basis state indices
+        (bit q is qubit q, as for dense states) and their values. Starts in
+        |0...0>. Diagonal and permutation gates keep the number of entries;
+        other gates branch each entry into at most 2^k.
+        '''
+        if num_qubits > 62:
+            raise ValueError("Sparse statevectors support at most 62 qubits.")
+        self.num_qubits = num_qubits
+        self.indices = np.zeros(1, dtype=np.int64) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.values = np.ones(1, dtype=complex) if values is None else np.asarray(values, dtype=complex)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    @property
+    def density(self):
+        return self.nnz / 2.0 ** self.num_qubits
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.values.nbytes
+
+    def to_dense(self):
+        coef = np.zeros(2 ** self.num_qubits, dtype=complex)
+        coef[self.indices] = self.values
+        return coef
+
+    def apply(self, op):
+        """
+        The state after a non-measurement operation, as a new SparseState.
+        """
+        matrix, qubits = _gate_matrix(op)
+        # Local index of every entry on the gate's qubits, bit j = qubits[j]
+        local = np.zeros(self.nnz, dtype=np.int64)
+        for j, q in enumerate(qubits):
+            local |= ((self.indices >> q) & 1) << j
+        if not _branching(matrix):
+            rows = np.argmax(np.abs(matrix) > _SPARSE_ATOL, axis=0)
+            indices = self.indices
+            for j, q in enumerate(qubits):
+                indices = indices ^ ((((rows[local] ^ local) >> j) & 1) << q)
+            return SparseState(self.num_qubits, indices, self.values * matrix[rows[local], local])
+
+        mask = sum(1 << q for q in qubits)
+        spread = np.zeros(len(matrix), dtype=np.int64)
+        for j, q in enumerate(qubits):
+            spread |= ((np.arange(len(matrix)) >> j) & 1) << q
+        candidates = ((self.indices & ~mask)[:, None] | spread[None, :]).reshape(-1)
+        amplitudes = (matrix[:, local].T * self.values[:, None]).reshape(-1)
+        # Merge the branches that land on the same basis state
+        indices, inverse = np.unique(candidates, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        values = (np.bincount(inverse, amplitudes.real, len(indices))
+                  + 1j * np.bincount(inverse, amplitudes.imag, len(indices)))
+        keep = np.abs(values) > _SPARSE_ATOL
+        return SparseState(self.num_qubits, indices[keep], values[keep])
+
+    def collapse(self, qubit, outcome):
+        """
+        (probability, normalized post-measurement state) for an outcome of
+        measuring qubit.
+        """
+        selected = ((self.indices >> qubit) & 1) == outcome
+        values = self.values[selected]
+        p = float(np.vdot(values, values).real)
+        if p <= _ZERO_PROBABILITY:
+            return 0.0, None
+        return p, SparseState(self.num_qubits, self.indices[selected], values / np.sqrt(p))
+
+    def measure(self, qubit):
+        """
+        Projective measurement of one qubit. Returns (collapsed_state, outcome).
+        """
+        p0, state0 = self.collapse(qubit, 0)
+        if np.random.random() < p0:
+            return state0, 0
+        return self.collapse(qubit, 1)[1], 1
+
+    def __repr__(self):
+        return f'SparseState({self.num_qubits} qubits, {self.nnz} non-zero)'
+
+
+# Operations with an angle that expectation_gradient differentiates
+_PARAMETERIZED = ('rx', 'ry', 'rz', 'phase', 'cp')
+
+
+def _inverse_op(op):
+    """
+    The operation undoing op (the adjoint of its gate).
+    """
+    name = op[0]
+    if name in ('rx', 'ry', 'rz', 'phase'):
+        return (name, op[1], -op[2])
+    if name == 'cp':
+        return (name, op[1], op[2], -op[3])
+    if name in ('s', 't'):
+        return ('phase', op[1], -np.pi / 2 if name == 's' else -np.pi / 4)
+    if name == 'custom':
+        return (name, op[1], np.ascontiguousarray(np.conjugate(op[2]).T))
+    return op  # h, x, y, z, cx, cz, swap are their own inverses
+
+
+def _pauli_apply(label, array, n):
+    """
+    A Pauli string applied to a statevector; label[0] acts on the highest
+    qubit, as in counts bitstrings ('XZ' is X on qubit 1, Z on qubit 0).
+    """
+    index = np.arange(2 ** n)
+    flip = 0
+    phase = np.ones(2 ** n, dtype=complex)
+    for q, pauli in enumerate(reversed(label)):
+        bits = (index >> q) & 1
+        if pauli in 'XY':
+            flip |= 1 << q
+        if pauli == 'Y':
+            phase *= np.where(bits == 0, 1j, -1j)  # Y|0> = i|1>, Y|1> = -i|0>
+        elif pauli == 'Z':
+            phase *= np.where(bits == 0, 1, -1)
+    result = np.empty(array.shape, dtype=complex)
+    result[index ^ flip] = phase * array
+    return result
+
+
+def _observable_apply(observable, array, n):
+    """
+    observable |array>, for an Operator (or matrix) or a Pauli sum given as
+    {label: coefficient} (see _pauli_apply).
+    """
+    if not isinstance(observable, dict):
+        operator = observable if isinstance(observable, Operator) else Operator(observable)
+        return operator._apply(array)
+    result = np.zeros(len(array), dtype=complex)
+    for label, coefficient in observable.items():
+        if len(label) != n or set(label) - set('IXYZ'):
+            raise ValueError(f"Pauli label {label!r} must have {n} characters from I, X, Y, Z.")
+        result += coefficient * _pauli_apply(label, array, n)
+    return result
+
+
+# Worker tasks of ShardedStatevector, at module level so the pool can run them
+
+def _attach_shards(names, size):
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    return blocks, [np.ndarray((size,), dtype=complex, buffer=block.buf) for block in blocks]
+
+
+def _release_shards(blocks, unlink=False):
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def _shard_apply(task):
+    """
+    Applies a gate to a group of 2^G shards that differ only in the G
+    global qubits the gate acts on (G = 0 for a shard-local gate).
+    Group member p has bit j of p set for global_qubits[j].
+    """
+    names, local_qubits, matrix, qubits, global_qubits = task
+    blocks, shards = _attach_shards(names, 2 ** local_qubits)
+    try:
+        g, k = len(global_qubits), len(qubits)
+        block = np.stack(shards).reshape((2,) * (g + local_qubits))
+
+        def axis(q):
+            if q >= local_qubits:
+                return g - 1 - global_qubits.index(q)
+            return g + local_qubits - 1 - q
+
+        axes = [axis(q) for q in reversed(qubits)]
+        gate = np.asarray(matrix, dtype=complex).reshape((2,) * (2 * k))
+        result = np.tensordot(gate, block, axes=(list(range(k, 2 * k)), axes))
+        result = np.moveaxis(result, list(range(k)), axes).reshape(len(shards), -1)
+        for shard, row in zip(shards, result):
+            shard[:] = row
+    finally:
+        del shards
+        _release_shards(blocks)
+
+
+def _shard_marginal(task):
+    """
+    Unnormalized probabilities of the given local qubits (highest first)
+    within one shard.
+    """
+    name, local_qubits, qubits = task
+    blocks, (shard,) = _attach_shards([name], 2 ** local_qubits)
+    try:
+        probs = np.abs(shard.reshape((2,) * local_qubits)) ** 2
+        kept = {local_qubits - 1 - q for q in qubits}
+        return probs.sum(axis=tuple(a for a in range(local_qubits) if a not in kept)).reshape(-1)
+    finally:
+        del shard
+        _release_shards(blocks)
+
+
+def _shard_copy(task):
+    source, target, local_qubits = task
+    blocks, (src, dst) = _attach_shards([source, target], 2 ** local_qubits)
+    try:
+        dst[:] = src
+    finally:
+        del src, dst
+        _release_shards(blocks)
+
+
+_shard_pools = {}  # processes -> (pid, pool), see _shard_pool
+_shard_pools_lock = threading.Lock()
+
+
+def _shard_pool(processes):
+    """
+    The process-wide pool of `processes` workers that ShardedStatevectors
+    are evolved in, created on first use. Workers come from a forkserver
+    (spawn where that is unavailable) rather than a fork of this possibly
+    multithreaded process, and the pool lives until the interpreter exits,
+    so runs do not pay for starting processes. A forked child gets its own.
+    """
+    with _shard_pools_lock:
+        entry = _shard_pools.get(processes)
+        if entry is None or entry[0] != os.getpid():
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            entry = _shard_pools[processes] = (os.getpid(), context.Pool(processes))
+        return entry[1]
+
+
+@atexit.register
+def _close_shard_pools():
+    with _shard_pools_lock:
+        for pid, pool in _shard_pools.values():
+            if pid == os.getpid():
+                pool.terminate()
+                pool.join()
+        _shard_pools.clear()
+
+
+class ShardedStatevector:
+    def __init__(self, num_qubits, num_shards=4, processes=None, pool=None):
+        '''
+        Statevector split across num_shards (a power of two) shared-memory
+        blocks on its high-order qubits: with l = num_qubits - log2(num_shards)
+        local qubits, shard s holds basis states s * 2^l to (s + 1) * 2^l - 1,
+        so the top qubits are "global" and select the shard. Starts in
+        |0...0>.
+
+        Gates run in a pool of worker processes: pool if given, otherwise
+        the process-wide _shard_pool of `processes` workers (default one per
+        shard up to the CPU count). Neither is closed by this state. A gate
+        on local qubits runs on every shard independently; a gate on global
+        qubits runs once per group of shards that differ only in those
+        qubits, the worker exchanging their amplitudes through shared
+        memory. Call close(), or use the state as a context manager, to
+        free the blocks.
+        '''
+        global_qubits = int(num_shards).bit_length() - 1
+        if num_shards < 1 or 2 ** global_qubits != num_shards:
+            raise ValueError("num_shards must be a power of two.")
+        if global_qubits > num_qubits:
+            raise ValueError("There cannot be more shards than basis states.")
+        self.num_qubits = num_qubits
+        self.num_shards = num_shards
+        self.local_qubits = num_qubits - global_qubits
+
+        size = 2 ** self.local_qubits
+        self._blocks = [shared_memory.SharedMemory(create=True, size=16 * size) for _ in range(num_shards)]
+        self.pool = pool or _shard_pool(processes or min(num_shards, os.cpu_count() or 1))
+        self._finalizer = weakref.finalize(self, _release_shards, self._blocks, True)
+        self.shards = [np.ndarray((size,), dtype=complex, buffer=block.buf) for block in self._blocks]
+        for shard in self.shards:
+            shard[:] = 0
+        self.shards[0][0] = 1
+
+    @property
+    def names(self):
+        return [block.name for block in self._blocks]
+
+    @property
+    def nbytes(self):
+        return sum(shard.nbytes for shard in self.shards)
+
+    def apply(self, op):
+        """
+        Applies a non-measurement operation in place.
+        """
+        self.apply_matrix(*_gate_matrix(op))
+
+    def apply_matrix(self, matrix, qubits):
+        """
+        Applies a 2^k x 2^k matrix to k qubits in place; bit j of the matrix
+        index is qubits[j]. The matrix need not be unitary.
+        """
+        l = self.local_qubits
+        global_qubits = [q for q in qubits if q >= l]
+        members = [sum(((p >> j) & 1) << (q - l) for j, q in enumerate(global_qubits))
+                   for p in range(2 ** len(global_qubits))]
+        names = self.names
+        mask = members[-1]
+        tasks = [([names[base | m] for m in members], l, matrix, tuple(qubits), global_qubits)
+                 for base in range(self.num_shards) if not base & mask]
+        self.pool.map(_shard_apply, tasks)
+
+    def marginal(self, qubits):
+        """
+        Probabilities of qubits (listed from highest to lowest), normalized;
+        index bit k-1-j holds qubits[j], as for Simulator._marginal.
+        """
+        l, k = self.local_qubits, len(qubits)
+        local = [q for q in qubits if q < l]
+        parts = self.pool.map(_shard_marginal, [(name, l, local) for name in self.names])
+        probs = np.zeros(2 ** k)
+        index = np.arange(2 ** len(local))
+        for shard, part in enumerate(parts):
+            positions = np.zeros(len(part), dtype=np.int64)
+            for j, q in enumerate(qubits):
+                if q < l:
+                    bit = (index >> (len(local) - 1 - local.index(q))) & 1
+                else:
+                    bit = (shard >> (q - l)) & 1
+                positions |= bit << (k - 1 - j)
+            probs[positions] += part
+        return probs / probs.sum()
+
+    def collapse(self, qubit, outcome, probability):
+        """
+        Projects qubit onto outcome (of the given probability) and renormalizes.
+        """
+        projector = np.zeros((2, 2))
+        projector[outcome, outcome] = 1 / np.sqrt(probability)
+        self.apply_matrix(projector, (qubit,))
+
+    def copy(self):
+        """
+        A new state with the same amplitudes, sharing this state's pool.
+        """
+        other = ShardedStatevector(self.num_qubits, self.num_shards, pool=self.pool)
+        self.pool.map(_shard_copy, [(a, b, self.local_qubits) for a, b in zip(self.names, other.names)])
+        return other
+
+    def to_dense(self):
+        return np.concatenate(self.shards)
+
+    def close(self):
+        self.shards = []
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f'ShardedStatevector({self.num_qubits} qubits, {self.num_shards} shards)'
+
+
+def _close_sampler(sample):
+    """
+    Frees what a Simulator._sampler holds outside Python memory (the
+    shared-memory prefix state of a sharded run).
+    """
+    close = getattr(sample, 'close', None)
+    if close is not None:
+        close()
+
+
+class Simulator:
+    METHODS = ('statevector', 'sparse', 'sharded')
+
+    def __init__(self, checkpoints=None, checkpoint_interval=16, profiler=None,
+                 method='statevector', sparse_density=_SPARSE_DENSITY, shards=4, processes=None,
+                 pool=None):
+        '''
+        checkpoints: optional CheckpointCache; when given, runs resume from the
+                     longest previously simulated operation prefix
+        checkpoint_interval: number of operations between stored checkpoints
+        profiler: optional Profiler recording time and memory per phase and
+                  operation type
+        method: 'statevector' (dense) or 'sparse', which run(), iter_counts()
+                and probabilities() evolve as a SparseState of the non-zero
+                amplitudes, for circuits that keep few of them (classical
+                logic, GHZ states) on registers too large to hold densely.
+                Checkpoints are not used by sparse runs.
+        sparse_density: fraction of non-zero amplitudes at which a sparse
+                        state is converted to dense for the rest of the run
+        shards, processes: for method='sharded', which runs the same entry
+                points on a ShardedStatevector of that many shared-memory
+                shards, evolved by that many worker processes (default one
+                per shard up to the CPU count). Checkpoints are not used.
+        pool: multiprocessing pool to evolve sharded states in; defaults to
+              the process-wide pool of `processes` workers (_shard_pool),
+              shared by every Simulator
+        '''
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {', '.join(self.METHODS)}")
+        self.checkpoints = checkpoints
+        self.checkpoint_interval = checkpoint_interval
+        self.profiler = profiler
+        self.method = method
+        self.sparse_density = sparse_density
+        self.shards = shards
+        self.processes = processes
+        self.pool = pool
+        self._progress = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        # Counters describing the most recent run
+        self.shots_done = 0
+        self.gates_applied = 0
+        self.peak_state_bytes = 0
+        self.checkpoint_hits = 0
+        self.checkpoint_misses = 0
+        # Light-cone pruning of the last sampled circuit, see _light_cone
+        self.operations_pruned = 0
+        self.qubits_pruned = 0
+
+    def run(self, circuit, shots=1024, progress=None):
+        '''
+        progress: optional callable progress(shots_done, gates_applied), called
+                  after every applied gate and finished shot. It may raise to
+                  abort the run (used for job cancellation).
+        '''
+        self._reset_stats()
+        self._progress = progress
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            return self._run(circuit, shots)
+        finally:
+            self._progress = None
+            if self.profiler is not None:
+                self.profiler.stop()
+
+    def _run(self, circuit, shots):
+        # Check if we need Monte Carlo simulation (intermediate measurements)
+        # We look for 'measure' operations in the circuit
+        has_measure_ops = any(op[0] == 'measure' for op in circuit.operations)
+
+        if not has_measure_ops and not circuit.measurements:
+            # No measurements at all
+            if self.method == 'sparse':
+                return {'statevector': self._sparse_evolve(SparseState(circuit.num_qubits), circuit.operations)}
+            if self.method == 'sharded':
+                with self._sharded_state(circuit.num_qubits) as state:
+                    self._sharded_evolve(state, circuit.operations)
+                    return {'statevector': Ket(state.to_dense())}
+            final_state = self._simulate_state(circuit)
+            return {'statevector': final_state}
+
+        counts = {}
+        sample = self._sampler(circuit)
+        try:
+            sample(shots, counts)
+        finally:
+            _close_sampler(sample)
+        return counts
+
+    def expectation_gradient(self, circuit, observable):
+        """
+        Expectation value <psi|H|psi> of a Hermitian observable in the
+        circuit's final state and its exact derivative with respect to the
+        angle of every rx, ry, rz, phase and cp operation, by the adjoint
+        method: one forward pass, then one backward pass undoing each gate
+        on both |psi> and H|psi>. That costs about three simulations however
+        many parameters there are, instead of 2 per parameter for parameter
+        shifts. Measurements are ignored as in statevector().
+
+        observable: an Operator (or matrix), or a Pauli sum {label: coefficient}
+                    with labels like 'ZZI' (leftmost character on the highest
+                    qubit, as in counts bitstrings)
+
+        Returns (value, gradients) where gradients[i] belongs to the i-th
+        parameterized operation in circuit order.
+        """
+        n = circuit.num_qubits
+        ops = [op for op in circuit.operations if op[0] != 'measure']
+        self._reset_stats()
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            psi = np.asarray(self._simulate_state(circuit).coef, dtype=complex)
+            lam = _observable_apply(observable, psi, n)
+            value = float(np.vdot(psi, lam).real)
+
+            gradients = []
+            for op in reversed(ops):
+                after = psi
+                psi = self._apply_kernel(psi, _inverse_op(op), n)
+                if op[0] in _PARAMETERIZED:
+                    # d/dθ U(θ) = G U(θ) for the generator G of the gate
+                    mu = self._apply_generator(after, op, n)
+                    gradients.append(2 * np.vdot(lam, mu).real)
+                lam = self._apply_kernel(lam, _inverse_op(op), n)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+        return value, np.array(gradients[::-1])
+
+    @staticmethod
+    def _apply_generator(array, op, n):
+        """
+        G |array> for the generator G = (dU/dθ) U^-1 of a parameterized gate.
+        """
+        name = op[0]
+        if name in ('rx', 'ry', 'rz'):
+            # U = exp(-iθP/2)
+            return -0.5j * _pauli_apply({'rx': 'X', 'ry': 'Y', 'rz': 'Z'}[name] + 'I' * op[1], array, n)
+        index = np.arange(2 ** n)
+        # phase and cp add e^(iθ) to basis states with the qubit (both qubits) set
+        selected = (index >> op[1]) & 1
+        if name == 'cp':
+            selected &= (index >> op[2]) & 1
+        return 1j * selected * array
+
+    def statevector(self, circuit):
+        """
+        Final pure state of the circuit as a Ket; measurements are ignored
+        (treated as Identity), so this is the pre-measurement state.
+        """
+        self._reset_stats()
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            return self._simulate_state(circuit)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+
+    def unitary(self, circuit, columns=None):
+        """
+        The circuit's unitary as a (2^n, 2^n) array; measurements are ignored
+        as in statevector(). All basis states are pushed through the gates
+        at once as the columns of one batched state, so each gate costs
+        O(4^n) instead of an O(8^n) matrix product.
+
+        columns: optional basis state indices; only those columns of the
+                 unitary are computed, returned in the given order as a
+                 (2^n, len(columns)) array.
+
+        With a CheckpointCache attached, results are cached by circuit hash.
+        """
+        n = circuit.num_qubits
+        dim = 2 ** n
+        columns = np.arange(dim) if columns is None else np.asarray(columns, dtype=np.intp).reshape(-1)
+        if np.any((columns < 0) | (columns >= dim)):
+            raise ValueError("Column indices must be basis states of the register.")
+
+        self._reset_stats()
+        if self.checkpoints is not None:
+            key = hashlib.blake2b(_prefix_hashes(circuit)[-1] + b'unitary' + columns.tobytes(),
+                                  digest_size=16).digest()
+            cached = self.checkpoints.get(key)
+            if cached is not None:
+                self.checkpoint_hits += 1
+                return cached.copy()
+            self.checkpoint_misses += 1
+
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            block = np.zeros((dim, len(columns)), dtype=complex)
+            block[columns, np.arange(len(columns))] = 1
+            for op in circuit.operations:
+                block = self._apply_kernel(block, op, n)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+
+        if self.checkpoints is not None:
+            self.checkpoints.put(key, block.copy())
+        return block
+
+    def iter_counts(self, circuit, shots=1024, batch_size=128):
+        """
+        Runs the circuit in batches of shots, yielding the cumulative counts
+        dict (updated in place) after every batch. The consumer may stop
+        iterating early; no further shots are simulated in that case.
+        """
+        if not any(op[0] == 'measure' for op in circuit.operations) and not circuit.measurements:
+            raise ValueError("Circuit has no measurements to sample.")
+
+        self._reset_stats()
+        sample = self._sampler(circuit)
+        counts = {}
+        try:
+            while self.shots_done < shots:
+                sample(min(batch_size, shots - self.shots_done), counts)
+                yield counts
+        finally:
+            _close_sampler(sample)
+
+    def _sampler(self, circuit):
+        """
+        Does the shot-independent work for a measured circuit and returns
+        sample(k, counts), which simulates k more shots into `counts`.
+        Pass it to _close_sampler when done.
+        """
+        # If we have measure ops, we MUST do shot-based simulation because
+        # the state collapses differently each time.
+        # Even if we don't have explicit measure ops but have measurements list
+        # (old style or implicit at end), the old logic worked. 
+        # But to be consistent with "Collapse" behavior, let's use the new engine 
+        # if there are ANY explicit measure instructions in the operations list.
+        # Operations outside the causal cone of the reported bits are dropped
+        # and the rest simulated on only the qubits they touch
+        reduced, self.operations_pruned = _light_cone(circuit)
+        self.qubits_pruned = circuit.num_qubits - reduced.num_qubits
+        circuit = reduced
+
+        # Measurements with nothing after them on their qubit do not change
+        # the rest of the circuit, so they are read from the final state
+        # instead; only true mid-circuit collapse needs per-shot replay.
+        body, terminal = _split_terminal_measurements(circuit)
+        has_measure_ops = any(op[0] == 'measure' for op in body.operations)
+        width = max((cbit for _, cbit in circuit.measurements + terminal), default=-1) + 1
+
+        if self.method == 'sparse':
+            return self._sparse_sampler(body, terminal, width)
+        if self.method == 'sharded':
+            return self._sharded_sampler(body, terminal, width)
+
+        if has_measure_ops:
+            n = circuit.num_qubits
+            terminal_qubits = sorted({q for q, _ in terminal}, reverse=True)
+            # Everything before the first measurement is identical for every shot
+            prefix = self._prefix_state(body)
+
+            def sample(k, counts):
+                for _ in range(k):
+                    # Run single shot
+                    state, measured_bits = self._simulate_shot(body, prefix=prefix)
+                    if terminal:
+                        marginal = self._marginal(state.coef, terminal_qubits, n)
+                        index = np.random.choice(len(marginal), p=marginal)
+                        for q_idx, c_idx in terminal:
+                            bit = len(terminal_qubits) - 1 - terminal_qubits.index(q_idx)
+                            measured_bits[c_idx] = (index >> bit) & 1
+
+                    # measured_bits is a dict {cbit: val}
+                    # We need to construct the bitstring
+                    if not measured_bits:
+                        continue
+                    if self.profiler is not None:
+                        token = self.profiler.begin()
+
+                    # Determine max cbit index
+                    max_cbit = 0
+                    if circuit.measurements:
+                         max_cbit = max(c for _, c in circuit.measurements)
+
+                    # Also check dynamic measurements from simulation
+                    if measured_bits:
+                        max_cbit = max(max_cbit, max(measured_bits.keys()))
+
+                    # Create bitstring c[n]...c[0]
+                    c_reg = ['0'] * (max_cbit + 1)
+                    for c_idx, val in measured_bits.items():
+                        c_reg[c_idx] = str(val)
+
+                    c_result = "".join(reversed(c_reg))
+                    counts[c_result] = counts.get(c_result, 0) + 1
+                    if self.profiler is not None:
+                        self.profiler.end(token, 'sample', 'counts')
+                    self._report_shot()
+
+            return sample
+
+        # Optimization: Use Statevector sampling if NO intermediate collapse is needed
+        # This is the old "Deffered Measurement" style (faster)
+        return self._marginal_sampler(body, terminal or circuit.measurements, width)
+
+    def _marginal_sampler(self, circuit, measurements, width=None, marginal=None):
+        """
+        Deferred-measurement sampler: simulates the circuit once, reduces the
+        probabilities to the 2^k marginal over the k measured qubits and
+        draws every shot from that, so sampling cost depends on k, not n.
+        measurements: (qubit, cbit) pairs read at the end of the circuit,
+                      applied in order when several write the same cbit
+        width: classical register size, by default up to the highest cbit
+        marginal: the marginal of the measured qubits if already known
+        With a CheckpointCache attached the marginal is cached too, so a
+        repeated request skips the simulation entirely.
+        """
+        qubits = sorted({q for q, _ in measurements}, reverse=True)
+        if marginal is None:
+            marginal = self._final_marginal(circuit, qubits)
+
+        # Marginal index bit k-1-j holds qubit qubits[j]
+        k = len(qubits)
+        bit_of = {q: k - 1 - j for j, q in enumerate(qubits)}
+        if width is None:
+            width = max((cbit for _, cbit in measurements), default=-1) + 1
+        labels = {}
+
+        def label(index):
+            if index not in labels:
+                c_reg = ['0'] * width
+                for q_idx, c_idx in measurements:
+                    c_reg[c_idx] = str((index >> bit_of[q_idx]) & 1)
+                labels[index] = "".join(reversed(c_reg))
+            return labels[index]
+
+        def sample(shots, counts):
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            if measurements:
+                hist = np.bincount(np.random.choice(len(marginal), size=shots, p=marginal),
+                                   minlength=len(marginal))
+                for index in np.flatnonzero(hist):
+                    c_result = label(int(index))
+                    counts[c_result] = counts.get(c_result, 0) + int(hist[index])
+
+            if self.profiler is not None:
+                self.profiler.end(token, 'sample', 'counts')
+            self.shots_done += shots
+            if self._progress is not None:
+                self._progress(self.shots_done, self.gates_applied)
+
+        return sample
+
+    def _final_marginal(self, circuit, qubits):
+        """
+        Marginal of `qubits` (highest first) in the circuit's final state,
+        cached in the CheckpointCache when one is attached.
+        """
+        marginal = None
+        if self.checkpoints is not None:
+            key = _marginal_key(_prefix_hashes(circuit)[-1], qubits)
+            marginal = self.checkpoints.get(key)
+        if marginal is None:
+            marginal = self._marginal(self._simulate_state(circuit).coef, qubits, circuit.num_qubits)
+            if self.checkpoints is not None:
+                self.checkpoints.put(key, marginal)
+        return marginal
+
+    def probabilities(self, circuit, top_k=None, threshold=0.0):
+        """
+        Exact outcome distribution of a measured circuit as a sparse
+        {bitstring: probability} dict, labelled like the counts of run(),
+        without sampling any shots. Terminal measurements are read from the
+        marginal of the final state; mid-circuit measurements branch over
+        both outcomes, so the cost doubles with each of those.
+
+        top_k: keep only the k most probable outcomes
+        threshold: keep only outcomes with at least this probability
+        Outcomes are ordered from most to least probable; probabilities
+        below rounding noise (_ZERO_PROBABILITY) are never returned.
+        """
+        if not any(op[0] == 'measure' for op in circuit.operations) and not circuit.measurements:
+            raise ValueError("Circuit has no measurements.")
+
+        self._reset_stats()
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            reduced, self.operations_pruned = _light_cone(circuit)
+            self.qubits_pruned = circuit.num_qubits - reduced.num_qubits
+            keys, probs, width = self._outcome_distribution(reduced)
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+
+        # Several branches or marginal entries can land on the same register value
+        keys, inverse = np.unique(keys, return_inverse=True)
+        probs = np.bincount(inverse.reshape(-1), weights=probs)
+        selected = np.flatnonzero((probs > _ZERO_PROBABILITY) & (probs >= threshold))
+        selected = selected[np.argsort(-probs[selected], kind='stable')][:top_k]
+        return {format(int(keys[i]), f'0{width}b'): float(probs[i]) for i in selected}
+
+    def _outcome_distribution(self, circuit):
+        """
+        Returns (register values, probabilities, register width) over every
+        outcome of the measured circuit; values may repeat.
+        """
+        body, terminal = _split_terminal_measurements(circuit)
+        width = max((cbit for _, cbit in circuit.measurements + terminal), default=-1) + 1
+        if not any(op[0] == 'measure' for op in body.operations):
+            measurements = terminal or circuit.measurements
+            if self.method == 'sparse':
+                state = self._sparse_evolve(SparseState(body.num_qubits), body.operations)
+                return self._register_distribution(state, measurements) + (width,)
+            qubits = sorted({q for q, _ in measurements}, reverse=True)
+            if self.method == 'sharded':
+                with self._sharded_state(body.num_qubits) as state:
+                    self._sharded_evolve(state, body.operations)
+                    return self._register_values(measurements, qubits), state.marginal(qubits), width
+            return self._register_values(measurements, qubits), self._final_marginal(body, qubits), width
+
+        # Branching keeps one state per outcome, so it always runs densely
+
+        n = circuit.num_qubits
+        state, start = self._prefix_state(body)
+        branches = [(state.coef, 1.0, {})]  # (amplitudes, probability, {cbit: outcome})
+        for op in body.operations[start:]:
+            if op[0] != 'measure':
+                branches = [(self._apply_kernel(coef, op, n), p, bits) for coef, p, bits in branches]
+                continue
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            branches = [
+                (collapsed, p * p_outcome, {**bits, op[2]: outcome})
+                for coef, p, bits in branches
+                for outcome, p_outcome, collapsed in self._collapse(coef, op[1], n)
+            ]
+            if self.profiler is not None:
+                self.profiler.end(token, 'measure', 'measure')
+
+        qubits = sorted({q for q, _ in terminal}, reverse=True)
+        terminal_values = self._register_values(terminal, qubits)
+        # Terminal measurements come last, so they overwrite mid-circuit results
+        terminal_cbits = {c for _, c in terminal}
+        keys, probs = [], []
+        for coef, p, bits in branches:
+            base = sum(outcome << c for c, outcome in bits.items() if c not in terminal_cbits)
+            if terminal:
+                keys.append(base | terminal_values)
+                probs.append(p * self._marginal(coef, qubits, n))
+            else:
+                keys.append(np.array([base]))
+                probs.append(np.array([p]))
+        return np.concatenate(keys), np.concatenate(probs), width
+
+    def _sparse_sampler(self, circuit, terminal, width):
+        """
+        _sampler for method='sparse'. circuit is the body left after the
+        terminal measurements were split off; mid-circuit measurements
+        collapse a per-shot copy of the state after the deterministic prefix.
+        """
+        ops = circuit.operations
+        first_measure = next((i for i, op in enumerate(ops) if op[0] == 'measure'), len(ops))
+        prefix = self._sparse_evolve(SparseState(circuit.num_qubits), ops[:first_measure])
+        terminal_cbits = {c for _, c in terminal}
+        if first_measure == len(ops):
+            distribution = self._register_distribution(prefix, terminal or circuit.measurements)
+
+        def record(value, counts, k=1):
+            c_result = format(int(value), f'0{width}b')
+            counts[c_result] = counts.get(c_result, 0) + k
+
+        def sample(k, counts):
+            if first_measure == len(ops):
+                if self.profiler is not None:
+                    token = self.profiler.begin()
+                keys, probs = distribution
+                hist = np.bincount(np.random.choice(len(probs), size=k, p=probs), minlength=len(probs))
+                for index in np.flatnonzero(hist):
+                    record(keys[index], counts, int(hist[index]))
+                if self.profiler is not None:
+                    self.profiler.end(token, 'sample', 'counts')
+                self.shots_done += k
+                if self._progress is not None:
+                    self._progress(self.shots_done, self.gates_applied)
+                return
+
+            for _ in range(k):
+                state, bits = prefix, {}
+                for op in ops[first_measure:]:
+                    if op[0] != 'measure':
+                        state = self._sparse_evolve(state, [op])
+                        continue
+                    if self.profiler is not None:
+                        token = self.profiler.begin()
+                    if isinstance(state, SparseState):
+                        state, bits[op[2]] = state.measure(op[1])
+                    else:
+                        state, bits[op[2]] = self._measure(state, op[1], circuit.num_qubits)
+                    if self.profiler is not None:
+                        self.profiler.end(token, 'measure', 'measure')
+                value = sum(outcome << c for c, outcome in bits.items() if c not in terminal_cbits)
+                if terminal:
+                    keys, probs = self._register_distribution(state, terminal)
+                    value |= int(keys[np.random.choice(len(probs), p=probs)])
+                record(value, counts)
+                self._report_shot()
+
+        return sample
+
+    def _sparse_evolve(self, state, ops):
+        """
+        Applies ops (measurements are Identity) to a SparseState, switching
+        to a dense Ket once more than sparse_density of the amplitudes are
+        non-zero. Returns the final SparseState or Ket.
+        """
+        n = state.num_qubits if isinstance(state, SparseState) else int(np.log2(len(state.coef)))
+        for op in ops:
+            if op[0] == 'measure':
+                continue
+            if not isinstance(state, SparseState):
+                state = self._apply_gate(state, op, n)
+                continue
+            self.gates_applied += 1
+            if self._progress is not None:
+                self._progress(self.shots_done, self.gates_applied)
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            state = state.apply(op)
+            if self.profiler is not None:
+                self.profiler.end(token, 'apply', op[0])
+            self.peak_state_bytes = max(self.peak_state_bytes, state.nbytes)
+            if state.density > self.sparse_density:
+                state = Ket(state.to_dense())
+        return state
+
+    def _register_distribution(self, state, measurements):
+        """
+        (register values, probabilities) of reading (qubit, cbit)
+        measurements from a SparseState or Ket; values may repeat.
+        """
+        if not isinstance(state, SparseState):
+            n = int(np.log2(len(state.coef)))
+            qubits = sorted({q for q, _ in measurements}, reverse=True)
+            return self._register_values(measurements, qubits), self._marginal(state.coef, qubits, n)
+        keys = np.zeros(state.nnz, dtype=np.int64)
+        for c, q in {c: q for q, c in measurements}.items():
+            keys |= ((state.indices >> q) & 1) << c
+        probs = np.abs(state.values) ** 2
+        return keys, probs / probs.sum()
+
+    def _sharded_state(self, n):
+        return ShardedStatevector(n, min(self.shards, 2 ** n), self.processes, self.pool)
+
+    def _sharded_sampler(self, circuit, terminal, width):
+        """
+        _sampler for method='sharded'. Terminal measurements are drawn from
+        the marginal gathered from the shards; with mid-circuit
+        measurements every shot replays the rest of the circuit on a copy
+        of the prefix state, which sample.close() frees (see _close_sampler).
+        """
+        n = circuit.num_qubits
+        ops = circuit.operations
+        first_measure = next((i for i, op in enumerate(ops) if op[0] == 'measure'), len(ops))
+        prefix = self._sharded_state(n)
+        try:
+            self._sharded_evolve(prefix, ops[:first_measure])
+        except BaseException:
+            prefix.close()
+            raise
+        if first_measure == len(ops):
+            measurements = terminal or circuit.measurements
+            with prefix:
+                marginal = prefix.marginal(sorted({q for q, _ in measurements}, reverse=True))
+            return self._marginal_sampler(circuit, measurements, width, marginal)
+
+        terminal_cbits = {c for _, c in terminal}
+        qubits = sorted({q for q, _ in terminal}, reverse=True)
+        terminal_values = self._register_values(terminal, qubits)
+
+        def sample(k, counts):
+            for _ in range(k):
+                bits = {}
+                with prefix.copy() as state:
+                    for op in ops[first_measure:]:
+                        if op[0] != 'measure':
+                            self._sharded_evolve(state, [op])
+                            continue
+                        if self.profiler is not None:
+                            token = self.profiler.begin()
+                        p1 = state.marginal([op[1]])[1]
+                        outcome = int(np.random.random() < p1)
+                        state.collapse(op[1], outcome, p1 if outcome else 1 - p1)
+                        bits[op[2]] = outcome
+                        if self.profiler is not None:
+                            self.profiler.end(token, 'measure', 'measure')
+                    value = sum(outcome << c for c, outcome in bits.items() if c not in terminal_cbits)
+                    if terminal:
+                        marginal = state.marginal(qubits)
+                        value |= int(terminal_values[np.random.choice(len(marginal), p=marginal)])
+                c_result = format(value, f'0{width}b')
+                counts[c_result] = counts.get(c_result, 0) + 1
+                self._report_shot()
+
+        sample.close = prefix.close
+        return sample
+
+    def _sharded_evolve(self, state, ops):
+        """
+        Applies ops (measurements are Identity) to a ShardedStatevector in place.
+        """
+        for op in ops:
+            if op[0] == 'measure':
+                continue
+            self.gates_applied += 1
+            if self._progress is not None:
+                self._progress(self.shots_done, self.gates_applied)
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            state.apply(op)
+            if self.profiler is not None:
+                self.profiler.end(token, 'apply', op[0])
+            self.peak_state_bytes = max(self.peak_state_bytes, state.nbytes)
+
+    @staticmethod
+    def _register_values(measurements, qubits):
+        """
+        Classical register value for every index of the marginal over
+        `qubits` (highest first), with (qubit, cbit) measurements applied in
+        order so the last write to a cbit wins.
+        """
+        k = len(qubits)
+        index = np.arange(2 ** k)
+        writer = {c: q for q, c in measurements}
+        values = np.zeros(2 ** k, dtype=np.int64)
+        for c, q in writer.items():
+            values |= ((index >> (k - 1 - qubits.index(q))) & 1) << c
+        return values
+
+    @staticmethod
+    def _collapse(coef, qubit, n):
+        """
+        Yields (outcome, probability, normalized post-measurement amplitudes)
+        for each possible outcome of measuring qubit.
+        """
+        tensor = np.asarray(coef).reshape((2,) * n)
+        for outcome in (0, 1):
+            index = [slice(None)] * n
+            index[n - 1 - qubit] = outcome  # axis n-1-q holds qubit q
+            part = np.zeros(tensor.shape, dtype=complex)
+            part[tuple(index)] = tensor[tuple(index)]
+            p = float(np.vdot(part, part).real)
+            if p > _ZERO_PROBABILITY:
+                yield outcome, p, part.reshape(-1) / np.sqrt(p)
+
+    @staticmethod
+    def _marginal(coef, qubits, n):
+        """
+        Probabilities of the measured qubits (listed from highest to lowest),
+        summed over all other qubits with a reshape, normalized.
+        """
+        probs = np.abs(coef.reshape((2,) * n)) ** 2
+        # Axis n-1-q holds qubit q (LSB ordering)
+        kept = {n - 1 - q for q in qubits}
+        probs = probs.sum(axis=tuple(axis for axis in range(n) if axis not in kept)).reshape(-1)
+        return probs / probs.sum()
+
+    def _report_shot(self):
+        self.shots_done += 1
+        if self._progress is not None:
+            self._progress(self.shots_done, self.gates_applied)
+
+    def _simulate_state(self, circuit):
+        """
+        Original simulator for pure states (no intermediate collapse).
+        Ignores 'measure' operations to prevent crash, effectively treating them as Identity
+        if this method is called directly (though .run() guards against this).
+        """
+        state, _ = self._simulate_shot(circuit, force_pure=True)
+        return state
+
+    def _simulate_shot(self, circuit, force_pure=False, prefix=None):
+        """
+        Simulates a single shot of the circuit.
+        current_state evolves.
+        prefix: optional (state, start) pair from _prefix_state, so repeated
+                shots do not replay the deterministic part of the circuit.
+        Returns (final_state, measured_values_dict)
+        """
+        n = circuit.num_qubits
+        if prefix is None:
+            prefix = self._prefix_state(circuit, force_pure)
+        state, start = prefix
+
+        measured_values = {}
+
+        gates = []
+        for op in circuit.operations[start:]:
+            if op[0] != 'measure':
+                gates.append(op)
+                continue
+            if force_pure:
+                continue # Treat as Identity in pure mode
+            state = self._apply_ops(state, gates, n)
+            gates = []
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            state, outcome = self._measure(state, op[1], n)
+            if self.profiler is not None:
+                self.profiler.end(token, 'measure', 'measure')
+            measured_values[op[2]] = outcome
+
+        return self._apply_ops(state, gates, n), measured_values
+
+    def _prefix_state(self, circuit, force_pure=False):
+        """
+        Evolves |0...0> through the deterministic prefix of the circuit, i.e.
+        every operation before the first collapsing measurement (the whole
+        circuit when force_pure is set).
+
+        With a CheckpointCache attached, evolution resumes from the longest
+        cached prefix and new checkpoints are stored every
+        checkpoint_interval operations and at the end of the prefix, so an
+        edit near the end of a deep circuit only replays the edited tail.
+
+        Returns (state, index of the first operation not yet applied)
         """
         n = circuit.num_qubits
+        ops = circuit.operations
+        stop = len(ops)
+        if not force_pure:
+            stop = next((i for i, op in enumerate(ops) if op[0] == 'measure'), stop)
+
         state = Ket([1, 0])
         for _ in range(n - 1):
             state = state.tensor(Ket([1, 0]))
-            
-        measured_values = {}
-            
-        for op in circuit.operations:
-            gate_name = op[0]
-            
-            if gate_name == 'measure':
-                if force_pure:
-                    continue # Treat as Identity in pure mode
-                
-                qubit = op[1]
-                cbit = op[2]
-                
-                # Projective Measurement
-                # 1. Calculate P(0) and P(1)
-                # We need projectors P0 and P1 for the specific qubit
-                # P0 = |0><0|, P1 = |1><1|
-                
-                # Construct big Projectors M0 and M1
-                # This is expensive O(2^N). Optimized way:
-                # Calculate marginal probability.
-                # Or just matrix multiply since N is small (<15).
-                
-                p0_matrix = np.array([[1, 0], [0, 0]], dtype=complex)
-                p1_matrix = np.array([[0, 0], [0, 1]], dtype=complex)
-                
-                # Tensor them up
-                # LSB ordering: qubit 0 is last in tensor
-                M0 = Operator([[1]])
-                M1 = Operator([[1]])
-                
-                for i in range(n):
-                    if i == (n - 1 - qubit):
-                        M0 = M0.tensor(Operator(p0_matrix))
-                        M1 = M1.tensor(Operator(p1_matrix))
-                    else:
-                        M0 = M0.tensor(Operator(Operator.identity))
-                        M1 = M1.tensor(Operator(Operator.identity))
-                        
-                # Probabilities
-                # <psi|M0|psi>
-                # M0 is projection, M0*M0 = M0, Hermitian
-                psi_vec = state.coef
-                
-                # M0|psi>
-                proj0_vec = M0.matrix @ psi_vec
-                prob0 = np.real(np.vdot(psi_vec, proj0_vec)) # vdot handles complex conjugate
-                
-                # Decide outcome
-                r = np.random.random()
-                
-                if r < prob0:
-                    outcome = 0
-                    # Collapse to projected state and normalize
-                    new_vec = proj0_vec / np.sqrt(prob0)
-                    state = Ket(new_vec)
-                else:
-                    outcome = 1
-                    prob1 = 1.0 - prob0
-                    # M1|psi>
-                    proj1_vec = M1.matrix @ psi_vec
-                    new_vec = proj1_vec / np.sqrt(prob1)
-                    state = Ket(new_vec)
-                    
-                measured_values[cbit] = outcome
-                
-            elif gate_name == 'h':
-                # Use manual H construction with LSB ordering
-                H = (1 / np.sqrt(2)) * np.array([[1, 1], [1, -1]], dtype=complex)
-                gate = self._single_qubit_gate(H, op[1], n)
-                state = gate.op(state)
-            elif gate_name == 'x':
-                X = Operator.pauli_x
-                gate = self._single_qubit_gate(X, op[1], n)
-                state = gate.op(state)
-            elif gate_name == 'y':
-                Y = Operator.pauli_y
-                gate = self._single_qubit_gate(Y, op[1], n)
-                state = gate.op(state)
-            elif gate_name == 'z':
-                Z = Operator.pauli_z
-                gate = self._single_qubit_gate(Z, op[1], n)
-                state = gate.op(state)
-            elif gate_name == 'phase':
-                gate = Operator.phase(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 't':
-                gate = Operator.t_gate(op[1], n)
-                state = gate.op(state)
-            elif gate_name == 's':
-                gate = Operator.s_gate(op[1], n)
-                state = gate.op(state)
-            elif gate_name == 'cx':
-                gate = Operator.cnot(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 'cz':
-                gate = Operator.cz(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 'cp':
-                gate = Operator.cp(op[1], op[2], op[3], n)
-                state = gate.op(state)
-            elif gate_name == 'cp':
-                # ('cp', control, target, theta)
-                gate = Operator.cp(op[1], op[2], op[3], n)
-                state = gate.op(state)
-            elif gate_name == 'swap':
-                gate = Operator.swap(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 'custom':
-                # ('custom', qubit, matrix_numpy)
-                mat = op[2]
-                qubit = op[1]
-                gate = self._single_qubit_gate(mat, qubit, n)
-                state = gate.op(state)
-            elif gate_name == 'rx':
-                gate = Operator.rx(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 'ry':
-                gate = Operator.ry(op[1], op[2], n)
-                state = gate.op(state)
-            elif gate_name == 'rz':
-                gate = Operator.rz(op[1], op[2], n)
-                state = gate.op(state)
-                
-        return state, measured_values
+
+        if self.checkpoints is None:
+            return self._apply_ops(state, ops[:stop], n), stop
+
+        hashes = _prefix_hashes(circuit, stop)
+        start, coef = self.checkpoints.longest_prefix(hashes)
+        if coef is not None:
+            # Evolve the cached array itself: Ket() would copy it, which
+            # for a memory-mapped disk checkpoint reads the whole file
+            state = Ket.__new__(Ket)
+            state.coef = coef
+            self.checkpoint_hits += 1
+        else:
+            self.checkpoint_misses += 1
+
+        while start < stop:
+            # Up to the next multiple of checkpoint_interval, or the end
+            end = min(stop, (start // self.checkpoint_interval + 1) * self.checkpoint_interval)
+            state = self._apply_ops(state, ops[start:end], n)
+            self.checkpoints.put(hashes[end], state.coef, position=end)
+            start = end
+        return state, stop
+
+    def _measure(self, state, qubit, n):
+        """
+        Projective measurement of one qubit.
+        Returns (collapsed_state, outcome)
+        """
+        # 1. Calculate P(0) and P(1)
+        # We need projectors P0 and P1 for the specific qubit
+        # P0 = |0><0|, P1 = |1><1|
+
+        # Construct big Projectors M0 and M1
+        # This is expensive O(2^N). Optimized way:
+        # Calculate marginal probability.
+        # Or just matrix multiply since N is small (<15).
+
+        p0_matrix = np.array([[1, 0], [0, 0]], dtype=complex)
+        p1_matrix = np.array([[0, 0], [0, 1]], dtype=complex)
+
+        # Tensor them up
+        # LSB ordering: qubit 0 is last in tensor
+        M0 = Operator([[1]])
+        M1 = Operator([[1]])
+
+        for i in range(n):
+            if i == (n - 1 - qubit):
+                M0 = M0.tensor(Operator(p0_matrix))
+                M1 = M1.tensor(Operator(p1_matrix))
+            else:
+                M0 = M0.tensor(Operator(Operator.identity))
+                M1 = M1.tensor(Operator(Operator.identity))
+
+        # Probabilities
+        # <psi|M0|psi>
+        # M0 is projection, M0*M0 = M0, Hermitian
+        psi_vec = state.coef
+
+        # M0|psi>
+        proj0_vec = M0._apply(psi_vec)
+        prob0 = np.real(np.vdot(psi_vec, proj0_vec)) # vdot handles complex conjugate
+
+        # Decide outcome
+        r = np.random.random()
+
+        if r < prob0:
+            # Collapse to projected state and normalize
+            new_vec = proj0_vec / np.sqrt(prob0)
+            return Ket(new_vec), 0
+
+        prob1 = 1.0 - prob0
+        # M1|psi>
+        proj1_vec = M1._apply(psi_vec)
+        new_vec = proj1_vec / np.sqrt(prob1)
+        return Ket(new_vec), 1
+
+    def _apply_ops(self, state, ops, n):
+        """
+        Applies a run of non-measurement operations layer by layer, see
+        _gate_layers and _apply_layer. Returns the new state.
+
+        SWAPs move no amplitudes: they exchange two entries of a logical to
+        physical qubit map that the later gates of the run are translated
+        through. The accumulated permutation is resolved once, with one
+        transpose, before the state leaves the run (to be measured,
+        checkpointed or returned), so a chain of SWAPs from routing costs at
+        most one pass over the statevector.
+        """
+        layout = list(range(n))  # logical qubit -> physical qubit
+        gates = []
+        for op in ops:
+            if op[0] == 'swap':
+                a, b = op[1], op[2]
+                if a < 0 or a >= n or b < 0 or b >= n:
+                    raise ValueError("Qubit indices must be within the range of the number of qubits.")
+                if a == b:
+                    raise ValueError("Qubit indices must be different.")
+                layout[a], layout[b] = layout[b], layout[a]
+                self.gates_applied += 1
+                if self._progress is not None:
+                    self._progress(self.shots_done, self.gates_applied)
+            elif op[0] not in _GATES:
+                continue  # treated as Identity, as by _apply_kernel
+            elif all(0 <= q < n for q in _op_qubits(op)):
+                gates.append(_remap_op(op, layout))
+            else:
+                gates.append(op)  # rejected by its kernel
+
+        coef = state.coef
+        for layer in _gate_layers(gates):
+            coef = self._apply_layer(coef, layer, n)
+        if layout != list(range(n)):
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            coef = _relabel(coef, layout, n)
+            if self.profiler is not None:
+                self.profiler.end(token, 'apply', 'relabel')
+            self.peak_state_bytes = max(self.peak_state_bytes, 2 * coef.nbytes)
+        return state if coef is state.coef else Ket(coef)
+
+    def _apply_layer(self, array, layer, n):
+        """
+        Applies gates on disjoint qubits to `array` (as _apply_kernel). Gates
+        that only touch the lowest _TILE_QUBITS qubits act within contiguous
+        tiles of 2^_TILE_QUBITS amplitudes, so they are applied one tile at a
+        time: each tile is read from memory once for all of them instead of
+        once per gate. The remaining gates are then applied one by one.
+        """
+        low = [op for op in layer if max(_op_qubits(op)) < _TILE_QUBITS]
+        if n <= _TILE_QUBITS or len(low) < 2:
+            for op in layer:
+                array = self._apply_kernel(array, op, n)
+            return array
+
+        gates = []
+        for op in low:
+            self.gates_applied += 1
+            if self._progress is not None:
+                self._progress(self.shots_done, self.gates_applied)
+            if self.profiler is not None:
+                token = self.profiler.begin()
+            gates.append(self._gate_operator(op, _TILE_QUBITS))
+            if self.profiler is not None:
+                self.profiler.end(token, 'build', op[0])
+
+        if self.profiler is not None:
+            token = self.profiler.begin()
+        tile = 2 ** _TILE_QUBITS
+        result = np.empty(array.shape, dtype=np.result_type(array, complex))
+        for start in range(0, len(array), tile):
+            block = array[start:start + tile]
+            for gate in gates:
+                block = gate._apply(block)
+            result[start:start + tile] = block
+        if self.profiler is not None:
+            self.profiler.end(token, 'apply', 'layer')
+        self.peak_state_bytes = max(self.peak_state_bytes, array.nbytes + result.nbytes)
+
+        for op in layer:
+            if max(_op_qubits(op)) >= _TILE_QUBITS:
+                result = self._apply_kernel(result, op, n)
+        return result
+
+    def _apply_gate(self, state, op, n):
+        """
+        Applies a single non-measurement operation and returns the new state.
+        'measure' operations are treated as Identity.
+        """
+        coef = self._apply_kernel(state.coef, op, n)
+        return state if coef is state.coef else Ket(coef)
+
+    def _apply_kernel(self, array, op, n):
+        """
+        Applies a single non-measurement operation to `array`, a statevector
+        of shape (2^n,) or a batch of them as the columns of a (2^n, m)
+        array, through the gate's structured (per-axis, permutation or
+        diagonal) application. 'measure' and other operations that are not
+        gates are treated as Identity.
+        """
+        gate_name = op[0]
+
+        if gate_name not in _GATES:
+            return array
+
+        self.gates_applied += 1
+        if self._progress is not None:
+            self._progress(self.shots_done, self.gates_applied)
+        if self.profiler is not None:
+            token = self.profiler.begin()
+        gate = self._gate_operator(op, n)
+        if self.profiler is not None:
+            self.profiler.end(token, 'build', gate_name)
+            token = self.profiler.begin()
+        array = gate._apply(array)
+        if self.profiler is not None:
+            self.profiler.end(token, 'apply', gate_name)
+
+        self.peak_state_bytes = max(self.peak_state_bytes, array.nbytes)
+        return array
+
+    def _gate_operator(self, op, n):
+        """
+        The structured Operator of a gate operation on an n-qubit register,
+        or None for operations that are not gates.
+        """
+        gate_name = op[0]
+        if gate_name == 'h':
+            # Use manual H construction with LSB ordering
+            H = (1 / np.sqrt(2)) * np.array([[1, 1], [1, -1]], dtype=complex)
+            gate = self._single_qubit_gate(H, op[1], n)
+        elif gate_name == 'x':
+            gate = self._single_qubit_gate(Operator.pauli_x, op[1], n)
+        elif gate_name == 'y':
+            gate = self._single_qubit_gate(Operator.pauli_y, op[1], n)
+        elif gate_name == 'z':
+            gate = self._single_qubit_gate(Operator.pauli_z, op[1], n)
+        elif gate_name == 'phase':
+            gate = Operator.phase(op[1], op[2], n)
+        elif gate_name == 't':
+            gate = Operator.t_gate(op[1], n)
+        elif gate_name == 's':
+            gate = Operator.s_gate(op[1], n)
+        elif gate_name == 'cx':
+            gate = Operator.cnot(op[1], op[2], n)
+        elif gate_name == 'cz':
+            gate = Operator.cz(op[1], op[2], n)
+        elif gate_name == 'cp':
+            # ('cp', control, target, theta)
+            gate = Operator.cp(op[1], op[2], op[3], n)
+        elif gate_name == 'swap':
+            gate = Operator.swap(op[1], op[2], n)
+        elif gate_name == 'custom':
+            # ('custom', qubit or qubits, matrix_numpy)
+            qubits = _op_qubits(op)
+            gate = SubsystemOperator(_validated_gate(op[2], len(qubits)), qubits, n)
+        elif gate_name == 'rx':
+            gate = Operator.rx(op[1], op[2], n)
+        elif gate_name == 'ry':
+            gate = Operator.ry(op[1], op[2], n)
+        elif gate_name == 'rz':
+            gate = Operator.rz(op[1], op[2], n)
+        else:
+            return None
+        return gate
 
     def _single_qubit_gate(self, matrix, qubit, no_of_qubits):
         result = Operator([[1]])
@@ -916,3 +3329,229 @@ class Simulator:
             else:
                 result = result.tensor(Operator(Operator.identity))
         return result
+
+
+class CostModel:
+    # Seconds per operation as coefficients of (1, 2^n), fitted by
+    # calibrate() on a development machine. Gates are lazy Kronecker
+    # products, permutations or diagonals, all applied in O(2^n).
+    DEFAULT_GATE_SECONDS = {
+        'h': [0.000116, 3.19e-08],
+        'x': [0.000117, 9.08e-08],
+        'y': [0.000161, 6.37e-08],
+        'z': [0.000157, 6.33e-08],
+        'custom': [0.000163, 6.42e-08],
+        'phase': [4.62e-05, 1.36e-08],
+        't': [4.68e-05, 9.92e-09],
+        's': [4.84e-05, 1.07e-08],
+        'rx': [0.000171, 6.19e-08],
+        'ry': [0.000165, 7.54e-08],
+        'rz': [0.000174, 6.77e-08],
+        'cx': [4.27e-05, 1.11e-08],
+        'cz': [4.83e-05, 1.17e-08],
+        'cp': [4.83e-05, 1.44e-08],
+        'swap': [5.6e-05, 1.56e-08],
+        'measure': [0.000159, 8.89e-08],
+    }
+
+    # No backend indexes more than 2^62 basis states (see SparseState), so
+    # larger registers are priced as impossible instead of evaluated: the
+    # 2^n terms overflow a float from n = 1024
+    MAX_QUBITS = 62
+
+    # Seconds per basis state and per shot for sampling, see calibrate()
+    DEFAULT_SAMPLING_SECONDS = {'per_basis_state': 1.9e-06, 'per_shot': 4.5e-08, 'per_collapsed_shot': 0.0}
+
+    def __init__(self, gate_seconds=None, sampling_seconds=None):
+        '''
+        Predicts peak memory and runtime of Simulator.run from the register
+        size, the gate mix, where the measurements are and the shot count,
+        without allocating anything.
+
+        gate_seconds: {op_name: [c0, c1]} time per operation as c0 + c1*2^n
+        sampling_seconds: {'per_basis_state': s, 'per_shot': s,
+                           'per_collapsed_shot': s}
+        '''
+        self.gate_seconds = dict(self.DEFAULT_GATE_SECONDS)
+        self.gate_seconds.update(gate_seconds or {})
+        self.sampling_seconds = dict(self.DEFAULT_SAMPLING_SECONDS)
+        self.sampling_seconds.update(sampling_seconds or {})
+
+    def _op_seconds(self, name, n):
+        c = self.gate_seconds.get(name, self.gate_seconds['h'])
+        return c[0] + c[1] * 2.0**n
+
+    def _gate_seconds(self, op, n):
+        # A k-qubit custom gate contracts 2^k amplitudes into each output one
+        # (calibrated on a single-qubit matrix)
+        seconds = self._op_seconds(op[0], n)
+        if op[0] == 'custom':
+            seconds *= 2 ** (len(_op_qubits(op)) - 1)
+        return seconds
+
+    def estimate(self, circuit, shots=1024, exact=False, method='statevector'):
+        """
+        Returns {'peak_bytes', 'seconds', 'path'} where path is 'statevector'
+        (no measurements), 'sampled' (one simulation, then sampling) or
+        'per_shot' (mid-circuit collapse, the measured part replayed per shot).
+        exact prices Simulator.probabilities instead, which ignores shots:
+        mid-circuit collapse then takes the 'branched' path, replaying the
+        measured part once per outcome branch (2^m for m measurements).
+        method='sparse' prices a sparse run from an upper bound on its
+        non-zero amplitudes, or as dense if it would be converted.
+        Registers of more than MAX_QUBITS qubits (after light-cone pruning)
+        get math.inf for peak_bytes and seconds, and path 'unsupported'.
+        """
+        if circuit.measurements or any(op[0] == 'measure' for op in circuit.operations):
+            # Sampled runs only simulate the light cone, see Simulator._sampler
+            circuit, _ = _light_cone(circuit)
+        n = circuit.num_qubits
+        if n > self.MAX_QUBITS:
+            return {'peak_bytes': math.inf, 'seconds': math.inf, 'path': 'unsupported'}
+        # Terminal measurements are read from the final state, see Simulator._sampler
+        body, terminal = _split_terminal_measurements(circuit)
+        ops = body.operations
+        if method == 'sparse':
+            estimate = self._sparse_estimate(circuit, ops, terminal, shots, exact)
+            if estimate is not None:
+                return estimate
+        state_bytes = 16 * 2.0**n
+        # current state, its successor and the Ket dtype conversion copy
+        peak = 3 * state_bytes
+
+        first_measure = next((i for i, op in enumerate(ops) if op[0] == 'measure'), None)
+        prefix_seconds = sum(self._gate_seconds(op, n) for op in ops[:first_measure])
+
+        if first_measure is None and not terminal and not circuit.measurements:
+            return {'peak_bytes': int(peak), 'seconds': prefix_seconds, 'path': 'statevector'}
+
+        if first_measure is not None:
+            shot_seconds = sum(self._gate_seconds(op, n) for op in ops[first_measure:])
+            shot_seconds += self.sampling_seconds['per_collapsed_shot']
+            if terminal:
+                shot_seconds += self.sampling_seconds['per_basis_state'] * 2.0**n
+            if exact:
+                branches = 2.0 ** sum(op[0] == 'measure' for op in ops)
+                # every live branch's state, plus the next list while it is built
+                peak += 2 * branches * state_bytes
+                return {'peak_bytes': int(peak), 'seconds': prefix_seconds + branches * shot_seconds, 'path': 'branched'}
+            return {'peak_bytes': int(peak), 'seconds': prefix_seconds + shots * shot_seconds, 'path': 'per_shot'}
+
+        # Deferred sampling squares the amplitudes into a float probability
+        # vector before reducing it to the measured qubits
+        peak += 8 * 2.0**n
+        seconds = prefix_seconds + self.sampling_seconds['per_basis_state'] * 2.0**n
+        if not exact:
+            seconds += self.sampling_seconds['per_shot'] * shots
+        return {'peak_bytes': int(peak), 'seconds': seconds, 'path': 'sampled'}
+
+    def _sparse_estimate(self, circuit, ops, terminal, shots, exact):
+        """
+        estimate() for a sparse run of the body ops, or None when the state
+        could reach the dense conversion threshold (or exact branching,
+        which runs densely) so the dense estimate applies.
+        """
+        n = circuit.num_qubits
+        nnz = peak_entries = 1.0
+        op_seconds = []
+        for op in ops:
+            if op[0] == 'measure':
+                op_seconds.append(0.0)
+                continue
+            matrix, _ = _gate_matrix(op)
+            if _branching(matrix):
+                # every entry branches before duplicates are merged
+                peak_entries = max(peak_entries, nnz * len(matrix))
+                nnz = min(nnz * len(matrix), 2.0**n)
+                if nnz > _SPARSE_DENSITY * 2.0**n:
+                    return None
+            # A pass over m sparse entries is priced like a dense pass over m amplitudes
+            op_seconds.append(self._gate_seconds(op, float(np.log2(nnz))))
+        # indices and values of the state, the branch candidates and the merged result
+        peak = 3 * 24 * peak_entries
+
+        first_measure = next((i for i, op in enumerate(ops) if op[0] == 'measure'), None)
+        prefix_seconds = sum(op_seconds[:first_measure])
+        if first_measure is None and not terminal and not circuit.measurements:
+            return {'peak_bytes': int(peak), 'seconds': prefix_seconds, 'path': 'statevector'}
+        if first_measure is not None:
+            if exact:
+                return None
+            shot_seconds = sum(op_seconds[first_measure:]) + self.sampling_seconds['per_collapsed_shot']
+            if terminal:
+                shot_seconds += self.sampling_seconds['per_basis_state'] * nnz
+            return {'peak_bytes': int(peak), 'seconds': prefix_seconds + shots * shot_seconds, 'path': 'per_shot'}
+        seconds = prefix_seconds + self.sampling_seconds['per_basis_state'] * nnz
+        if not exact:
+            seconds += self.sampling_seconds['per_shot'] * shots
+        return {'peak_bytes': int(peak), 'seconds': seconds, 'path': 'sampled'}
+
+    @classmethod
+    def calibrate(cls, qubits=range(2, 10), repeats=3):
+        """
+        Times every operation type and the sampling loops on this machine and
+        fits the model coefficients. Returns a new CostModel.
+        """
+        from scipy.optimize import nnls
+
+        def best_time(fn):
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        sim = Simulator()
+        ops = {
+            'h': ('h', 0), 'x': ('x', 0), 'y': ('y', 0), 'z': ('z', 0),
+            'custom': ('custom', 0, np.array(Operator.pauli_x, dtype=complex)),
+            'phase': ('phase', 0, 0.3), 't': ('t', 0), 's': ('s', 0),
+            'rx': ('rx', 0, 0.3), 'ry': ('ry', 0, 0.3), 'rz': ('rz', 0, 0.3),
+            'cx': ('cx', 0, 1), 'cz': ('cz', 0, 1), 'cp': ('cp', 0, 1, 0.3),
+            'swap': ('swap', 0, 1), 'measure': ('measure', 0, 0),
+        }
+        qubits = list(qubits)
+        features = np.array([[1.0, 2.0**n] for n in qubits])
+        gate_seconds = {}
+        for name, op in ops.items():
+            times = []
+            for n in qubits:
+                state = Ket(np.ones(2**n) / np.sqrt(2**n))
+                if name == 'measure':
+                    times.append(best_time(lambda: sim._measure(state, 0, n)))
+                else:
+                    times.append(best_time(lambda: sim._apply_gate(state, op, n)))
+            # Relative least squares, so large registers do not dominate the fit
+            times = np.array(times)
+            coef, _ = nnls(features / times[:, None], np.ones(len(times)))
+            gate_seconds[name] = [float(c) for c in coef]
+
+        sampling = {}
+        n = qubits[-1]
+        circuit = QuantumCircuit(n)
+        circuit.measurements = [(q, q) for q in range(n)]
+        big = best_time(lambda: sim.run(circuit, shots=1))
+        shots = best_time(lambda: sim.run(circuit, shots=2000))
+        sampling['per_shot'] = max(shots - big, 0.0) / 2000
+        sampling['per_basis_state'] = big / 2**n
+
+        collapsed = QuantumCircuit(1)
+        collapsed.measure(0, 0)
+        one = best_time(lambda: sim.run(collapsed, shots=200))
+        sampling['per_collapsed_shot'] = max(one / 200 - cls(gate_seconds)._op_seconds('measure', 1), 0.0)
+
+        return cls(gate_seconds, sampling)
+
+    def to_dict(self):
+        return {'gate_seconds': self.gate_seconds, 'sampling_seconds': self.sampling_seconds}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get('gate_seconds'), data.get('sampling_seconds'))
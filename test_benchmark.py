@@ -0,0 +1,19 @@
+import benchmark
+
+
+def test_suite_runs_on_small_grid():
+    results = benchmark.run_suite([2, 3], repeats=1, only={"ghz", "mid_circuit", "noisy_density_matrix"})
+    assert set(results) == {f"{name}/{n}" for name in ("ghz", "mid_circuit", "noisy_density_matrix") for n in (2, 3)}
+    assert all(seconds > 0 for seconds in results.values())
+
+
+def test_compare_flags_only_slowdowns_beyond_threshold():
+    baseline = {"ghz/4": 1.0, "qft/4": 1.0, "gone/4": 1.0}
+    results = {"ghz/4": 1.2, "qft/4": 1.5, "new/4": 9.0}
+    assert benchmark.compare(results, baseline, 0.25) == [("qft/4", 1.0, 1.5, 1.5)]
+
+
+if __name__ == "__main__":
+    test_suite_runs_on_small_grid()
+    test_compare_flags_only_slowdowns_beyond_threshold()
+    print("Benchmark tests passed!")
@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import quantum_lib
+import numpy as np
+
+
+def build_circuit(tail_theta):
+    circuit = quantum_lib.QuantumCircuit(3)
+    for _ in range(10):
+        circuit.h(0)
+        circuit.cx(0, 1)
+        circuit.rz(2, 0.3)
+        circuit.swap(1, 2)
+    circuit.ry(0, tail_theta)
+    return circuit
+
+
+def test_resume_matches_full_replay():
+    cache = quantum_lib.CheckpointCache()
+    sim = quantum_lib.Simulator(checkpoints=cache, checkpoint_interval=8)
+
+    first = sim._simulate_state(build_circuit(0.1))
+    assert len(cache) > 0
+
+    # Only the final gate changes, so the run resumes from the 40-op prefix
+    edited = build_circuit(0.7)
+    hashes = quantum_lib._prefix_hashes(edited)
+    start, _ = cache.longest_prefix(hashes)
+    assert start == len(edited.operations) - 1
+
+    resumed = sim._simulate_state(edited)
+    expected = quantum_lib.Simulator()._simulate_state(edited)
+    assert np.allclose(resumed.coef, expected.coef)
+    assert not np.allclose(first.coef, resumed.coef)
+
+
+def test_returned_state_cannot_corrupt_cache():
+    cache = quantum_lib.CheckpointCache()
+    sim = quantum_lib.Simulator(checkpoints=cache)
+    circuit = build_circuit(0.1)
+    state = sim._simulate_state(circuit)
+    expected = state.coef.copy()
+    try:
+        state.coef[0] = 7
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("cached state was writable")
+    assert np.array_equal(sim._simulate_state(circuit).coef, expected)
+
+
+def test_cache_evicts_by_size():
+    cache = quantum_lib.CheckpointCache(max_bytes=3 * 8 * 16)
+    for i in range(5):
+        cache.put(bytes([i]), np.zeros(8, dtype=complex))
+    assert len(cache) == 3
+    assert cache.total_bytes <= cache.max_bytes
+    assert cache.longest_prefix([b'', bytes([0])]) == (0, None)
+
+
+def test_shots_reuse_prefix():
+    cache = quantum_lib.CheckpointCache()
+    circuit = quantum_lib.QuantumCircuit(1)
+    circuit.h(0)
+    circuit.measure(0, 0)
+    circuit.h(0)
+    circuit.measure(0, 0)
+
+    counts = quantum_lib.Simulator(checkpoints=cache).run(circuit, shots=200)
+    assert sum(counts.values()) == 200
+    assert cache.misses == 1
+
+
+def test_disk_checkpoints_survive_restart():
+    with tempfile.TemporaryDirectory() as directory:
+        disk = quantum_lib.DiskCheckpointCache(directory, min_bytes=0)
+        sim = quantum_lib.Simulator(checkpoints=quantum_lib.CheckpointCache(disk=disk), checkpoint_interval=8)
+        sim._simulate_state(build_circuit(0.1))
+        assert len(disk) > 0
+
+        # A fresh process: empty memory tier, same directory
+        cache = quantum_lib.CheckpointCache(disk=quantum_lib.DiskCheckpointCache(directory, min_bytes=0))
+        edited = build_circuit(0.7)
+        hashes = quantum_lib._prefix_hashes(edited)
+        start, coef = cache.longest_prefix(hashes)
+        assert start == len(edited.operations) - 1
+        assert isinstance(coef, np.memmap)
+        assert cache.disk.metadata(hashes[start])['position'] == start
+
+        # The run evolves the mapped file, it does not load a copy first
+        sim = quantum_lib.Simulator(checkpoints=cache)
+        state, _ = sim._prefix_state(build_circuit(0.1))
+        assert isinstance(state.coef, np.memmap)
+
+        resumed = sim._simulate_state(edited)
+        expected = quantum_lib.Simulator()._simulate_state(edited)
+        assert np.allclose(resumed.coef, expected.coef)
+
+
+def test_disk_tier_takes_only_large_statevectors():
+    with tempfile.TemporaryDirectory() as directory:
+        disk = quantum_lib.DiskCheckpointCache(directory, min_bytes=16 * 8)
+        cache = quantum_lib.CheckpointCache(disk=disk)
+        cache.put(b'small', np.zeros(4, dtype=complex), position=1)
+        cache.put(b'marginal', np.zeros(8, dtype=complex))
+        cache.put(b'state', np.zeros(8, dtype=complex), position=1)
+        assert len(cache) == 3
+        assert b'state' in disk and len(disk) == 1
+
+
+def test_disk_checkpoint_checksum_and_cap():
+    with tempfile.TemporaryDirectory() as directory:
+        disk = quantum_lib.DiskCheckpointCache(directory, max_bytes=3 * (8 * 16 + 128), min_bytes=0, verify=True)
+        for i in range(5):
+            disk.put(bytes([i]), np.full(8, i, dtype=complex), position=i)
+            os.utime(os.path.join(directory, bytes([i]).hex() + '.npy'), (i, i))
+        assert len(disk) == 3
+        assert disk.total_bytes <= disk.max_bytes
+        assert bytes([0]) not in disk and bytes([4]) in disk
+        assert np.array_equal(disk.get(bytes([4])), np.full(8, 4))
+
+        # A corrupted file fails its checksum and is dropped
+        with open(os.path.join(directory, bytes([3]).hex() + '.npy'), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'\x01')
+        assert disk.get(bytes([3])) is None
+        assert bytes([3]) not in disk
+
+
+if __name__ == "__main__":
+    test_resume_matches_full_replay()
+    test_returned_state_cannot_corrupt_cache()
+    test_cache_evicts_by_size()
+    test_shots_reuse_prefix()
+    test_disk_checkpoints_survive_restart()
+    test_disk_tier_takes_only_large_statevectors()
+    test_disk_checkpoint_checksum_and_cap()
+    print("Checkpoint tests passed")
@@ -0,0 +1,46 @@
+import numpy as np
+
+import quantum_lib
+from benchmark import random_layers
+
+
+def expectation(circuit, matrix):
+    psi = quantum_lib.Simulator().statevector(circuit).coef
+    return np.vdot(psi, matrix @ psi).real
+
+
+def test_adjoint_gradient_matches_finite_differences():
+    n = 4
+    circuit = random_layers(n, depth=3, seed=3)
+    circuit.cp(0, 2, 0.3)
+    circuit.phase(3, 1.2)
+    circuit.s(1)
+    circuit.custom([1, 3], np.linalg.qr(np.random.default_rng(2).normal(size=(4, 4)))[0])
+    observable = {'ZZII': 1.0, 'IXIY': 0.5, 'YIIZ': -0.3}
+
+    value, gradients = quantum_lib.Simulator().expectation_gradient(circuit, observable)
+    paulis = {'I': np.eye(2), 'X': np.array([[0, 1], [1, 0]]), 'Y': np.array([[0, -1j], [1j, 0]]), 'Z': np.diag([1, -1])}
+    matrix = sum(c * np.kron(np.kron(paulis[l[0]], paulis[l[1]]), np.kron(paulis[l[2]], paulis[l[3]]))
+                 for l, c in observable.items())
+    assert np.isclose(value, expectation(circuit, matrix))
+
+    positions = [i for i, op in enumerate(circuit.operations) if op[0] in ('rx', 'ry', 'rz', 'phase', 'cp')]
+    assert len(gradients) == len(positions)
+    eps = 1e-6
+    for g, i in zip(gradients, positions):
+        shifted = []
+        for sign in (1, -1):
+            c = quantum_lib.QuantumCircuit(n)
+            c.operations = list(circuit.operations)
+            c.operations[i] = c.operations[i][:-1] + (c.operations[i][-1] + sign * eps,)
+            shifted.append(expectation(c, matrix))
+        assert np.isclose(g, (shifted[0] - shifted[1]) / (2 * eps), atol=1e-6)
+
+    # An Operator observable gives the same result
+    value2, gradients2 = quantum_lib.Simulator().expectation_gradient(circuit, quantum_lib.Operator(matrix))
+    assert np.isclose(value, value2) and np.allclose(gradients, gradients2)
+
+
+if __name__ == "__main__":
+    test_adjoint_gradient_matches_finite_differences()
+    print("Gradient tests passed!")
@@ -0,0 +1,89 @@
+import numpy as np
+
+import quantum_lib
+from test_sparse import random_circuit
+
+
+def test_layers_are_disjoint_and_preserve_order():
+    circuit = random_circuit(6, 60)
+    layers = quantum_lib._gate_layers(circuit.operations)
+    assert sum(len(layer) for layer in layers) == len(circuit.operations)
+    for layer in layers:
+        qubits = [q for op in layer for q in quantum_lib._op_qubits(op)]
+        assert len(qubits) == len(set(qubits))
+
+    # Operations on each qubit keep their relative order
+    scheduled = [op for layer in layers for op in layer]
+    for q in range(6):
+        on_q = [op for op in circuit.operations if q in quantum_lib._op_qubits(op)]
+        assert [op for op in scheduled if q in quantum_lib._op_qubits(op)] == on_q
+
+
+def test_tiled_layers_match_gate_by_gate():
+    n = quantum_lib._TILE_QUBITS + 2
+    circuit = random_circuit(n, 80)
+    for q in range(n):
+        circuit.h(q)
+    sim = quantum_lib.Simulator()
+    state = sim.statevector(circuit)
+    assert sim.gates_applied == len(circuit.operations)
+
+    reference = quantum_lib.Simulator()
+    coef = np.zeros(2 ** n, dtype=complex)
+    coef[0] = 1
+    for op in circuit.operations:
+        coef = reference._apply_kernel(coef, op, n)
+    assert np.allclose(state.coef, coef)
+
+
+def test_non_gate_operations_are_not_counted():
+    n = quantum_lib._TILE_QUBITS + 1
+    circuit = quantum_lib.QuantumCircuit(n)
+    circuit.operations = [('h', q) for q in range(n)] + [('barrier', 0)]
+    profiler = quantum_lib.Profiler()
+    sim = quantum_lib.Simulator(profiler=profiler)
+    sim.statevector(circuit)
+    assert sim.gates_applied == n
+    assert sim._apply_kernel(np.ones(2), ('barrier', 0), 1).tolist() == [1, 1]
+    assert sim.gates_applied == n
+    assert all(row['op'] != 'barrier' for row in profiler.summary())
+
+
+def test_swaps_relabel_instead_of_moving_amplitudes():
+    n = 5
+    circuit = quantum_lib.QuantumCircuit(n)
+    for q in range(n):
+        circuit.ry(q, 0.3 * (q + 1))
+    for q in range(n - 1):
+        circuit.swap(q, q + 1)  # routing chain: qubit 0 ends up on qubit n-1
+    circuit.cx(n - 1, 0)
+    circuit.swap(2, 1)
+    circuit.rz(1, 0.5)
+
+    profiler = quantum_lib.Profiler()
+    sim = quantum_lib.Simulator(profiler=profiler)
+    state = sim.statevector(circuit)
+    assert sim.gates_applied == len(circuit.operations)
+    rows = {(row['phase'], row['op']): row for row in profiler.summary()}
+    assert ('apply', 'swap') not in rows and rows[('apply', 'relabel')]['calls'] == 1
+
+    reference = quantum_lib.Simulator()
+    coef = np.zeros(2 ** n, dtype=complex)
+    coef[0] = 1
+    for op in circuit.operations:
+        coef = reference._apply_kernel(coef, op, n)
+    assert np.allclose(state.coef, coef)
+
+    # Measurements index the resolved state
+    circuit.measure(n - 1, 0)
+    counts = sim.run(circuit, shots=2000)
+    p1 = np.sum(np.abs(coef.reshape(2, -1)[1]) ** 2)
+    assert abs(counts.get('1', 0) / 2000 - p1) < 0.05
+
+
+if __name__ == "__main__":
+    test_layers_are_disjoint_and_preserve_order()
+    test_tiled_layers_match_gate_by_gate()
+    test_non_gate_operations_are_not_counted()
+    test_swaps_relabel_instead_of_moving_amplitudes()
+    print("Layer tests passed")
@@ -0,0 +1,158 @@
+import numpy as np
+
+import quantum_lib
+
+rng = np.random.default_rng(7)
+
+
+def random_matrix(d):
+    return rng.normal(size=(d, d)) + 1j * rng.normal(size=(d, d))
+
+
+def test_tensor_is_lazy_and_matches_kron():
+    a, b = random_matrix(2), random_matrix(32)
+    op = quantum_lib.Operator(a).tensor(quantum_lib.Operator(quantum_lib.Operator.identity), quantum_lib.Operator(b))
+    assert isinstance(op, quantum_lib.KronOperator)
+    assert [f.shape for f in op.factors] == [(2, 2), (2, 2), (32, 32)]
+
+    vec = rng.normal(size=128) + 1j * rng.normal(size=128)
+    result = op.op(quantum_lib.Ket(vec)).coef
+    assert op._matrix is None  # applying never built the 128x128 matrix
+    dense = np.kron(np.kron(a, np.eye(2)), b)
+    assert np.allclose(result, dense @ vec)
+    assert np.allclose(op.matrix, dense)
+    assert np.allclose(op.dagger().matrix, dense.conj().T)
+
+
+def test_matmul_aligns_factor_boundaries():
+    left = quantum_lib.Operator(random_matrix(2)).tensor(quantum_lib.Operator(random_matrix(2)), quantum_lib.Operator(random_matrix(4)))
+    right = quantum_lib.Operator(random_matrix(4)).tensor(quantum_lib.Operator(random_matrix(2)), quantum_lib.Operator(random_matrix(2)))
+    product = left @ right
+    assert isinstance(product, quantum_lib.KronOperator)
+    assert [f.shape for f in product.factors] == [(4, 4), (4, 4)]
+    assert np.allclose(product.matrix, left.matrix @ right.matrix)
+
+    dense = quantum_lib.Operator(random_matrix(16))
+    assert np.allclose((left @ dense).matrix, left.matrix @ dense.matrix)
+    assert np.allclose((dense @ left).matrix, dense.matrix @ left.matrix)
+
+
+def test_density_matrix_evolution_and_channels():
+    n = 3
+    vec = rng.normal(size=2**n) + 1j * rng.normal(size=2**n)
+    vec /= np.linalg.norm(vec)
+    rho = quantum_lib.DensityMatrix(np.outer(vec, vec.conj()))
+
+    gate = quantum_lib.Operator.ry(1, 0.4, n)
+    expected = gate.matrix @ rho.matrix @ gate.matrix.conj().T
+    assert np.allclose(rho.evolve(gate).matrix, expected)
+    assert np.allclose(gate.op(rho).matrix, expected)
+
+    identity = quantum_lib.Operator(np.eye(4))
+    kraus = quantum_lib.QuantumChannel.amplitude_damping(0.3).kraus_operators
+    channel = quantum_lib.QuantumChannel([identity.tensor(K) for K in kraus])
+    dense = sum(np.kron(np.eye(4), K.matrix) @ rho.matrix @ np.kron(np.eye(4), K.matrix).conj().T for K in kraus)
+    assert np.allclose(channel.apply(rho).matrix, dense)
+
+
+def test_structured_gates_match_dense_definitions():
+    n = 3
+    cnot = quantum_lib.Operator.cnot(0, 2, n)
+    assert isinstance(cnot, quantum_lib.PermutationOperator)
+    for index in range(2**n):
+        expected = index ^ 4 if index & 1 else index
+        assert cnot.matrix[expected, index] == 1
+
+    swap = quantum_lib.Operator.swap(0, 2, n)
+    assert isinstance(swap, quantum_lib.PermutationOperator)
+    assert swap.unitary() and swap.hermitian()
+    assert list(swap.perm) == [0, 4, 2, 6, 1, 5, 3, 7]
+
+    cz = quantum_lib.Operator.cz(1, 2, n)
+    assert isinstance(cz, quantum_lib.DiagonalOperator)
+    assert list(cz.diagonal.real) == [1, 1, 1, 1, 1, 1, -1, -1]
+    cp = quantum_lib.Operator.cp(0, 1, 0.3, n)
+    assert np.allclose(cp.diagonal, [1, 1, 1, np.exp(0.3j), 1, 1, 1, np.exp(0.3j)])
+    phase = quantum_lib.Operator.phase(2, 0.7, n)
+    assert np.allclose(phase.diagonal, [1] * 4 + [np.exp(0.7j)] * 4)
+    assert cp.unitary() and not quantum_lib.DiagonalOperator([1, 2]).unitary()
+
+
+def test_structured_products_stay_closed_form():
+    n = 4
+    a, b = quantum_lib.Operator.cnot(0, 3, n), quantum_lib.Operator.swap(1, 2, n)
+    product = a @ b
+    assert isinstance(product, quantum_lib.PermutationOperator)
+    assert np.allclose(product.matrix, a.matrix @ b.matrix)
+    assert np.allclose(a.dagger().matrix, a.matrix.conj().T)
+
+    c, d = quantum_lib.Operator.cp(0, 1, 0.2, n), quantum_lib.Operator.phase(3, 1.1, n)
+    assert isinstance(c @ d, quantum_lib.DiagonalOperator)
+    assert np.allclose((c @ d).matrix, c.matrix @ d.matrix)
+
+    dense = quantum_lib.Operator(random_matrix(2**n))
+    for op in (a, c):
+        assert np.allclose((op @ dense).matrix, op.matrix @ dense.matrix)
+        assert np.allclose((dense @ op).matrix, dense.matrix @ op.matrix)
+        vec = rng.normal(size=2**n)
+        assert np.allclose(op.op(quantum_lib.Ket(vec)).coef, op.matrix @ vec)
+
+
+def random_unitary(d):
+    q, r = np.linalg.qr(random_matrix(d))
+    return q * (np.diag(r) / np.abs(np.diag(r)))
+
+
+def test_subsystem_gate_matches_dense_embedding():
+    n, qubits = 5, (3, 0, 2)
+    gate = random_unitary(8)
+    op = quantum_lib.SubsystemOperator(gate, qubits, n)
+
+    # Dense reference: bit j of the gate index is qubits[j], bit q of the register index is qubit q
+    dense = np.zeros((2**n, 2**n), dtype=complex)
+    for col in range(2**n):
+        sub_col = sum(((col >> q) & 1) << j for j, q in enumerate(qubits))
+        rest = col & ~sum(1 << q for q in qubits)
+        for sub_row in range(8):
+            row = rest | sum(((sub_row >> j) & 1) << q for j, q in enumerate(qubits))
+            dense[row, col] = gate[sub_row, sub_col]
+
+    batch = rng.normal(size=(2**n, 3)) + 1j * rng.normal(size=(2**n, 3))
+    assert np.allclose(op._apply(batch), dense @ batch)
+    assert np.allclose(op.matrix, dense)
+    assert np.allclose(op.dagger().matrix, dense.conj().T)
+    assert op.unitary()
+
+
+def test_multi_qubit_custom_gate_runs_as_one_operation():
+    gate = random_unitary(4)
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.custom([2, 0], gate)
+    circuit.custom([2, 0], gate.copy())  # same matrix, validated once
+
+    sim = quantum_lib.Simulator()
+    state = sim.statevector(circuit).coef
+    assert sim.gates_applied == 3
+    expected = np.array([1, 1, 0, 0, 0, 0, 0, 0]) / np.sqrt(2)
+    dense = quantum_lib.SubsystemOperator(gate, (2, 0), 3).matrix
+    assert np.allclose(state, dense @ dense @ expected)
+    assert circuit.operations[1][2] is circuit.operations[2][2]
+
+    for qubits, matrix in (([0, 1], np.eye(2)), ([0, 0], np.eye(4)), ([0, 3], np.eye(4)), ([0, 1], 2 * np.eye(4))):
+        try:
+            circuit.custom(qubits, matrix)
+        except ValueError:
+            continue
+        raise AssertionError(f"custom({qubits}, ...) should have been rejected")
+
+
+if __name__ == "__main__":
+    test_tensor_is_lazy_and_matches_kron()
+    test_matmul_aligns_factor_boundaries()
+    test_density_matrix_evolution_and_channels()
+    test_structured_gates_match_dense_definitions()
+    test_structured_products_stay_closed_form()
+    test_subsystem_gate_matches_dense_embedding()
+    test_multi_qubit_custom_gate_runs_as_one_operation()
+    print("Operator tests passed!")
@@ -0,0 +1,92 @@
+import json
+import threading
+import tracemalloc
+
+import quantum_lib
+
+
+def build_circuit():
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.measure(0, 0)
+    circuit.rx(0, 0.4)
+    circuit.measure(1, 1)
+    circuit.measure(0, 2)
+    return circuit
+
+
+def test_profiler_records_phases_per_operation():
+    profiler = quantum_lib.Profiler()
+    sim = quantum_lib.Simulator(profiler=profiler)
+    sim.run(build_circuit(), shots=20)
+
+    rows = {(row['phase'], row['op']): row for row in profiler.summary()}
+    assert rows[('build', 'h')]['calls'] == 1
+    assert rows[('apply', 'cx')]['calls'] == 1
+    # rx follows a mid-circuit measurement, so it is replayed for every shot;
+    # the terminal measurements are sampled from the final state
+    assert rows[('apply', 'rx')]['calls'] == 20
+    assert rows[('measure', 'measure')]['calls'] == 20
+    assert rows[('sample', 'counts')]['calls'] == 20
+    assert all(row['seconds'] >= 0 and row['bytes'] >= 0 for row in rows.values())
+    assert 'apply' in profiler.summary_table()
+
+
+def test_chrome_trace_is_capped_and_serializable():
+    profiler = quantum_lib.Profiler(track_memory=False, max_events=5)
+    quantum_lib.Simulator(profiler=profiler).run(build_circuit(), shots=20)
+
+    trace = json.loads(json.dumps(profiler.chrome_trace()))
+    assert len(trace['traceEvents']) == 5
+    event = trace['traceEvents'][0]
+    assert event['ph'] == 'X' and event['dur'] >= 0 and 'bytes' in event['args']
+    # The summary still covers every event
+    assert sum(row['calls'] for row in profiler.summary()) > 5
+
+
+def test_concurrent_profiled_runs_share_tracing():
+    errors = []
+
+    def run():
+        try:
+            profiler = quantum_lib.Profiler()
+            quantum_lib.Simulator(profiler=profiler).run(build_circuit(), shots=50)
+            assert profiler.summary()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert not errors and not any(thread.is_alive() for thread in threads)
+    assert not tracemalloc.is_tracing()
+
+    # A run failing inside a span leaves no span open for the next one
+    circuit = quantum_lib.QuantumCircuit(1)
+    circuit.cx(0, 0)
+    circuit.measure(0, 0)
+    try:
+        quantum_lib.Simulator(profiler=quantum_lib.Profiler()).run(circuit, shots=1)
+    except ValueError:
+        pass
+    acquired = []
+
+    def try_span():
+        acquired.append(quantum_lib._memory_span_lock.acquire(blocking=False))
+        if acquired[-1]:
+            quantum_lib._memory_span_lock.release()
+
+    thread = threading.Thread(target=try_span)
+    thread.start()
+    thread.join()
+    assert acquired == [True]
+
+
+if __name__ == "__main__":
+    test_profiler_records_phases_per_operation()
+    test_chrome_trace_is_capped_and_serializable()
+    test_concurrent_profiled_runs_share_tracing()
+    print("All profiler tests passed!")
@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+import quantum_lib
+
+PROGRAM = """OPENQASM 2.0;
+include "qelib1.inc";
+// two registers are flattened in declaration order
+qreg q[2];
+qreg anc[1];
+creg c[3];
+h q[0]; cx q[0],q[1];
+rx(-pi/2) anc[0];
+u3(0.3, 0.2, 0.1) q[1];
+cu1(pi/4) q[0],
+    anc[0];
+measure q[0] -> c[1];
+measure q[1] -> c[0];
+measure anc[0] -> c[2];
+"""
+
+
+def test_openqasm_roundtrip():
+    circuit = quantum_lib.parse_qasm(io.StringIO(PROGRAM))
+    assert circuit.num_qubits == 3
+    assert circuit.operations[:3] == [('h', 0), ('cx', 0, 1), ('rx', 2, -np.pi / 2)]
+    assert circuit.measurements == [(0, 1), (1, 0), (2, 2)]
+
+    reparsed = quantum_lib.parse_qasm("\n".join(quantum_lib.dump_qasm(circuit)))
+    sim = quantum_lib.Simulator()
+    overlap = np.vdot(sim.statevector(circuit).coef, sim.statevector(reparsed).coef)
+    assert np.isclose(abs(overlap), 1.0)
+
+
+def test_qasm_lite_matches_app_syntax():
+    text = "H 0\nCX 0 1\nRX 2 1.57\nCP 0 1 0.5\nMEASURE 1\nMEASURE 0 3\n"
+    circuit = quantum_lib.parse_qasm(text.encode().splitlines(keepends=True))
+    assert circuit.num_qubits == 3
+    assert circuit.measurements == [(1, 1), (0, 3)]
+    assert "\n".join(quantum_lib.dump_qasm(circuit, lite=True)) + "\n" == text
+
+
+def test_parse_errors_name_the_line():
+    for program, message in [
+        ("H 0\nFOO 1\n", "line 2"),
+        ("H 0\nH 4\n", "out of range"),
+        ("OPENQASM 2.0;\nqreg q[1];\nh q[1];\n", "line 3"),
+        ("OPENQASM 2.0;\nqreg q[1];\nrx(__import__) q[0];\n", "Unsupported parameter"),
+        ("OPENQASM 2.0;\nqreg q[1];\nrx(1/0) q[0];\n", "line 3"),
+        ("OPENQASM 2.0;\nqreg q[1];\nrx(9**9**9) q[0];\n", "line 3"),
+        ("OPENQASM 2.0;\nqreg q[1];\nrx((-1)**0.5) q[0];\n", "line 3"),
+        ("OPENQASM 2.0;\nqreg q[2];\ncreg c[2];\nmeasure q -> c[0];\n", "cannot mix"),
+        ("OPENQASM 2.0;\nqreg q[2];\ncreg c[1];\nmeasure q -> c;\n", "sizes do not match"),
+        ("H 0\n" * 10, "exceeds 5 operations"),
+    ]:
+        try:
+            quantum_lib.parse_qasm(program, num_qubits=2, max_ops=5)
+            assert False, program
+        except ValueError as e:
+            assert message in str(e), (program, e)
+
+
+if __name__ == "__main__":
+    test_openqasm_roundtrip()
+    test_qasm_lite_matches_app_syntax()
+    test_parse_errors_name_the_line()
+    print("QASM tests passed")
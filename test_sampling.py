@@ -0,0 +1,187 @@
+import numpy as np
+
+import quantum_lib
+
+
+def test_marginal_matches_full_distribution():
+    sim = quantum_lib.Simulator()
+    circuit = quantum_lib.QuantumCircuit(4)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.x(3)
+    circuit.ry(2, 0.7)
+    coef = sim._simulate_state(circuit).coef
+    full = np.abs(coef) ** 2
+
+    # Qubits 3 and 1 (highest first): marginal index bit 1 is q3, bit 0 is q1
+    marginal = sim._marginal(coef, [3, 1], 4)
+    expected = np.zeros(4)
+    for index, p in enumerate(full):
+        expected[((index >> 3) & 1) << 1 | ((index >> 1) & 1)] += p
+    assert np.allclose(marginal, expected)
+
+
+def test_sampled_counts_map_qubits_to_cbits():
+    circuit = quantum_lib.QuantumCircuit(4)
+    circuit.x(3)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    # q3 -> c0 and q1 -> c4; q0 and q2 are never read
+    circuit.measurements = [(3, 0), (1, 4)]
+    counts = quantum_lib.Simulator().run(circuit, shots=2000)
+    assert set(counts) == {'00001', '10001'}
+    assert sum(counts.values()) == 2000
+    assert 800 < counts['10001'] < 1200
+
+
+def test_marginal_is_reused_from_cache():
+    cache = quantum_lib.CheckpointCache()
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.cx(0, 2)
+    circuit.measurements = [(0, 0), (2, 1)]
+
+    first = quantum_lib.Simulator(checkpoints=cache)
+    first.run(circuit, shots=100)
+    second = quantum_lib.Simulator(checkpoints=cache)
+    counts = second.run(circuit, shots=100)
+    assert first.gates_applied == 2 and second.gates_applied == 0
+    assert set(counts) <= {'00', '11'} and sum(counts.values()) == 100
+
+
+def test_terminal_measurements_are_deferred():
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.measure(0, 0)
+    circuit.h(1)
+    circuit.cx(1, 2)
+    circuit.measure(1, 1)
+    circuit.measure(2, 2)
+    body, terminal = quantum_lib._split_terminal_measurements(circuit)
+    assert terminal == [(0, 0), (1, 1), (2, 2)]
+    assert [op[0] for op in body.operations] == ['h', 'h', 'cx']
+
+    sim = quantum_lib.Simulator()
+    counts = sim.run(circuit, shots=500)
+    # One simulation for all shots instead of one per shot
+    assert sim.gates_applied == 3
+    assert set(counts) <= {'000', '001', '110', '111'} and sum(counts.values()) == 500
+
+
+def test_mid_circuit_collapse_keeps_per_shot_path():
+    circuit = quantum_lib.QuantumCircuit(2)
+    circuit.h(0)
+    circuit.measure(0, 0)
+    circuit.h(0)
+    circuit.x(1)
+    circuit.measure(0, 1)
+    circuit.measure(1, 0)  # overwrites c0, so the first measurement stays in place
+    body, terminal = quantum_lib._split_terminal_measurements(circuit)
+    assert terminal == [(0, 1), (1, 0)]
+    assert [op[0] for op in body.operations] == ['h', 'measure', 'h', 'x']
+
+    sim = quantum_lib.Simulator()
+    counts = sim.run(circuit, shots=400)
+    assert set(counts) == {'01', '11'}
+    assert 120 < counts['11'] < 280
+    assert sim.gates_applied == 1 + 2 * 400
+
+
+def test_light_cone_prunes_unmeasured_qubits():
+    circuit = quantum_lib.QuantumCircuit(5)
+    circuit.h(0)
+    circuit.cx(0, 2)
+    circuit.h(1)          # never measured
+    circuit.cx(1, 3)      # never measured
+    circuit.x(4)
+    circuit.measure(0, 0)
+    circuit.h(0)          # after the last measurement of qubit 0
+    circuit.measure(2, 1)
+    circuit.measure(4, 2)
+
+    reduced, dropped = quantum_lib._light_cone(circuit)
+    assert reduced.num_qubits == 3
+    assert dropped == 3
+    assert [op[0] for op in reduced.operations] == ['h', 'cx', 'x', 'measure', 'measure', 'measure']
+
+    sim = quantum_lib.Simulator()
+    counts = sim.run(circuit, shots=400)
+    assert set(counts) == {'100', '111'}
+    assert 120 < counts['111'] < 280
+    assert sim.operations_pruned == 3
+    assert sim.qubits_pruned == 2
+
+
+def test_planned_gates_match_applied_gates():
+    circuit = quantum_lib.QuantumCircuit(4)
+    circuit.h(0)
+    circuit.h(3)          # never measured
+    circuit.measure(0, 0)
+    circuit.cx(0, 1)
+    circuit.swap(1, 2)
+    circuit.measure(2, 1)
+    for shots in (1, 37):
+        sim = quantum_lib.Simulator()
+        sim.run(circuit, shots=shots)
+        assert sim.gates_applied == quantum_lib._planned_gates(circuit, shots) == 1 + 2 * shots
+
+
+def test_light_cone_rejects_out_of_range_qubits():
+    circuit = quantum_lib.QuantumCircuit(2)
+    circuit.h(5)
+    circuit.measure(5, 0)
+    try:
+        quantum_lib.Simulator().run(circuit, shots=10)
+    except ValueError as e:
+        assert "qubit 5" in str(e)
+    else:
+        raise AssertionError("out-of-range qubit was simulated")
+
+
+def test_exact_probabilities_match_statevector():
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.ry(2, 0.7)
+    circuit.measure(2, 0)
+    circuit.measure(0, 1)
+
+    sim = quantum_lib.Simulator()
+    probs = sim.probabilities(circuit)
+    p1 = np.sin(0.35) ** 2
+    expected = {'00': 0.5 * (1 - p1), '10': 0.5 * (1 - p1), '01': 0.5 * p1, '11': 0.5 * p1}
+    assert list(probs) == ['00', '10', '01', '11']  # most probable first
+    assert all(np.isclose(probs[k], v) for k, v in expected.items())
+    assert sim.shots_done == 0
+
+    assert list(sim.probabilities(circuit, top_k=1)) == ['00']
+    assert set(sim.probabilities(circuit, threshold=0.1)) == {'00', '10'}
+
+
+def test_exact_probabilities_branch_on_mid_circuit_measurements():
+    circuit = quantum_lib.QuantumCircuit(2)
+    circuit.h(0)
+    circuit.measure(0, 0)
+    circuit.h(0)
+    circuit.x(1)
+    circuit.measure(0, 1)
+    circuit.measure(1, 2)
+
+    # c0 is a fair coin; H after the collapse makes c1 a second one
+    probs = quantum_lib.Simulator().probabilities(circuit)
+    assert set(probs) == {'100', '101', '110', '111'}
+    assert np.allclose(list(probs.values()), 0.25)
+
+
+if __name__ == "__main__":
+    test_marginal_matches_full_distribution()
+    test_sampled_counts_map_qubits_to_cbits()
+    test_marginal_is_reused_from_cache()
+    test_terminal_measurements_are_deferred()
+    test_mid_circuit_collapse_keeps_per_shot_path()
+    test_light_cone_prunes_unmeasured_qubits()
+    test_planned_gates_match_applied_gates()
+    test_light_cone_rejects_out_of_range_qubits()
+    test_exact_probabilities_match_statevector()
+    test_exact_probabilities_branch_on_mid_circuit_measurements()
+    print("Sampling tests passed!")
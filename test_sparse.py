@@ -0,0 +1,65 @@
+import numpy as np
+
+import quantum_lib
+
+rng = np.random.default_rng(11)
+
+
+def random_circuit(n, depth):
+    circuit = quantum_lib.QuantumCircuit(n)
+    for _ in range(depth):
+        q, r = rng.choice(n, size=2, replace=False)
+        name = rng.choice(['h', 'x', 'y', 's', 't', 'rx', 'rz', 'cx', 'cz', 'cp', 'swap'])
+        if name in ('cx', 'cz', 'swap'):
+            getattr(circuit, name)(q, r)
+        elif name == 'cp':
+            circuit.cp(q, r, rng.uniform(0, np.pi))
+        elif name in ('rx', 'rz'):
+            getattr(circuit, name)(q, rng.uniform(0, np.pi))
+        else:
+            getattr(circuit, name)(q)
+    return circuit
+
+
+def test_sparse_state_matches_dense():
+    for seed in range(5):
+        circuit = random_circuit(5, 30)
+        state = quantum_lib.SparseState(5)
+        for op in circuit.operations:
+            state = state.apply(op)
+        assert np.allclose(state.to_dense(), quantum_lib.Simulator().statevector(circuit).coef)
+
+    # Once dense enough, the sparse run continues on a dense statevector
+    for q in range(5):
+        circuit.measure(q, q)
+    sparse = quantum_lib.Simulator(method='sparse')
+    probs = sparse.probabilities(circuit)
+    dense = quantum_lib.Simulator().probabilities(circuit)
+    assert probs.keys() == dense.keys()
+    assert np.allclose(list(probs.values()), [dense[k] for k in probs])
+
+
+def test_large_sparse_circuits_run():
+    n = 60
+    circuit = quantum_lib.QuantumCircuit(n)
+    circuit.h(0)
+    for q in range(n - 1):
+        circuit.cx(q, q + 1)
+    circuit.x(n - 1)
+    circuit.measure(0, 0)       # collapses the GHZ state mid-circuit
+    circuit.cx(0, 1)
+    for q in range(n):
+        circuit.measure(q, q)
+
+    sim = quantum_lib.Simulator(method='sparse')
+    counts = sim.run(circuit, shots=200)
+    # q0 = 0: only the flipped last qubit is set; q0 = 1: cx clears qubit 1
+    assert set(counts) == {'1' + '0' * (n - 1), '0' + '1' * (n - 3) + '01'}
+    assert sum(counts.values()) == 200
+    assert sim.peak_state_bytes < 1024
+
+
+if __name__ == "__main__":
+    test_sparse_state_matches_dense()
+    test_large_sparse_circuits_run()
+    print("Sparse tests passed!")
@@ -0,0 +1,64 @@
+import numpy as np
+
+import quantum_lib
+
+
+def build_circuit():
+    circuit = quantum_lib.QuantumCircuit(3)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    circuit.rx(2, 0.3)
+    circuit.cp(1, 2, 0.7)
+    circuit.swap(0, 2)
+    circuit.measure(1, 1)
+    circuit.t(1)
+    return circuit
+
+
+def dense_unitary(circuit):
+    n = circuit.num_qubits
+    H = quantum_lib.Operator((1 / np.sqrt(2)) * np.array([[1, 1], [1, -1]]))
+    gates = [
+        quantum_lib.Operator(np.eye(4)).tensor(H),
+        quantum_lib.Operator.cnot(0, 1, n),
+        quantum_lib.Operator.rx(2, 0.3, n),
+        quantum_lib.Operator.cp(1, 2, 0.7, n),
+        quantum_lib.Operator.swap(0, 2, n),
+        quantum_lib.Operator.t_gate(1, n),
+    ]
+    result = np.eye(2**n)
+    for gate in gates:
+        result = gate.matrix @ result
+    return result
+
+
+def test_unitary_matches_gate_product():
+    circuit = build_circuit()
+    sim = quantum_lib.Simulator()
+    u = sim.unitary(circuit)
+    assert u.shape == (8, 8)
+    assert np.allclose(u, dense_unitary(circuit))
+    assert np.allclose(u.conj().T @ u, np.eye(8))
+    # Column 0 is the circuit applied to |000>
+    assert np.allclose(u[:, 0], sim.statevector(circuit).coef)
+
+
+def test_selected_columns_and_cache():
+    circuit = build_circuit()
+    cache = quantum_lib.CheckpointCache()
+    sim = quantum_lib.Simulator(checkpoints=cache)
+    part = sim.unitary(circuit, columns=[5, 2])
+    assert part.shape == (8, 2)
+    assert np.allclose(part, dense_unitary(circuit)[:, [5, 2]])
+    assert sim.gates_applied == 6
+
+    again = sim.unitary(circuit, columns=[5, 2])
+    assert sim.gates_applied == 0 and sim.checkpoint_hits == 1
+    again[0, 0] = 99  # callers get their own copy
+    assert np.allclose(sim.unitary(circuit, columns=[5, 2]), part)
+
+
+if __name__ == "__main__":
+    test_unitary_matches_gate_product()
+    test_selected_columns_and_cache()
+    print("Unitary tests passed!")